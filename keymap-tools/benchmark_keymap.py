@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Benchmark the process_keymap.py stages on synthetic ZMK configs.
+
+Generates configs in the style of ../config (layers, combos, hold-tap and
+mod-morph behaviors, nested includes and plain defines) at configurable
+sizes, times every stage separately and writes the results as JSON so runs
+can be compared.
+
+    python3 benchmark_keymap.py --sizes small,medium,large -o bench.json
+    python3 benchmark_keymap.py --layers 20 --combos 400 --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import keymap_pipeline as pk
+
+SIZE_PRESETS = {
+    'small': {'layers': 4, 'combos': 20, 'behaviors': 10, 'include_depth': 2, 'defines': 50},
+    'medium': {'layers': 10, 'combos': 100, 'behaviors': 40, 'include_depth': 4, 'defines': 300},
+    'large': {'layers': 24, 'combos': 500, 'behaviors': 150, 'include_depth': 8, 'defines': 2000},
+    'huge': {'layers': 48, 'combos': 2000, 'behaviors': 600, 'include_depth': 16, 'defines': 10000},
+}
+
+# Sofle key labels in position order, matching zmk-helpers key-labels/sofle.h
+SOFLE_KEY_LABELS = (
+    [f"LN{i}" for i in range(5, -1, -1)] + [f"RN{i}" for i in range(6)]
+    + [f"LT{i}" for i in range(5, -1, -1)] + [f"RT{i}" for i in range(6)]
+    + [f"LM{i}" for i in range(5, -1, -1)] + [f"RM{i}" for i in range(6)]
+    + [f"LB{i}" for i in range(5, -1, -1)] + ["LEC", "REC"] + [f"RB{i}" for i in range(6)]
+    + [f"LH{i}" for i in range(4, -1, -1)] + [f"RH{i}" for i in range(5)]
+)
+
+KEYCODES = [chr(c) for c in range(ord('A'), ord('Z') + 1)] + [f"N{i}" for i in range(10)]
+
+def layer_name(index):
+    return "BASE" if index == 0 else f"LAYER_{chr(ord('A') + index % 26)}{'_' * (index // 26)}"
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def generate_config(root, layers, combos, behaviors, include_depth, defines):
+    """Write a synthetic config tree under root and return the path of its base.keymap."""
+    config_dir = os.path.join(root, "config")
+    includes_dir = os.path.join(config_dir, "includes")
+    labels_dir = os.path.join(root, "zmk-helpers", "include", "zmk-helpers", "key-labels")
+
+    write(os.path.join(labels_dir, "sofle.h"), "#pragma once\n\n" + "".join(
+        f"#define {label} {position}\n" for position, label in enumerate(SOFLE_KEY_LABELS)))
+
+    layer_names = [layer_name(i) for i in range(layers)]
+    write(os.path.join(includes_dir, "layers_definitions.dtsi"), "// Define layer numbers\n" + "".join(
+        f"#define {name} {i}\n" for i, name in enumerate(layer_names)))
+
+    # Plain defines spread over a chain of nested includes
+    depth = max(include_depth, 1)
+    per_file = max(defines // depth, 1)
+    for level in range(depth):
+        lines = [f"/* generated include level {level} */\n"]
+        if level + 1 < depth:
+            lines.append(f'#include "level_{level + 1}.dtsi"\n')
+        for i in range(per_file):
+            lines.append(f"#define GEN_VALUE_{level}_{i} {i}  // filler\n")
+        write(os.path.join(includes_dir, f"level_{level}.dtsi"), "".join(lines))
+
+    hold_taps = []
+    mod_morphs = []
+    for i in range(behaviors):
+        if i % 2 == 0:
+            hold_taps.append(f"""
+        ht_{i}: ht_{i} {{
+            compatible = "zmk,behavior-hold-tap";
+            #binding-cells = <2>;
+            bindings = <&kp>, <&kp>;
+            flavor = "tap-preferred";
+            tapping-term-ms = <HM_TAPPING_TERM>;
+            quick-tap-ms = <175>;
+            require-prior-idle-ms = <HM_PRIOR_IDLE>;
+            hold-trigger-key-positions = <KEYS_R KEYS_T>;
+        }};
+""")
+        else:
+            mod_morphs.append(f"""
+        /*
+        * Generated mod-morph {i}
+        */
+        mm_{i}: mm_{i} {{
+            compatible = "zmk,behavior-mod-morph";
+            #binding-cells = <0>;
+            #ifdef HAS_CAPSLOCK
+            bindings = <&kp {KEYCODES[i % len(KEYCODES)]}>, <&caps_word>;
+            #else
+            bindings = <&kp {KEYCODES[i % len(KEYCODES)]}>, <&kp LS({KEYCODES[i % len(KEYCODES)]})>;
+            #endif
+            mods = <(MOD_LSFT|MOD_RSFT)>;
+        }};
+""")
+    write(os.path.join(includes_dir, "behaviours_homerow_mods.dtsi"),
+          "#define HM_TAPPING_TERM 250\n#define HM_PRIOR_IDLE 100\n\n/ {\n    behaviors {" + "".join(hold_taps) + "    };\n};\n")
+    write(os.path.join(includes_dir, "behaviours_mod_morph.dtsi"),
+          "/ {\n    behaviors {" + "".join(mod_morphs) + "    };\n};\n")
+
+    combo_nodes = []
+    for i in range(combos):
+        first = SOFLE_KEY_LABELS[i % len(SOFLE_KEY_LABELS)]
+        second = SOFLE_KEY_LABELS[(i * 7 + 1) % len(SOFLE_KEY_LABELS)]
+        layers_property = ""
+        if i % 3 == 0:
+            layers_property = f"\n\t\t\tlayers = <{' '.join(layer_names[:min(3, layers)])}>;"
+        combo_nodes.append(f"""
+\t\tcombo_gen_{i} {{
+\t\t\tbindings = <&kp {KEYCODES[i % len(KEYCODES)]}>;
+\t\t\tkey-positions = <{first} {second}>;
+\t\t\ttimeout-ms = <COMBO_TERM_FAST>;
+\t\t\trequire-prior-idle-ms = <COMBO_PRIOR_IDLE_FAST>;{layers_property}
+\t\t}};
+""")
+    write(os.path.join(includes_dir, "combos.dtsi"),
+          '#include "layers_definitions.dtsi"\n\n#define COMBO_TERM_FAST 35\n#define COMBO_PRIOR_IDLE_FAST 10\n\n'
+          "/ {\n\tcombos {\n\t\tcompatible = \"zmk,combos\";\n" + "".join(combo_nodes) + "\t};\n};\n")
+
+    layer_nodes = []
+    for i, name in enumerate(layer_names):
+        bindings = []
+        for position in range(len(SOFLE_KEY_LABELS)):
+            key = KEYCODES[(position + i) % len(KEYCODES)]
+            if position == 25 and behaviors:
+                bindings.append(f"&ht_0 LCTRL {key}")
+            elif position == 53 and layers > 1:
+                bindings.append(f"&lt {layer_names[(i + 1) % layers]} SPACE")
+            else:
+                bindings.append(f"&kp {key}")
+        rows = ["\t\t\t" + "  ".join(bindings[row:row + 12]) for row in range(0, len(bindings), 12)]
+        layer_nodes.append(f"""
+\t\t{name.lower()}_layer {{
+\t\t\tdisplay-name = "{name.title()}";
+\t\t\tbindings = <
+{chr(10).join(rows)}
+\t\t\t>;
+\t\t}};
+""")
+
+    write(os.path.join(config_dir, "base.keymap"), """/* generated benchmark keymap */
+#include "includes/layers_definitions.dtsi"
+#include <behaviors.dtsi>
+#include <dt-bindings/zmk/keys.h>
+#include "includes/level_0.dtsi"
+#include "includes/combos.dtsi"
+#include "includes/behaviours_homerow_mods.dtsi"
+#include "includes/behaviours_mod_morph.dtsi"
+
+/ {
+\tkeymap {
+\t\tcompatible = "zmk,keymap";
+""" + "".join(layer_nodes) + "\t};\n};\n")
+
+    write(os.path.join(config_dir, "sofle.keymap"), """/* source keypos definitions */
+#include "../zmk-helpers/include/zmk-helpers/key-labels/sofle.h"
+
+#define KEYS_L LN5 LN4 LN3 LN2 LN1 LN0 LT5 LT4 LT3 LT2 LT1 LT0 LM5 LM4 LM3 LM2 LM1 LM0 LB5 LB4 LB3 LB2 LB1 LB0 LEC
+#define KEYS_R RN0 RN1 RN2 RN3 RN4 RN5 RT0 RT1 RT2 RT3 RT4 RT5 RM0 RM1 RM2 RM3 RM4 RM5 REC RB0 RB1 RB2 RB3 RB4 RB5
+#define KEYS_T LH4 LH3 LH2 LH1 LH0 RH0 RH1 RH2 RH3 RH4
+
+/* source the main keymap */
+#include "base.keymap"
+""")
+
+    return os.path.join(config_dir, "base.keymap")
+
+def time_stage(func, repeat, setup=None):
+    """Run func repeat times and return timing statistics in milliseconds plus its last result.
+
+    When setup is given it's called untimed before every run and func gets
+    its result, so each run starts from fresh state instead of what the
+    previous run memoized.
+    """
+    samples = []
+    result = None
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        started = time.perf_counter()
+        result = func(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'repeat': repeat,
+    }, result
+
+def benchmark_config(params, repeat, with_drawer):
+    """Generate one synthetic config and time each process_keymap stage on it."""
+    with tempfile.TemporaryDirectory(prefix="keymap-bench-") as root:
+        keymap_path = generate_config(root, **params)
+        base_dir = os.path.dirname(keymap_path)
+        project_root = os.path.dirname(base_dir)
+        output_path = os.path.join(root, "keymap-tools", "out", "processed_keymap.keymap")
+        os.makedirs(os.path.dirname(output_path))
+
+        graph = pk.build_include_graph(keymap_path)
+        combined_content = '\n'.join(graph.contents.values())
+        total_bytes = sum(len(content) for content in graph.contents.values())
+        key_positions = pk.extract_key_positions(combined_content)
+        layer_definitions = pk.extract_layer_definitions(os.path.join(base_dir, "includes", "layers_definitions.dtsi"))
+        combos_file = os.path.join(base_dir, "includes", "combos.dtsi")
+
+        def fresh_graph():
+            # Graphs memoize their symbols, macros and devicetree trees
+            pk.clear_memos()
+            return pk.build_include_graph(keymap_path)
+
+        def fresh_index_inputs():
+            fresh = fresh_graph()
+            return fresh, fresh.key_positions()
+
+        def fresh_index():
+            fresh, fresh_key_positions = fresh_index_inputs()
+            index = pk.build_devicetree_index(fresh, fresh_key_positions, layer_definitions)
+            return index, pk.build_symbol_table(fresh.defines())
+
+        stages = {}
+        stages['find_includes'], _ = time_stage(
+            lambda: pk.find_includes(graph.keymap_content, base_dir, project_root), repeat)
+        stages['build_include_graph'], _ = time_stage(lambda: pk.build_include_graph(keymap_path), repeat)
+        stages['extract_defines'], _ = time_stage(lambda: pk.extract_defines(combined_content), repeat)
+        stages['extract_key_positions'], _ = time_stage(lambda: pk.extract_key_positions(combined_content), repeat)
+        stages['process_keymap'], processed = time_stage(
+            lambda fresh: pk.process_keymap(keymap_path, output_path, fresh), repeat, fresh_graph)
+        stages['build_devicetree_index'], _ = time_stage(
+            lambda inputs: pk.build_devicetree_index(*inputs, layer_definitions), repeat, fresh_index_inputs)
+        stages['process_combos'], yaml_combos = time_stage(
+            lambda: pk.process_combos(combos_file, key_positions, layer_definitions), repeat)
+
+        with open(output_path, 'w') as f:
+            f.write(processed)
+
+        drawer_available = with_drawer and pk.load_keymap_drawer() is not None
+        if drawer_available:
+            stages['emit_keymap_document'], _ = time_stage(
+                lambda inputs: pk.emit_keymap_document(*inputs, {"zmk_keyboard": "sofle"}), repeat, fresh_index)
+            stages['drawer_parse'], document = time_stage(lambda: pk.drawer_parse(output_path), repeat)
+        else:
+            document = {'layers': {name: [] for name in layer_definitions}}
+        document['layout'] = {"zmk_keyboard": "sofle"}
+        document.setdefault('combos', []).extend(yaml_combos)
+
+        stages['yaml_dump'], final_yaml = time_stage(lambda: pk.dump_yaml(document), repeat)
+        stages['yaml_load'], _ = time_stage(lambda: pk.load_yaml(final_yaml), repeat)
+
+        if drawer_available:
+            yaml_path = os.path.join(os.path.dirname(output_path), "keymap.yaml")
+            with open(yaml_path, 'w') as f:
+                f.write(final_yaml)
+            stages['drawer_draw'], _ = time_stage(lambda: pk.drawer_draw(document, yaml_path), repeat)
+
+        return {
+            'params': params,
+            'files': len(graph.contents),
+            'bytes': total_bytes,
+            'combos_extracted': len(yaml_combos),
+            'stages': stages,
+        }
+
+def compare_results(previous, current):
+    """Print per-stage median ratios between two result files for the configs they share."""
+    previous_runs = {json.dumps(run['params'], sort_keys=True): run for run in previous.get('runs', [])}
+    for run in current['runs']:
+        key = json.dumps(run['params'], sort_keys=True)
+        if key not in previous_runs:
+            continue
+        print(f"\nComparison for {run['params']}:")
+        old_stages = previous_runs[key]['stages']
+        for stage, stats in run['stages'].items():
+            if stage not in old_stages or not old_stages[stage]['median_ms']:
+                continue
+            ratio = stats['median_ms'] / old_stages[stage]['median_ms']
+            print(f"  {stage:<24} {old_stages[stage]['median_ms']:>10.3f} -> {stats['median_ms']:>10.3f} ms  ({ratio:.2f}x)")
+
+def print_run(run):
+    print(f"\n{run['params']} - {run['files']} files, {run['bytes']} bytes, {run['combos_extracted']} combos")
+    for stage, stats in run['stages'].items():
+        print(f"  {stage:<24} median {stats['median_ms']:>10.3f} ms   min {stats['min_ms']:>10.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process_keymap.py stages on synthetic ZMK configs.")
+    parser.add_argument("--sizes", help=f"Comma-separated size presets to run ({', '.join(SIZE_PRESETS)})")
+    parser.add_argument("--layers", type=int, help="Number of layers")
+    parser.add_argument("--combos", type=int, help="Number of combos in combos.dtsi")
+    parser.add_argument("--behaviors", type=int, help="Number of hold-tap and mod-morph behaviors")
+    parser.add_argument("--include-depth", type=int, help="Depth of the nested include chain")
+    parser.add_argument("--defines", type=int, help="Number of filler #defines spread over the include chain")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions per stage (default: 5)")
+    parser.add_argument("--no-drawer", action="store_true", help="Skip the keymap_drawer parse and draw stages")
+    parser.add_argument("-o", "--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    args = parser.parse_args()
+
+    # Keep stage output quiet so terminal I/O doesn't skew the timings
+    pk.configure_logging('quiet')
+
+    custom = {
+        key: value for key, value in (
+            ('layers', args.layers), ('combos', args.combos), ('behaviors', args.behaviors),
+            ('include_depth', args.include_depth), ('defines', args.defines),
+        ) if value is not None
+    }
+    configs = []
+    if args.sizes:
+        for size in args.sizes.split(','):
+            if size not in SIZE_PRESETS:
+                parser.error(f"Unknown size preset: {size}")
+            configs.append(dict(SIZE_PRESETS[size], **custom))
+    else:
+        configs.append(dict(SIZE_PRESETS['medium'], **custom))
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'runs': [],
+    }
+    for params in configs:
+        run = benchmark_config(params, args.repeat, not args.no_drawer)
+        results['runs'].append(run)
+        print_run(run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
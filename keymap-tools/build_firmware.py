@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Build the ZMK firmware of every half with west, skipping halves whose
+inputs haven't changed since their last successful build.
+
+The inputs of a half are hashed up front from the include graph of its
+keymap (the same one process_keymap.py walks) and the names of the
+includes it couldn't resolve, its .conf/.overlay files, west.yml, the ZMK
+revision, the state of every extra module (commit, uncommitted changes
+and untracked files) and the build command. Halves that need a
+build are built concurrently, each in its own build directory, and their
+UF2 files are copied to ../out. Every build is timed and appended to
+../out/build-timings.csv.
+
+    python3 build_firmware.py
+    python3 build_firmware.py --target sofle_left --pristine
+    python3 build_firmware.py --dry-run
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import keymap_pipeline as pk
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), pk.CACHE_DIR_NAME)
+
+# Locations used by the dev container, see ../build.sh
+DEFAULT_ZMK_APP = "/workspaces/zmk/app"
+DEFAULT_MODULES = ("zmk-userspace", "zmk-helpers")
+DEFAULT_TARGETS = (('nice_nano', 'sofle_left'), ('nice_nano', 'sofle_right'))
+
+SIDE_SUFFIXES = ('_left', '_right')
+TIMINGS_FILE_NAME = "build-timings.csv"
+TIMINGS_FIELDS = ['started', 'target', 'status', 'seconds', 'inputs']
+BUILD_LOG_NAME = "build_firmware.log"
+LOG_TAIL_LINES = 20
+
+Target = namedtuple('Target', ['board', 'shield'])
+BuildResult = namedtuple('BuildResult', ['target', 'status', 'seconds', 'inputs', 'log_path'])
+
+def target_name(target):
+    return target.shield or target.board
+
+def load_targets(build_yaml):
+    """Board/shield pairs from the include list of build.yaml, or the two Sofle halves without it."""
+    if not os.path.exists(build_yaml):
+        return [Target(board, shield) for board, shield in DEFAULT_TARGETS]
+    data = pk.load_yaml(pk.read_file(build_yaml)) or {}
+    targets = [Target(entry['board'], entry.get('shield')) for entry in data.get('include', []) if entry.get('board')]
+    for board in data.get('board', []):
+        targets.extend(Target(board, shield) for shield in data.get('shield', [None]))
+    return targets
+
+def config_names(target):
+    """File names ZMK looks up in the config directory for a target, most specific first."""
+    name = target_name(target)
+    names = [name]
+    for suffix in SIDE_SUFFIXES:
+        if name.endswith(suffix):
+            names.append(name[:-len(suffix)])
+    return names
+
+def target_keymap(config_dir, target):
+    for name in config_names(target):
+        path = os.path.join(config_dir, name + ".keymap")
+        if os.path.exists(path):
+            return path
+    return None
+
+def git_output(directory, *args):
+    """stdout of a git command run in directory, or None if git or the repository isn't there."""
+    try:
+        result = subprocess.run(["git", "-C", directory, *args], capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+def zmk_revision(zmk_app):
+    """Commit of the ZMK checkout, so updating ZMK rebuilds everything."""
+    return (git_output(zmk_app, "rev-parse", "HEAD") or "").strip()
+
+def module_state(module):
+    """Hash of an extra module as the build sees it: its commit, uncommitted changes and untracked files.
+
+    Keymaps include headers from modules (zmk-helpers, zmk-userspace) that
+    the include graph can't always resolve, and the firmware is built from
+    the whole module anyway. A module that isn't a git checkout is hashed
+    file by file.
+    """
+    revision = git_output(module, "rev-parse", "HEAD")
+    if revision is not None:
+        parts = [revision, git_output(module, "diff", "HEAD", "--binary", "--", ".") or ""]
+        untracked = git_output(module, "ls-files", "--others", "--exclude-standard", "-z", "--", ".") or ""
+        paths = sorted(path for path in untracked.split('\0') if path)
+    else:
+        parts = []
+        paths = []
+        for root, dirs, files in os.walk(module):
+            dirs[:] = sorted(d for d in dirs if d != '.git')
+            paths.extend(os.path.relpath(os.path.join(root, name), module) for name in sorted(files))
+    for path in paths:
+        full_path = os.path.join(module, path)
+        if os.path.isfile(full_path):
+            parts += [path, pk.hash_file(full_path)]
+    return pk.hash_text(module, *parts)
+
+def west_command(target, build_dir, config_dir, modules, pristine=False):
+    command = ["west", "build", "-d", build_dir, "-b", target.board]
+    if pristine:
+        command += ["-p", "always"]
+    command += ["--", f"-DZMK_CONFIG={config_dir}", f"-DZMK_EXTRA_MODULES={';'.join(modules)}"]
+    if target.shield:
+        command.append(f"-DSHIELD={target.shield}")
+    return command
+
+def target_inputs_key(target, config_dir, graphs, command, versions):
+    """Hash everything the firmware of target is built from that this script can see up front.
+
+    command is the west command without -p, since a pristine build starts
+    from an empty build directory but has the same inputs. versions holds
+    the ZMK revision and the module_state() of every extra module. graphs
+    caches the include graph per keymap path, so halves sharing a keymap
+    walk it once.
+    """
+    extra = [*versions, ' '.join(command)]
+    for name in config_names(target):
+        for ext in ('.conf', '.overlay'):
+            path = os.path.join(config_dir, name + ext)
+            if os.path.exists(path):
+                extra += [name + ext, pk.read_file(path)]
+    west_yml = os.path.join(config_dir, "west.yml")
+    if os.path.exists(west_yml):
+        extra.append(pk.read_file(west_yml))
+
+    keymap_path = target_keymap(config_dir, target)
+    if keymap_path is None:
+        pk.logger.warning(f"No keymap found for {target_name(target)} in {config_dir}")
+        return pk.hash_text(*extra)
+    if keymap_path not in graphs:
+        graphs[keymap_path] = pk.build_include_graph(keymap_path, cache_dir=CACHE_DIR)
+    graph = graphs[keymap_path]
+    return pk.hash_include_graph(graph, *extra, *graph.unresolved_includes())
+
+def log_tail(log_path, lines=LOG_TAIL_LINES):
+    try:
+        with open(log_path, 'r', errors='replace') as f:
+            return ''.join(f.readlines()[-lines:])
+    except OSError:
+        return ''
+
+def build_target(target, command, zmk_app, build_dir, uf2_path, inputs_key, cache):
+    """Run west build for one target with its output in build_dir/build_firmware.log, then copy the UF2."""
+    name = target_name(target)
+    os.makedirs(build_dir, exist_ok=True)
+    log_path = os.path.join(build_dir, BUILD_LOG_NAME)
+    pk.logger.info(f"Building {name}: {' '.join(command)}")
+    started = time.perf_counter()
+    with open(log_path, 'w') as log:
+        try:
+            returncode = subprocess.run(command, cwd=zmk_app, stdout=log, stderr=subprocess.STDOUT).returncode
+        except OSError as e:
+            log.write(f"{e}\n")
+            returncode = None
+    seconds = time.perf_counter() - started
+
+    firmware = os.path.join(build_dir, "zephyr", "zmk.uf2")
+    if returncode != 0 or not os.path.exists(firmware):
+        pk.logger.error(f"Building {name} failed after {seconds:.1f}s, see {log_path}:\n{log_tail(log_path)}")
+        return BuildResult(target, 'failed', seconds, inputs_key, log_path)
+    shutil.copyfile(firmware, uf2_path)
+    cache.record_outputs(inputs_key, [uf2_path])
+    pk.logger.info(f"Built {name} in {seconds:.1f}s -> {uf2_path}")
+    return BuildResult(target, 'built', seconds, inputs_key, log_path)
+
+def record_timings(path, results):
+    """Append one row per target to the CSV of build timings."""
+    new_file = not os.path.exists(path)
+    started = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(TIMINGS_FIELDS)
+        for result in results:
+            writer.writerow([started, target_name(result.target), result.status,
+                             f"{result.seconds:.2f}", result.inputs[:16]])
+
+def format_summary(results, elapsed):
+    lines = [f"{'Target':<16} {'Status':<8} {'Time (s)':>9}"]
+    for result in results:
+        lines.append(f"{target_name(result.target):<16} {result.status:<8} {result.seconds:>9.1f}")
+    lines.append(f"{'total':<16} {'':<8} {elapsed:>9.1f}")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the firmware of each half concurrently, skipping unchanged halves.")
+    parser.add_argument('--zmk-app', default=DEFAULT_ZMK_APP, help=f"ZMK app directory west builds from (default: {DEFAULT_ZMK_APP})")
+    parser.add_argument('--config', default=os.path.join(PROJECT_ROOT, "config"), help="ZMK config directory (default: ../config)")
+    parser.add_argument('--module', dest='modules', action='append', metavar='PATH',
+                        help=f"extra ZMK module (repeatable, default: {', '.join(DEFAULT_MODULES)} in the project root)")
+    parser.add_argument('--build-dir', help="directory holding one build directory per target (default: build/ in the ZMK app)")
+    parser.add_argument('--out', default=os.path.join(PROJECT_ROOT, "out"), help="where the UF2 files and build timings go (default: ../out)")
+    parser.add_argument('--target', action='append', metavar='SHIELD', help="only build these targets from build.yaml (repeatable)")
+    parser.add_argument('--jobs', type=int, help="targets built at the same time (default: all of them)")
+    parser.add_argument('--force', action='store_true', help="build even if the inputs are unchanged")
+    parser.add_argument('--pristine', action='store_true', help="start from empty build directories (implies --force)")
+    parser.add_argument('--dry-run', action='store_true', help="print which targets would be built and their commands")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show include and parsing details")
+    args = parser.parse_args()
+
+    pk.configure_logging('debug' if args.verbose else 'normal')
+    config_dir = os.path.abspath(args.config)
+    modules = [os.path.abspath(path) for path in args.modules] if args.modules else [
+        os.path.join(PROJECT_ROOT, name) for name in DEFAULT_MODULES]
+    build_root = args.build_dir or os.path.join(args.zmk_app, "build")
+
+    targets = load_targets(os.path.join(PROJECT_ROOT, "build.yaml"))
+    if args.target:
+        unknown = set(args.target) - {target_name(target) for target in targets}
+        if unknown:
+            pk.logger.error(f"Unknown target(s): {', '.join(sorted(unknown))}")
+            sys.exit(2)
+        targets = [target for target in targets if target_name(target) in args.target]
+
+    start = time.perf_counter()
+    versions = [zmk_revision(args.zmk_app)] + [module_state(module) for module in modules]
+    graphs = {}
+    pending, results = [], []
+    for target in targets:
+        name = target_name(target)
+        build_dir = os.path.join(build_root, name)
+        command = west_command(target, build_dir, config_dir, modules, args.pristine)
+        inputs_key = target_inputs_key(target, config_dir, graphs,
+                                       west_command(target, build_dir, config_dir, modules), versions)
+        cache = pk.StageCache(CACHE_DIR, manifest_name=f"build-{name}.json")
+        uf2_path = os.path.join(args.out, f"{name}.uf2")
+        if not (args.force or args.pristine) and cache.outputs_unchanged(inputs_key):
+            pk.logger.info(f"{name}: inputs unchanged, keeping {uf2_path}")
+            results.append(BuildResult(target, 'skipped', 0.0, inputs_key, None))
+        else:
+            pending.append((target, command, build_dir, uf2_path, inputs_key, cache))
+    pk.logger.info(f"Hashed inputs of {len(targets)} target(s) in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    if args.dry_run:
+        for target, command, *_ in pending:
+            print(f"{target_name(target)}: {' '.join(command)}")
+        for result in results:
+            print(f"{target_name(result.target)}: up to date")
+        return
+
+    if pending:
+        if shutil.which("west") is None:
+            pk.logger.error("west not found, run this inside the ZMK dev container or a west workspace")
+            sys.exit(1)
+        if not os.path.isdir(args.zmk_app):
+            pk.logger.error(f"ZMK app directory not found: {args.zmk_app}")
+            sys.exit(1)
+        os.makedirs(args.out, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=args.jobs or len(pending)) as pool:
+            futures = [pool.submit(build_target, target, command, args.zmk_app, build_dir, uf2_path, inputs_key, cache)
+                       for target, command, build_dir, uf2_path, inputs_key, cache in pending]
+            results.extend(future.result() for future in futures)
+    results.sort(key=lambda result: targets.index(result.target))
+    if pending:
+        record_timings(os.path.join(args.out, TIMINGS_FILE_NAME), results)
+    print(format_summary(results, time.perf_counter() - start))
+    sys.exit(1 if any(result.status == 'failed' for result in results) else 0)
+
+if __name__ == "__main__":
+    main()
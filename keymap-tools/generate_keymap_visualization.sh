@@ -59,37 +59,18 @@ fi
 # Ensure output directory exists
 mkdir -p "$OUT_DIR"
 
-# Clean output directory
-echo -e "\nCleaning output directory..."
-rm -f "$OUT_DIR"/*
+# Outputs are no longer wiped on every run: process_keymap.py keeps a
+# content-hash cache in $TOOLS_DIR/.cache and only re-parses and re-draws
+# when the keymap, its includes or the drawer configuration changed.
+# Pass --no-cache to this script to force a full rebuild.
 
-# Step 1: Process the keymap
+# Step 1: Process the keymap, generate the YAML and draw the SVG
 echo -e "\nProcessing keymap..."
 source "$KEYMAP_DIR/venv/bin/activate"
-python3 "$TOOLS_DIR/process_keymap.py" "$CONFIG_DIR/base.keymap" "$OUT_DIR/processed_keymap.keymap"
+python3 "$TOOLS_DIR/process_keymap.py" "$CONFIG_DIR/base.keymap" "$OUT_DIR/processed_keymap.keymap" "$@"
 
-# Step 1.5: Combo processing is now handled directly in the process_keymap.py script
-echo -e "\nNOTE: Combos are now processed directly within the Python script"
-
-# Step 2: Generate SVG visualization
-echo -e "\nGenerating SVG visualization..."
-
-if [ "$FORCE_LOCAL_REPO" = true ] || ! command -v keymap &> /dev/null; then
-    if [ -d "$KEYMAP_DRAWER_DIR" ]; then
-        echo "Using local keymap-drawer repository for drawing"
-        cd "$KEYMAP_DRAWER_DIR"
-        source "$KEYMAP_DIR/venv/bin/activate"
-        python3 -m keymap_drawer draw "$OUT_DIR/keymap.yaml" -o "$SVG_OUTPUT"
-        cd "$TOOLS_DIR"
-    else
-        echo "ERROR: keymap-drawer repository not found at $KEYMAP_DRAWER_DIR"
-        echo "Please clone the repository: git clone https://github.com/caksoylar/keymap-drawer.git $KEYMAP_DRAWER_DIR"
-        exit 1
-    fi
-else
-    echo "Using installed keymap-drawer package for drawing"
-    keymap draw "$OUT_DIR/keymap.yaml" -o "$SVG_OUTPUT"
-fi
+# Step 2: The SVG visualization is drawn by process_keymap.py itself
+echo -e "\nNOTE: Combos and SVG drawing are handled directly within the Python script"
 
 # Check if the SVG was generated
 if [ -f "$SVG_OUTPUT" ]; then
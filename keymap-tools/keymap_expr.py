@@ -0,0 +1,169 @@
+"""
+Evaluate C preprocessor integer expressions, as in #if and #elif.
+
+Kept out of keymap_source.py so that it is only loaded for keymaps with
+#if or #elif conditions and by the tools that resolve numeric values.
+"""
+
+import re
+
+EXPRESSION_TOKEN_PATTERN = re.compile(r'\s*(?:(0[xX][0-9A-Fa-f]+|\d+)[uUlL]*|([A-Za-z_]\w*)|(&&|\|\||<<|>>|[<>=!]=|[-+*/%<>!~&|^()?:]))')
+
+def c_divide(a, b):
+    """Integer division truncating toward zero, like C."""
+    if b == 0:
+        raise ValueError("division by zero")
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+UNARY_OPERATORS = {
+    '!': lambda a: int(not a),
+    '~': lambda a: ~a,
+    '-': lambda a: -a,
+    '+': lambda a: a,
+}
+
+# Binary operators by C precedence, && and || are evaluated separately so they short-circuit
+BINARY_PRECEDENCE = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6,
+    '<': 7, '<=': 7, '>': 7, '>=': 7, '<<': 8, '>>': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10,
+}
+BINARY_OPERATORS = {
+    '|': lambda a, b: a | b,
+    '^': lambda a, b: a ^ b,
+    '&': lambda a, b: a & b,
+    '==': lambda a, b: int(a == b),
+    '!=': lambda a, b: int(a != b),
+    '<': lambda a, b: int(a < b),
+    '<=': lambda a, b: int(a <= b),
+    '>': lambda a, b: int(a > b),
+    '>=': lambda a, b: int(a >= b),
+    '<<': lambda a, b: a << b,
+    '>>': lambda a, b: a >> b,
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': c_divide,
+    '%': lambda a, b: a - b * c_divide(a, b),
+}
+
+def integer_literal(text):
+    if text[:2] in ('0x', '0X'):
+        return int(text, 16)
+    return int(text, 8) if len(text) > 1 and text[0] == '0' else int(text)
+
+_parsed_expressions = {}
+
+def parse_integer_expression(text):
+    """Parse a C preprocessor integer expression into nested tuples.
+
+    Supports decimal, hex and octal literals, identifiers, defined X and
+    defined(X), the unary, binary and ?: operators of C with their
+    precedence, and parentheses. Raises ValueError for anything else.
+    Parsed expressions are memoized, #if conditions are evaluated once per
+    directive they guard.
+    """
+    if text in _parsed_expressions:
+        return _parsed_expressions[text]
+    tokens = []
+    position = 0
+    end = len(text.rstrip())
+    while position < end:
+        match = EXPRESSION_TOKEN_PATTERN.match(text, position)
+        if not match:
+            raise ValueError(f"unexpected {text[position:end].strip()!r}")
+        tokens.append(match.groups())
+        position = match.end()
+    tokens.append((None, None, None))
+    cursor = 0
+
+    def peek():
+        return tokens[cursor][2]
+
+    def advance():
+        nonlocal cursor
+        token = tokens[cursor]
+        cursor = min(cursor + 1, len(tokens) - 1)
+        return token
+
+    def expect(operator):
+        if advance()[2] != operator:
+            raise ValueError(f"expected {operator}")
+
+    def primary():
+        number, name, operator = advance()
+        if number is not None:
+            return ('number', integer_literal(number))
+        if name == 'defined':
+            parenthesized = peek() == '('
+            if parenthesized:
+                advance()
+            symbol = advance()[1]
+            if symbol is None:
+                raise ValueError("defined without a name")
+            if parenthesized:
+                expect(')')
+            return ('defined', symbol)
+        if name is not None:
+            return ('name', name)
+        if operator in UNARY_OPERATORS:
+            return ('unary', operator, primary())
+        if operator == '(':
+            node = conditional()
+            expect(')')
+            return node
+        raise ValueError(f"unexpected {operator or 'end of expression'}")
+
+    def binary(min_precedence):
+        left = primary()
+        while BINARY_PRECEDENCE.get(peek(), 0) >= min_precedence:
+            operator = advance()[2]
+            left = ('binary', operator, left, binary(BINARY_PRECEDENCE[operator] + 1))
+        return left
+
+    def conditional():
+        node = binary(1)
+        if peek() == '?':
+            advance()
+            then = conditional()
+            expect(':')
+            node = ('conditional', node, then, conditional())
+        return node
+
+    tree = conditional()
+    if cursor != len(tokens) - 1:
+        raise ValueError(f"unexpected {peek() or tokens[cursor][0] or tokens[cursor][1]}")
+    _parsed_expressions[text] = tree
+    return tree
+
+def evaluate_integer(text, value=None, defined=None):
+    """Evaluate a C preprocessor integer expression with C semantics (1/2 is 0, && and || short-circuit).
+
+    value(name) gives the value of an identifier and defined(name) tells
+    whether it's defined; without them identifiers are an error. Raises
+    ValueError when text isn't an integer expression.
+    """
+    def evaluate(node):
+        kind = node[0]
+        if kind == 'number':
+            return node[1]
+        if kind == 'name':
+            if value is None:
+                raise ValueError(f"unknown identifier {node[1]}")
+            return value(node[1])
+        if kind == 'defined':
+            if defined is None:
+                raise ValueError(f"unknown identifier {node[1]}")
+            return int(bool(defined(node[1])))
+        if kind == 'unary':
+            return UNARY_OPERATORS[node[1]](evaluate(node[2]))
+        if kind == 'conditional':
+            return evaluate(node[2] if evaluate(node[1]) else node[3])
+        operator, left, right = node[1:]
+        if operator == '&&':
+            return int(bool(evaluate(left)) and bool(evaluate(right)))
+        if operator == '||':
+            return int(bool(evaluate(left)) or bool(evaluate(right)))
+        return BINARY_OPERATORS[operator](evaluate(left), evaluate(right))
+
+    return evaluate(parse_integer_expression(text))
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Count how often every key, layer and combo would be used to type a text corpus.
+
+Each character is mapped to the cheapest way of producing it with the
+keymap: a key on the base layer, a key on another layer (plus the press
+that activates that layer), an extra shift press, or a combo. The corpus
+is read in fixed-size chunks and only distinct characters are looked up,
+so memory use doesn't grow with the corpus size.
+
+    python3 keymap_heatmap.py ../config/base.keymap corpus.txt --svg out/heatmap.svg
+    python3 keymap_heatmap.py ../config/base.keymap *.txt --json heat.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter, namedtuple
+
+import keymap_pipeline as pk
+from keymap_latency import collect_behaviors, load_keymap_index
+
+CHUNK_CHARS = 1 << 20
+
+HEAT_LEVELS = 8
+HEAT_STYLE = "".join(
+    f"rect.heat-{level} {{ fill: hsl({60 - level * 60 // (HEAT_LEVELS - 1)}, 100%, {88 - level * 4}%); }}\n"
+    for level in range(HEAT_LEVELS))
+
+# Characters produced by ZMK keycodes, as (unshifted, shifted); None where the keycode sends shift itself
+KEYCODE_CHARS = {
+    **{chr(c): (chr(c).lower(), chr(c)) for c in range(ord('A'), ord('Z') + 1)},
+    **{f"N{d}": (str(d), s) for d, s in zip(range(10), ")!@#$%^&*(")},
+    **{f"NUMBER_{d}": (str(d), s) for d, s in zip(range(10), ")!@#$%^&*(")},
+    **{f"KP_N{d}": (str(d), None) for d in range(10)},
+    **{f"KP_NUMBER_{d}": (str(d), None) for d in range(10)},
+    'SPACE': (' ', ' '), 'SPC': (' ', ' '),
+    'RET': ('\n', '\n'), 'ENTER': ('\n', '\n'), 'RETURN': ('\n', '\n'),
+    'TAB': ('\t', None),
+    'MINUS': ('-', '_'), 'EQUAL': ('=', '+'),
+    'LBKT': ('[', '{'), 'LEFT_BRACKET': ('[', '{'), 'RBKT': (']', '}'), 'RIGHT_BRACKET': (']', '}'),
+    'BSLH': ('\\', '|'), 'BACKSLASH': ('\\', '|'),
+    'SEMI': (';', ':'), 'SEMICOLON': (';', ':'),
+    'SQT': ("'", '"'), 'APOS': ("'", '"'), 'APOSTROPHE': ("'", '"'), 'SINGLE_QUOTE': ("'", '"'),
+    'GRAVE': ('`', '~'), 'COMMA': (',', '<'), 'DOT': ('.', '>'), 'PERIOD': ('.', '>'),
+    'FSLH': ('/', '?'), 'SLASH': ('/', '?'),
+    'KP_ASTERISK': ('*', None), 'KP_MULTIPLY': ('*', None), 'KP_PLUS': ('+', None), 'KP_MINUS': ('-', None),
+    'KP_SLASH': ('/', None), 'KP_DIVIDE': ('/', None), 'KP_DOT': ('.', None), 'KP_EQUAL': ('=', None),
+    # Keycodes with an implicit shift
+    'EXCL': ('!', None), 'EXCLAMATION': ('!', None), 'AT': ('@', None), 'AT_SIGN': ('@', None),
+    'HASH': ('#', None), 'POUND': ('#', None), 'DLLR': ('$', None), 'DOLLAR': ('$', None),
+    'PRCNT': ('%', None), 'PERCENT': ('%', None), 'CARET': ('^', None),
+    'AMPS': ('&', None), 'AMPERSAND': ('&', None), 'STAR': ('*', None), 'ASTRK': ('*', None), 'ASTERISK': ('*', None),
+    'LPAR': ('(', None), 'LEFT_PARENTHESIS': ('(', None), 'RPAR': (')', None), 'RIGHT_PARENTHESIS': (')', None),
+    'UNDER': ('_', None), 'UNDERSCORE': ('_', None), 'PLUS': ('+', None),
+    'LBRC': ('{', None), 'LEFT_BRACE': ('{', None), 'RBRC': ('}', None), 'RIGHT_BRACE': ('}', None),
+    'PIPE': ('|', None), 'COLON': (':', None), 'DQT': ('"', None), 'DOUBLE_QUOTES': ('"', None),
+    'TILDE': ('~', None), 'LT': ('<', None), 'LESS_THAN': ('<', None), 'GT': ('>', None), 'GREATER_THAN': ('>', None),
+    'QMARK': ('?', None), 'QUESTION': ('?', None),
+}
+
+SHIFT_KEYCODES = {'LSHFT', 'RSHFT', 'LSHIFT', 'RSHIFT', 'LEFT_SHIFT', 'RIGHT_SHIFT'}
+SHIFT_WRAPPER_PATTERN = re.compile(r'^(?:LS|RS)\((.+)\)$')
+LAYER_ACTIVATORS = {'mo': 'hold', 'lt': 'hold', 'sl': 'sticky', 'to': 'toggle', 'tog': 'toggle'}
+
+Route = namedtuple('Route', ['layer', 'positions', 'shift', 'combo'])
+
+def keycode_chars(keycode, macros):
+    """Return (unshifted, shifted) characters of a keycode like 'A', 'LS(N1)' or a #define alias."""
+    keycode = macros.expand(keycode).strip()
+    match = SHIFT_WRAPPER_PATTERN.match(keycode)
+    if match:
+        chars = KEYCODE_CHARS.get(match.group(1))
+        return (chars[1] or chars[0], None) if chars else (None, None)
+    return KEYCODE_CHARS.get(keycode, (None, None))
+
+def binding_chars(binding, behaviors, macros, depth=0):
+    """Characters a tap of binding can type, as {char: needs_shift}."""
+    parts = binding.split()
+    name = parts[0].lstrip('&')
+    params = parts[1:]
+    node = behaviors.get(name)
+    if name == 'kp' and params:
+        unshifted, shifted = keycode_chars(params[0], macros)
+        chars = {}
+        if shifted:
+            chars[shifted] = True
+        if unshifted:
+            chars[unshifted] = False
+        return chars
+    if node is None or depth > 4:
+        return {}
+    nested = node.bindings()
+    if node.compatible == 'zmk,behavior-hold-tap' and len(nested) > 1:
+        tap = nested[1] + (f" {params[1]}" if len(params) > 1 else '')
+        return binding_chars(tap, behaviors, macros, depth + 1)
+    if node.compatible == 'zmk,behavior-tap-dance' and nested:
+        return binding_chars(nested[0], behaviors, macros, depth + 1)
+    if node.compatible == 'zmk,behavior-mod-morph' and nested:
+        chars = {c: s for c, s in binding_chars(nested[0], behaviors, macros, depth + 1).items() if not s}
+        mods = str(node.properties.get('mods', ''))
+        if len(nested) > 1 and 'SFT' in mods:
+            for char, shifted in binding_chars(nested[1], behaviors, macros, depth + 1).items():
+                if not shifted:
+                    chars.setdefault(char, True)
+        return chars
+    return {}
+
+def binding_hold(binding, behaviors):
+    """The binding a hold of binding triggers, e.g. '&mo NAV' for '&lt NAV TAB'."""
+    parts = binding.split()
+    name = parts[0].lstrip('&')
+    node = behaviors.get(name)
+    if node is not None and node.compatible == 'zmk,behavior-hold-tap':
+        nested = node.bindings()
+        if nested:
+            return nested[0] + (f" {parts[1]}" if len(parts) > 1 else '')
+    return binding
+
+class KeymapRoutes:
+    """Cheapest key sequence for every character the keymap can type."""
+
+    def __init__(self, index, macros, key_positions):
+        self.index = index
+        self.behaviors = collect_behaviors(index)
+        self.labels = key_positions.labels
+        self.layers = [layer.bindings() for layer in index.layers]
+        self.layer_names = []
+        for layer in index.layers:
+            name = layer.properties.get('display-name')
+            self.layer_names.append(name.strip('"') if isinstance(name, str) else layer.name)
+
+        self.activators = self._find_activators()
+        self.shift_positions = self._find_shift_positions()
+        self.routes = {}
+        for layer_id, bindings in enumerate(self.layers):
+            if layer_id and layer_id not in self.activators:
+                continue
+            for position, binding in enumerate(bindings):
+                if binding == '&trans':
+                    continue
+                for char, shifted in binding_chars(binding, self.behaviors, macros).items():
+                    self._offer(char, Route(layer_id, (position,), shifted, None))
+        for combo in index.combos():
+            positions = tuple(index.resolve_positions(combo.tokens('key-positions')))
+            bindings = combo.bindings()
+            if not positions or not bindings:
+                continue
+            for char, shifted in binding_chars(bindings[0], self.behaviors, macros).items():
+                self._offer(char, Route(0, positions, shifted, combo.name))
+
+    def _find_activators(self):
+        """Map layer numbers to (position, kind) of the base-layer key that activates them."""
+        activators = {}
+        for position, binding in enumerate(self.layers[0] if self.layers else ()):
+            parts = binding_hold(binding, self.behaviors).split()
+            kind = LAYER_ACTIVATORS.get(parts[0].lstrip('&'))
+            if kind and len(parts) > 1:
+                layer = self.index.resolve_layers(parts[1:2])
+                if layer and layer[0] not in activators:
+                    activators[layer[0]] = (position, kind)
+        return activators
+
+    def _find_shift_positions(self):
+        positions = []
+        for position, binding in enumerate(self.layers[0] if self.layers else ()):
+            for candidate in (binding, binding_hold(binding, self.behaviors)):
+                parts = candidate.split()
+                if parts[0] in ('&kp', '&sk') and len(parts) > 1 and parts[1] in SHIFT_KEYCODES:
+                    positions.append(position)
+                    break
+        return positions
+
+    def _cost(self, route):
+        return (len(route.positions) + (1 if route.shift else 0) + (1 if route.layer else 0),
+                route.combo is not None, route.layer)
+
+    def _offer(self, char, route):
+        current = self.routes.get(char)
+        if current is None or self._cost(route) < self._cost(current):
+            self.routes[char] = route
+
+    def shift_position(self, position):
+        """Shift key on the other hand from position, where there is one."""
+        hand = self.labels.get(position, '')[:1]
+        for candidate in self.shift_positions:
+            if self.labels.get(candidate, '')[:1] != hand:
+                return candidate
+        return self.shift_positions[0] if self.shift_positions else None
+
+class HeatmapCounter:
+    """Streams text through KeymapRoutes, counting presses per (layer, position), layer activations and combos.
+
+    Each chunk is counted with whole-string operations instead of a Python
+    loop per character: a Counter update for the character histogram, and
+    one regex per held layer whose matches are the runs of characters typed
+    while that layer is held.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.chars = Counter()
+        self.layer_runs = Counter()
+        self.last_char = ''
+        self.layer_patterns = {}
+        for layer in set(route.layer for route in routes.routes.values()):
+            if layer and routes.activators.get(layer, (None, 'sticky'))[1] != 'sticky':
+                chars = sorted(char for char, route in routes.routes.items() if route.layer == layer)
+                self.layer_patterns[layer] = (frozenset(chars), re.compile(f"[{self._char_class(chars)}]+"))
+
+    def _char_class(self, chars):
+        return ''.join(re.escape(char) for char in chars)
+
+    def feed(self, text):
+        if not text:
+            return
+        self.chars.update(text)
+        for layer, (layer_chars, pattern) in self.layer_patterns.items():
+            runs = len(pattern.findall(text))
+            if runs and text[0] in layer_chars and self.last_char in layer_chars:
+                # The run started in the previous chunk
+                runs -= 1
+            self.layer_runs[layer] += runs
+        self.last_char = text[-1]
+
+    def feed_file(self, path, chunk_chars=CHUNK_CHARS, encoding='utf-8'):
+        total = 0
+        with open(path, 'r', encoding=encoding, errors='replace', newline='') as f:
+            while True:
+                chunk = f.read(chunk_chars)
+                if not chunk:
+                    return total
+                self.feed(chunk)
+                total += len(chunk)
+
+    def results(self):
+        """Return press counts per (layer, position), layer activations, combo counts and unmapped characters."""
+        routes = self.routes
+        presses = Counter()
+        combos = Counter()
+        unmapped = Counter()
+        layer_activations = Counter()
+        for char, count in self.chars.items():
+            route = routes.routes.get(char)
+            if route is None:
+                unmapped[char] += count
+                continue
+            for position in route.positions:
+                presses[(route.layer, position)] += count
+            if route.combo:
+                combos[route.combo] += count
+            if route.shift:
+                shift = routes.shift_position(route.positions[0])
+                if shift is not None:
+                    presses[(0, shift)] += count
+            if route.layer:
+                position, kind = routes.activators[route.layer]
+                if kind == 'sticky':
+                    presses[(0, position)] += count
+                    layer_activations[route.layer] += count
+        for layer, runs in self.layer_runs.items():
+            position, _ = routes.activators[layer]
+            presses[(0, position)] += runs
+            layer_activations[layer] += runs
+        return presses, layer_activations, combos, unmapped
+
+def format_report(routes, characters, presses, layer_activations, combos, unmapped, top=20):
+    total = sum(presses.values()) or 1
+    per_position = Counter()
+    per_layer = Counter()
+    for (layer, position), count in presses.items():
+        per_position[position] += count
+        per_layer[layer] += count
+    lines = [f"{characters} characters, {sum(presses.values())} key presses "
+             f"({sum(presses.values()) / max(characters, 1):.3f} per character)", '']
+    lines.append(f"{'Pos':>3} {'Label':<5} {'Presses':>12} {'Share':>7}")
+    for position, count in per_position.most_common(top):
+        lines.append(f"{position:>3} {routes.labels.get(position, ''):<5} {count:>12} {100 * count / total:>6.2f}%")
+    lines += ['', f"{'Layer':<12} {'Presses':>12} {'Activations':>12}"]
+    for layer, count in sorted(per_layer.items()):
+        lines.append(f"{routes.layer_names[layer][:12]:<12} {count:>12} {layer_activations.get(layer, 0):>12}")
+    if combos:
+        lines += ['', 'Combos:'] + [f"  {name:<30} {count:>12}" for name, count in combos.most_common()]
+    if unmapped:
+        shown = ', '.join(f"{char!r} x{count}" for char, count in unmapped.most_common(10))
+        lines += ['', f"{sum(unmapped.values())} characters can't be typed with this keymap: {shown}"]
+    return '\n'.join(lines)
+
+def heat_level(count, peak):
+    if not count or not peak:
+        return None
+    return min(HEAT_LEVELS - 1, int((HEAT_LEVELS - 1) * count / peak + 0.5))
+
+def render_heatmap(routes, presses, svg_path):
+    """Draw physical key usage, summed over layers, and the usage of each layer."""
+    key_count = max(len(bindings) for bindings in routes.layers)
+    per_position = Counter()
+    for (layer, position), count in presses.items():
+        per_position[position] += count
+    total = sum(per_position.values()) or 1
+
+    def keys(counts, bindings):
+        peak = max(counts.values(), default=0)
+        row = []
+        for position in range(key_count):
+            count = counts.get(position, 0)
+            key = {'t': f"{100 * count / total:.1f}%" if count else ''}
+            if bindings is not None and position < len(bindings):
+                key['s'] = bindings[position].split()[-1] if bindings[position] != '&trans' else ''
+            level = heat_level(count, peak)
+            if level is not None:
+                key['type'] = f"heat-{level}"
+            row.append(key)
+        return row
+
+    layers = {'All layers': keys(per_position, None)}
+    for layer_id, bindings in enumerate(routes.layers):
+        counts = Counter({position: count for (layer, position), count in presses.items() if layer == layer_id})
+        if counts:
+            layers[routes.layer_names[layer_id]] = keys(counts, bindings)
+    pk.draw_overlay(layers, svg_path, HEAT_STYLE)
+    pk.logger.info(f"Heatmap written to {svg_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Count key, layer and combo usage for text corpora.")
+    parser.add_argument('keymap_file', help="path to the keymap, e.g. ../config/base.keymap")
+    parser.add_argument('corpus', nargs='+', help="text files to count")
+    parser.add_argument('--svg', metavar='PATH', help="draw a heat overlay of the key layout")
+    parser.add_argument('--json', metavar='PATH', help="write the counts as JSON, to compare layout variants")
+    parser.add_argument('--encoding', default='utf-8', help="corpus text encoding (default: utf-8)")
+    parser.add_argument('--top', type=int, default=20, help="number of keys listed in the report")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show include and parsing details")
+    args = parser.parse_args()
+
+    pk.configure_logging('debug' if args.verbose else 'quiet')
+    graph, index = load_keymap_index(args.keymap_file)
+    routes = KeymapRoutes(index, graph.macros(), graph.key_positions())
+    counter = HeatmapCounter(routes)
+
+    start = time.perf_counter()
+    characters = 0
+    for path in args.corpus:
+        if not os.path.exists(path):
+            pk.logger.error(f"Corpus file not found: {path}")
+            sys.exit(1)
+        characters += counter.feed_file(path, encoding=args.encoding)
+    presses, layer_activations, combos, unmapped = counter.results()
+    elapsed = time.perf_counter() - start
+
+    print(format_report(routes, characters, presses, layer_activations, combos, unmapped, args.top))
+    print(f"\nCounted {characters} characters in {elapsed:.2f}s")
+
+    if args.json:
+        pk.write_if_changed(args.json, json.dumps({
+            'keymap': args.keymap_file,
+            'characters': characters,
+            'presses': [{'layer': routes.layer_names[layer], 'position': position,
+                         'label': routes.labels.get(position, ''), 'count': count}
+                        for (layer, position), count in sorted(presses.items())],
+            'layer_activations': {routes.layer_names[layer]: count for layer, count in layer_activations.items()},
+            'combos': dict(combos),
+            'unmapped': dict(unmapped.most_common(50)),
+        }, indent=2))
+    if args.svg:
+        render_heatmap(routes, presses, args.svg)
+
+if __name__ == "__main__":
+    main()
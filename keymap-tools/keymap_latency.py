@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Static typing-latency analysis of a ZMK keymap.
+
+For every key position on every layer, estimates the worst-case delay
+between pressing the key and its tap reaching the host, from the combo
+and behavior timings in the config (combo timeout-ms, hold-tap and
+tap-dance tapping-term-ms, nested mod-morph bindings). Positions where a
+combo timeout stacks on top of a hold-tap or tap-dance decision are
+flagged.
+
+    python3 keymap_latency.py ../config/base.keymap
+    python3 keymap_latency.py ../config/base.keymap --svg out/latency.svg --all
+"""
+
+import argparse
+import os
+import sys
+from collections import namedtuple
+
+import keymap_pipeline as pk
+
+# Timings ZMK uses when a behavior or combo doesn't set them
+DEFAULT_COMBO_TIMEOUT_MS = 50
+DEFAULT_TAPPING_TERM_MS = 200
+
+# Built-in behaviors with a tapping term, as defined by ZMK's behaviors.dtsi
+BUILTIN_BEHAVIORS = {
+    'mt': {'compatible': '"zmk,behavior-hold-tap"', 'bindings': '<&kp>, <&kp>',
+           'flavor': '"hold-preferred"', 'tapping-term-ms': '<200>'},
+    'lt': {'compatible': '"zmk,behavior-hold-tap"', 'bindings': '<&mo>, <&kp>',
+           'flavor': '"tap-preferred"', 'tapping-term-ms': '<200>'},
+}
+
+# Worst-case delay thresholds for the SVG overlay classes
+LATENCY_CLASSES = ((0, ''), (50, 'latency-low'), (200, 'latency-mid'))
+
+OVERLAY_STYLE = """
+rect.latency-low { fill: #fff3c4; }
+rect.latency-mid { fill: #ffd08a; }
+rect.latency-high { fill: #ff9b85; }
+rect.latency-stacked { fill: #e05a5a; stroke: #8b0000; stroke-width: 2; }
+"""
+
+# Compiled key position indexes are shared with process_keymap.py's default stage cache
+INDEX_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), pk.CACHE_DIR_NAME)
+
+KeyLatency = namedtuple('KeyLatency', ['layer', 'position', 'label', 'binding', 'combo_ms', 'behavior_ms', 'total_ms', 'stacked', 'notes'])
+
+def resolve_number(value, macros, default=None):
+    """Resolve a property value such as '<HM_TAPPING_TERM>' to an int by expanding it with a pk.MacroTable."""
+    if value is None or value is True:
+        return default
+    text = macros.expand(value.strip().strip('<>')).strip()
+    if text.isdigit():
+        return int(text)
+    try:
+        return pk.evaluate_integer(text)
+    except ValueError:
+        pass
+    pk.logger.warning(f"Could not resolve timing value {value!r}")
+    return default
+
+def with_overrides(node, properties):
+    """Copy of node with properties applied on top of its own, leaving the node shared with the index untouched."""
+    copied = pk.DTNode(node.name, node.labels, node.parent, node.source, node.line)
+    copied.properties = {**node.properties, **properties}
+    copied.children = node.children
+    return copied
+
+def collect_behaviors(index):
+    """Map behavior labels to their nodes, including ZMK built-ins with their '&lt { ... };' overrides applied."""
+    behaviors = {}
+    for name, properties in BUILTIN_BEHAVIORS.items():
+        node = pk.DTNode(name, [name])
+        node.properties.update(properties)
+        behaviors[name] = node
+    for label, node in index.by_label.items():
+        if node.compatible:
+            behaviors[label] = node
+    for name, nodes in index.by_name.items():
+        if name.startswith('&') and name[1:] in behaviors:
+            for node in nodes:
+                behaviors[name[1:]] = with_overrides(behaviors[name[1:]], node.properties)
+    return behaviors
+
+class LatencyAnalyzer:
+    """Computes per-position worst-case tap latency from a DeviceTreeIndex."""
+
+    def __init__(self, index, macros):
+        self.index = index
+        self.macros = macros
+        self.behaviors = collect_behaviors(index)
+        self._behavior_delay = {}
+
+    def behavior_delay(self, binding, stack=()):
+        """Worst-case delay in ms before the tap of binding is sent, with a short explanation."""
+        name = binding.split()[0].lstrip('&')
+        if name in self._behavior_delay:
+            return self._behavior_delay[name]
+        node = self.behaviors.get(name)
+        if node is None or name in stack:
+            return 0, ''
+
+        compatible = node.compatible
+        nested = node.bindings()
+        delay, note = 0, ''
+        if compatible == 'zmk,behavior-hold-tap':
+            tapping_term = resolve_number(node.properties.get('tapping-term-ms'), self.macros, DEFAULT_TAPPING_TERM_MS)
+            tap_delay, tap_note = self.behavior_delay(nested[1], stack + (name,)) if len(nested) > 1 else (0, '')
+            delay = tapping_term + tap_delay
+            note = f"hold-tap {name} {tapping_term}ms"
+            prior_idle = resolve_number(node.properties.get('require-prior-idle-ms'), self.macros)
+            if prior_idle:
+                note += f" (instant after {prior_idle}ms typing)"
+            if tap_note:
+                note += f" + {tap_note}"
+        elif compatible == 'zmk,behavior-tap-dance':
+            tapping_term = resolve_number(node.properties.get('tapping-term-ms'), self.macros, DEFAULT_TAPPING_TERM_MS)
+            nested_delays = [self.behavior_delay(b, stack + (name,)) for b in nested]
+            worst = max(nested_delays, default=(0, ''))
+            delay = tapping_term + worst[0]
+            note = f"tap-dance {name} {tapping_term}ms" + (f" + {worst[1]}" if worst[1] else '')
+        elif compatible == 'zmk,behavior-mod-morph':
+            nested_delays = [self.behavior_delay(b, stack + (name,)) for b in nested]
+            delay, note = max(nested_delays, default=(0, ''))
+
+        self._behavior_delay[name] = (delay, note)
+        return delay, note
+
+    def combo_delays(self, layer_count):
+        """Map (layer, position) to the longest timeout-ms of the combos that hold that key back."""
+        delays = {}
+        for combo in self.index.combos():
+            timeout = resolve_number(combo.properties.get('timeout-ms'), self.macros, DEFAULT_COMBO_TIMEOUT_MS)
+            layers = self.index.resolve_layers(combo.tokens('layers')) or range(layer_count)
+            for position in self.index.resolve_positions(combo.tokens('key-positions')):
+                for layer in layers:
+                    current = delays.get((layer, position))
+                    if current is None or timeout > current[0]:
+                        delays[(layer, position)] = (timeout, combo.name)
+        return delays
+
+    def analyze(self, position_labels):
+        """Return a KeyLatency for every key position on every layer."""
+        layers = self.index.layers
+        combo_delays = self.combo_delays(len(layers))
+        layer_bindings = [layer.bindings() for layer in layers]
+        results = []
+        for layer_id, layer in enumerate(layers):
+            layer_name = layer.properties.get('display-name', layer.name)
+            layer_name = layer_name.strip('"') if isinstance(layer_name, str) else layer.name
+            for position, binding in enumerate(layer_bindings[layer_id]):
+                effective = binding
+                # Transparent keys fall through to the nearest lower layer
+                lower = layer_id
+                while effective.split()[0] == '&trans' and lower > 0:
+                    lower -= 1
+                    below = layer_bindings[lower]
+                    effective = below[position] if position < len(below) else '&none'
+                behavior_ms, behavior_note = self.behavior_delay(effective)
+                combo_ms, combo_name = combo_delays.get((layer_id, position), (0, ''))
+                notes = [n for n in (f"combo {combo_name} {combo_ms}ms" if combo_ms else '', behavior_note) if n]
+                results.append(KeyLatency(
+                    layer_name, position, position_labels.get(position, ''), binding,
+                    combo_ms, behavior_ms, combo_ms + behavior_ms,
+                    bool(combo_ms and behavior_ms), '; '.join(notes)))
+        return results
+
+def load_keymap_index(keymap_path):
+    """Build the include graph and devicetree index of keymap_path, returning (graph, index)."""
+    graph = pk.build_include_graph(keymap_path, cache_dir=INDEX_CACHE_DIR)
+    key_positions = graph.key_positions()
+    layer_defs_file = os.path.join(graph.base_dir, "includes", "layers_definitions.dtsi")
+    layer_definitions = pk.extract_layer_definitions(layer_defs_file, graph)
+    return graph, pk.build_devicetree_index(graph, key_positions, layer_definitions)
+
+def analyze_keymap(keymap_path):
+    """Build the include graph and devicetree index of keymap_path and analyze it."""
+    graph, index = load_keymap_index(keymap_path)
+    return LatencyAnalyzer(index, graph.macros()).analyze(graph.key_positions().labels)
+
+def format_table(results, show_all=False):
+    rows = [r for r in results if show_all or r.total_ms]
+    header = f"{'Layer':<12} {'Pos':>3} {'Label':<5} {'Binding':<28} {'Combo':>5} {'Behav':>5} {'Worst':>5}  Notes"
+    lines = [header, '-' * len(header)]
+    for r in rows:
+        flag = '!! ' if r.stacked else ''
+        lines.append(f"{r.layer[:12]:<12} {r.position:>3} {r.label:<5} {r.binding[:28]:<28} "
+                     f"{r.combo_ms:>5} {r.behavior_ms:>5} {r.total_ms:>5}  {flag}{r.notes}")
+    stacked = [r for r in results if r.stacked]
+    worst = max(results, key=lambda r: r.total_ms, default=None)
+    lines.append('')
+    lines.append(f"{len(results)} keys analyzed, {sum(1 for r in results if r.total_ms)} with a delay, "
+                 f"{len(stacked)} with stacked combo and behavior timeouts")
+    if worst is not None and worst.total_ms:
+        lines.append(f"Worst case: {worst.total_ms}ms at {worst.label or worst.position} on {worst.layer} ({worst.notes})")
+    return '\n'.join(lines)
+
+def latency_class(result):
+    if result.stacked:
+        return 'latency-stacked'
+    for limit, name in LATENCY_CLASSES:
+        if result.total_ms <= limit:
+            return name
+    return 'latency-high'
+
+def render_overlay(results, svg_path):
+    """Draw the keymap layout with each key labelled and coloured by its worst-case latency."""
+    layers = {}
+    for r in results:
+        key = {'t': f"{r.total_ms}ms" if r.total_ms else '', 's': r.binding.split()[0].lstrip('&')}
+        if r.combo_ms:
+            key['h'] = f"combo {r.combo_ms}"
+        css_class = latency_class(r)
+        if css_class:
+            key['type'] = css_class
+        layers.setdefault(r.layer, []).append(key)
+
+    pk.draw_overlay(layers, svg_path, OVERLAY_STYLE)
+    pk.logger.info(f"Latency overlay written to {svg_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate worst-case tap latency per key position and layer.")
+    parser.add_argument('keymap_file', help="path to the keymap, e.g. ../config/base.keymap")
+    parser.add_argument('--all', action='store_true', help="list keys without any delay as well")
+    parser.add_argument('--svg', metavar='PATH', help="also draw an SVG overlay of the latencies")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show include and parsing details")
+    args = parser.parse_args()
+
+    pk.configure_logging('debug' if args.verbose else 'quiet')
+    if not os.path.exists(args.keymap_file):
+        pk.logger.error(f"Keymap file not found: {args.keymap_file}")
+        sys.exit(1)
+
+    results = analyze_keymap(args.keymap_file)
+    print(format_table(results, args.all))
+
+    if args.svg:
+        render_overlay(results, args.svg)
+
+if __name__ == "__main__":
+    main()
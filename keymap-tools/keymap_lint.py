@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Lint a ZMK keymap without drawing it, fast enough for a pre-commit hook.
+
+Reports key-position labels that don't resolve, undefined layers and
+combo clashes with file and line, and exits with status 1 on errors:
+
+    python3 keymap_lint.py ../config/base.keymap
+
+Only keymap_source.py is imported (not keymap_pipeline.py, yaml or
+keymap_drawer), so startup is dominated by the interpreter itself.
+process_keymap.py --check runs the same checks without loading the
+pipeline.
+"""
+
+import gc
+import os
+import sys
+from collections import namedtuple
+
+from keymap_source import (KEY_POSITION_PROPERTIES, LAYER_BEHAVIORS, LAYER_PROPERTIES,
+                           build_devicetree_index, build_include_graph, extract_layer_definitions)
+
+# A problem found by check_keymap(), printed as path:line: severity: message
+Problem = namedtuple('Problem', ['severity', 'path', 'line', 'message'])
+
+# Defines from ZMK's own headers, which are skipped when resolving includes
+ZMK_DEFINES = {'MACRO_PLACEHOLDER': '0'}
+
+def check_key_positions(index, key_positions):
+    """Key-position tokens that are neither a known label nor a position on the board."""
+    problems = []
+    key_count = max(key_positions.labels) + 1 if getattr(key_positions, 'labels', None) else None
+    for root in index.roots:
+        for node in root.walk():
+            for name in KEY_POSITION_PROPERTIES:
+                for token in index.expand(node.tokens(name)):
+                    if token in key_positions:
+                        continue
+                    value = index.macros.expand(token).strip()
+                    if not value.isdigit():
+                        problems.append(Problem('error', node.source, node.line, f"{node.name}: unknown key position label {token} in {name}"))
+                    elif key_count is not None and int(value) >= key_count:
+                        problems.append(Problem('error', node.source, node.line, f"{node.name}: key position {token} is out of range, the board has {key_count} keys"))
+    return problems
+
+def check_layers(index, layer_ids):
+    """Layer references in layers/if-layers/then-layer and &mo/&lt/&to/&tog/&sl bindings that don't exist."""
+    problems = []
+    layer_count = len(index.layers)
+
+    def check(node, token, where):
+        value = token if token in layer_ids else index.macros.expand(token).strip()
+        value = layer_ids.get(value, ZMK_DEFINES.get(value, value))
+        if not str(value).isdigit():
+            problems.append(Problem('error', node.source, node.line, f"{node.name}: undefined layer {token} in {where}"))
+        elif layer_count and int(value) >= layer_count:
+            problems.append(Problem('error', node.source, node.line,
+                                    f"{node.name}: layer {token} ({value}) in {where} doesn't exist, the keymap has {layer_count} layers"))
+
+    for root in index.roots:
+        for node in root.walk():
+            for name in LAYER_PROPERTIES:
+                for token in node.tokens(name):
+                    check(node, token, name)
+            for binding in node.bindings():
+                parts = binding.split()
+                if parts[0] in LAYER_BEHAVIORS and len(parts) > 1:
+                    check(node, parts[1], binding)
+    return problems
+
+def check_combos(index):
+    """Duplicate combo names and combos using the same key positions on a shared layer."""
+    problems = []
+    all_layers = set(range(len(index.layers)))
+    seen = {}
+    by_positions = {}
+    for combo in index.combos():
+        if combo.name in seen:
+            first = seen[combo.name]
+            problems.append(Problem('error', combo.source, combo.line,
+                                    f"duplicate combo name {combo.name}, first defined at {first.source}:{first.line}"))
+        else:
+            seen[combo.name] = combo
+        positions = frozenset(index.resolve_positions(combo.tokens('key-positions')))
+        layers = set(index.resolve_layers(combo.tokens('layers'))) or all_layers
+        for other, other_layers in by_positions.get(positions, ()):
+            shared = layers & other_layers
+            if shared:
+                names = [layer.name for i, layer in enumerate(index.layers) if i in shared] or sorted(shared)
+                problems.append(Problem('error', combo.source, combo.line,
+                                        f"combos {other.name} and {combo.name} use the same key positions on layers {', '.join(map(str, names))}"))
+        by_positions.setdefault(positions, []).append((combo, layers))
+    return problems
+
+def check_keymap(keymap_path):
+    """Lint a keymap without drawing it: unresolved key-position labels, undefined layers and combo clashes.
+
+    Only the include graph and the devicetree parser are used, so this
+    runs without yaml or keymap_drawer. The few files of a keymap are read
+    without a thread pool. Returns a list of Problems.
+    """
+    graph = build_include_graph(keymap_path, workers=1)
+    if not graph.keymap_content:
+        return [Problem('error', keymap_path, 0, "keymap is empty or can't be read")]
+    key_positions = graph.key_positions()
+    layer_defs_file = os.path.join(graph.base_dir, "includes", "layers_definitions.dtsi")
+    layer_ids = extract_layer_definitions(layer_defs_file, graph)
+    index = build_devicetree_index(graph, key_positions, layer_ids)
+
+    problems = []
+    if not key_positions:
+        problems.append(Problem('error', keymap_path, 0, "no key positions found, is the key-labels header included?"))
+    else:
+        problems.extend(check_key_positions(index, key_positions))
+    problems.extend(check_layers(index, layer_ids))
+    if key_positions:
+        # Without positions every combo would clash with every other one
+        problems.extend(check_combos(index))
+    return problems
+
+def report_problems(problems):
+    """Print problems like a compiler does and return the number of errors."""
+    for problem in problems:
+        print(f"{problem.path}:{problem.line}: {problem.severity}: {problem.message}")
+    errors = sum(1 for problem in problems if problem.severity == 'error')
+    warnings = len(problems) - errors
+    print(f"{errors} error(s), {warnings} warning(s)" if problems else "No problems found")
+    return errors
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    if not args or args[0] in ('-h', '--help'):
+        print("usage: keymap_lint.py KEYMAP [KEYMAP ...]")
+        sys.exit(0 if args else 2)
+    # A lint run is short and allocates thousands of nodes without cycles to
+    # collect, so the cyclic garbage collector only slows it down
+    gc.disable()
+    errors = 0
+    for keymap_path in args:
+        errors += report_problems(check_keymap(keymap_path))
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1393 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import logging
+import hashlib
+import io
+import json
+import re
+import os
+import select
+import struct
+import sys
+import time
+from collections import Counter
+
+# Reading the keymap (preprocessor, includes, macros, devicetree) lives in
+# keymap_source.py, #if arithmetic in keymap_expr.py and the --check lint in
+# keymap_lint.py, none of which import logging or yaml; process_keymap.py
+# runs --check without importing this module. The names the other tools use
+# through this module are re-exported here.
+from keymap_expr import evaluate_integer
+from keymap_source import (DTNode, DeviceTreeIndex, IncludeResolver, MacroTable, build_devicetree_index,
+                           build_include_graph, clear_memos, extract_defines, extract_key_positions,
+                           extract_layer_definitions, find_includes, hash_text, load_source, parse_devicetree,
+                           profiler, read_file)
+
+# yaml, gzip, subprocess, multiprocessing and keymap_drawer are imported where
+# they are used
+
+logger = logging.getLogger("process_keymap")
+
+LOG_LEVELS = {
+    'quiet': logging.WARNING,
+    'normal': logging.INFO,
+    'debug': logging.DEBUG,
+}
+
+class ConsoleFormatter(logging.Formatter):
+    """Print informational messages as-is and prefix warnings and errors with their level."""
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.levelno >= logging.WARNING:
+            return f"{record.levelname}: {message}"
+        return message
+
+def configure_logging(verbosity='normal'):
+    """Send this script's log messages to stdout at the given verbosity (quiet, normal or debug)."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(ConsoleFormatter())
+    logger.handlers[:] = [handler]
+    logger.setLevel(LOG_LEVELS[verbosity])
+    logger.propagate = False
+
+SYMBOL_NAME_PATTERN = re.compile(r'^[A-Z_]+$')
+SYMBOL_TOKEN_PATTERN = re.compile(r'\b[A-Z_]+\b')
+
+def build_symbol_table(defines):
+    """Select the defines that look like layer names (all caps with underscores) and have numeric values."""
+    symbols = {}
+    for name, value in defines.items():
+        if not SYMBOL_NAME_PATTERN.match(name):
+            continue
+        try:
+            # Try to convert to int to verify it's a number
+            int(value)
+        except ValueError:
+            # Not a numeric value, skip
+            continue
+        symbols[name] = value
+    return symbols
+
+def substitute_symbols(content, symbols):
+    """Replace every whole-word occurrence of a symbol with its value in a single pass.
+
+    Candidate words are found by one token regex and looked up in the symbol
+    table, so the cost is linear in the content size regardless of how many
+    symbols are defined. Returns the new content and a Counter of hits per symbol.
+    """
+    hits = Counter()
+    if not symbols:
+        return content, hits
+
+    def replace(match):
+        name = match.group(0)
+        value = symbols.get(name)
+        if value is None:
+            return name
+        hits[name] += 1
+        return value
+
+    return SYMBOL_TOKEN_PATTERN.sub(replace, content), hits
+
+def normalize_keymap(keymap_content):
+    """Clean up and normalize the keymap file content."""
+    # Remove comments
+    keymap_content = re.sub(r'//.*$', '', keymap_content, flags=re.MULTILINE)
+    
+    # Remove empty lines
+    keymap_content = re.sub(r'\n\s*\n', '\n', keymap_content)
+    
+    return keymap_content
+
+_yaml = None
+
+def load_yaml_module():
+    """Import yaml once, preferring the libyaml C loader and dumper, which are much faster on large layouts."""
+    global _yaml
+    if _yaml is None:
+        import yaml
+        try:
+            from yaml import CSafeDumper as YamlDumper, CSafeLoader as YamlLoader
+        except ImportError:
+            from yaml import SafeDumper as YamlDumper, SafeLoader as YamlLoader
+        _yaml = (yaml, YamlLoader, YamlDumper)
+    return _yaml
+
+def load_yaml(text):
+    """Parse a YAML document, using libyaml when available."""
+    yaml, loader, _ = load_yaml_module()
+    return yaml.load(text, Loader=loader)
+
+def dump_yaml(data):
+    """Serialize a YAML document, using libyaml when available."""
+    yaml, _, dumper = load_yaml_module()
+    return yaml.dump(data, Dumper=dumper, default_flow_style=False, sort_keys=False, allow_unicode=True)
+
+def process_keymap(keymap_path, output_path, graph=None):
+    """Process the keymap file and its includes to create a consolidated keymap."""
+    if graph is None:
+        graph = build_include_graph(keymap_path)
+    
+    keymap_content = graph.keymap_content
+    if not keymap_content:
+        return ""
+    
+    # Extract all #define statements
+    with profiler.stage("define extraction") as stage:
+        defines = graph.defines()
+        stage['items'] = len(defines)
+    
+    # Extract key position definitions
+    with profiler.stage("key-position mapping") as stage:
+        key_positions = graph.key_positions()
+        stage['items'] = len(key_positions)
+    
+    # Normalize the keymap content
+    processed_content = normalize_keymap(keymap_content)
+    
+    # Replace key positions in key-positions attributes
+    unmapped = Counter()
+    def replace_key_positions(match):
+        positions_str = match.group(1)
+        positions = re.findall(r'(\w+)', positions_str)
+        numeric_positions = []
+        
+        for pos in positions:
+            numeric_pos = key_positions.get(pos)
+            if numeric_pos is None:
+                unmapped[pos] += 1
+                numeric_pos = pos
+            numeric_positions.append(numeric_pos)
+        
+        return f'key-positions = <{" ".join(numeric_positions)}>;'
+    
+    key_pos_pattern = r'key-positions\s*=\s*<([^>]+)>;'
+    with profiler.stage("key-position mapping") as stage:
+        processed_content, stage['items'] = re.subn(key_pos_pattern, replace_key_positions, processed_content)
+    for pos, count in unmapped.items():
+        logger.warning(f"No mapping found for {pos} ({count} occurrence(s)), keeping as is")
+    
+    # Replace layer references
+    with profiler.stage("layer substitution") as stage:
+        layer_symbols = build_symbol_table(defines)
+        processed_content, symbol_hits = substitute_symbols(processed_content, layer_symbols)
+        stage['items'] = sum(symbol_hits.values())
+    
+    logger.info(f"Made {len(symbol_hits)} layer name replacements")
+    for name, hits in symbol_hits.most_common():
+        logger.debug(f"  {name} -> {layer_symbols[name]}: {hits} occurrence(s)")
+    
+    # Create a human-readable layer mapping
+    layer_names = {}
+    for name, id_str in layer_symbols.items():
+        layer_names[int(id_str)] = name
+    
+    # Print layer mapping
+    logger.info("\nLayer mapping:")
+    for layer_id in sorted(layer_names.keys()):
+        logger.info(f"Layer {layer_id}: {layer_names[layer_id]}")
+    
+    # Variant flags go first so keymap-drawer's preprocessor takes the same #ifdef branches
+    if graph.flags:
+        flag_lines = [f"#define {name} {value}".rstrip() for name, value in graph.flags.items()]
+        processed_content = '\n'.join(flag_lines) + '\n' + processed_content
+    
+    # Return the processed content
+    return processed_content
+
+def process_combos(combo_file_path, key_positions, layer_definitions=None, index=None):
+    """Extract combo definitions for keymap-drawer from the devicetree index.
+
+    Without an index, combo_file_path is parsed on its own.
+    """
+    if index is None:
+        if not os.path.exists(combo_file_path):
+            logger.warning(f"Combos file not found at {combo_file_path}")
+            return []
+        
+        combos_content = read_file(combo_file_path)
+        if not combos_content:
+            logger.warning("Combos file is empty")
+            return []
+        
+        index = DeviceTreeIndex(key_positions, layer_definitions)
+        index.add_tree(parse_devicetree(combos_content, combo_file_path))
+    
+    yaml_combos = []
+    combo_nodes = index.combos()
+    
+    for node in combo_nodes:
+        # Extract key positions
+        positions = index.resolve_positions(node.tokens('key-positions'))
+        if not positions:
+            continue
+            
+        # Extract binding
+        bindings = node.cells('bindings')
+        if not bindings:
+            continue
+            
+        binding = bindings[0]
+        
+        # Extract key character from binding
+        key_char = binding
+        if '&kp ' in binding:
+            key_char = binding.replace('&kp ', '')
+            
+        # Add the combo to our list with just positions and key
+        yaml_combos.append({
+            'p': positions,
+            'k': key_char
+        })
+    
+    logger.info(f"Processed {len(combo_nodes)} combos, extracted {len(yaml_combos)} valid combos")
+    
+    # For debugging, print the first few combos
+    if yaml_combos:
+        logger.debug("Sample of extracted combos:")
+        for i, combo in enumerate(yaml_combos[:3]):
+            logger.debug(f"  Combo {i+1}: positions={combo['p']}, key={combo['k']}")
+    else:
+        logger.warning("No combos were extracted")
+    
+    return yaml_combos
+
+CACHE_DIR_NAME = ".cache"
+CACHE_ENTRIES_PER_STAGE = 8
+
+def hash_include_graph(graph, *extra):
+    """Hash the full include graph (paths and contents), variant flags and any extra inputs."""
+    parts = []
+    for path, content in graph.contents.items():
+        parts.append(os.path.normpath(path))
+        parts.append(content)
+    if graph.flags:
+        parts.append(json.dumps(sorted(graph.flags.items())))
+    parts.extend(extra)
+    return hash_text(*parts)
+
+def hash_file(path):
+    """Return a sha256 hex digest of a file's bytes, so binary outputs like .svgz can be checked too."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def write_if_changed(path, content):
+    """Write content (text or bytes) to path unless the file already holds exactly that content."""
+    binary = 'b' if isinstance(content, bytes) else ''
+    try:
+        with open(path, 'r' + binary) as f:
+            if f.read() == content:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    with open(path, 'w' + binary) as f:
+        f.write(content)
+    return True
+
+class StageCache:
+    """Content-addressed cache for the intermediate results of each pipeline stage.
+
+    Entries are stored as <stage>-<key><ext> files in the cache directory, where
+    key is a hash of everything the stage depends on. A manifest records the
+    inputs and outputs of the last complete run so unchanged keymaps can exit early.
+    """
+
+    def __init__(self, cache_dir, enabled=True, manifest_name="manifest.json"):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.manifest_name = manifest_name
+        if enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, stage, key, ext):
+        return os.path.join(self.cache_dir, f"{stage}-{key}{ext}")
+
+    def get(self, stage, key, ext):
+        """Return the cached text for a stage, or None on a miss."""
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(stage, key, ext), 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, stage, key, ext, content):
+        """Store the text produced by a stage and drop its oldest entries."""
+        if not self.enabled:
+            return
+        path = self._path(stage, key, ext)
+        # Per-process temporary name, variants may be rendered in parallel
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        self._prune(stage)
+
+    def _prune(self, stage):
+        prefix = stage + "-"
+        entries = [
+            entry for entry in os.scandir(self.cache_dir)
+            if entry.name.startswith(prefix) and not entry.name.endswith(".tmp")
+        ]
+        if len(entries) <= CACHE_ENTRIES_PER_STAGE:
+            return
+        try:
+            entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        except OSError:
+            # Pruned concurrently by another process
+            return
+        for entry in entries[CACHE_ENTRIES_PER_STAGE:]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def load_manifest(self):
+        if not self.enabled:
+            return {}
+        try:
+            with open(os.path.join(self.cache_dir, self.manifest_name), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        if not self.enabled:
+            return
+        with open(os.path.join(self.cache_dir, self.manifest_name), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    def outputs_unchanged(self, inputs_key):
+        """Check whether the last run had the same inputs and its outputs are still intact."""
+        manifest = self.load_manifest()
+        if manifest.get('inputs') != inputs_key:
+            return False
+        for path, expected in manifest.get('outputs', {}).items():
+            try:
+                if hash_file(path) != expected:
+                    return False
+            except OSError:
+                return False
+        return bool(manifest.get('outputs'))
+
+    def record_outputs(self, inputs_key, output_paths):
+        outputs = {path: hash_file(path) for path in output_paths}
+        self.save_manifest({'inputs': inputs_key, 'outputs': outputs})
+
+_drawer_version = None
+
+def drawer_version():
+    """Version of the installed keymap-drawer package, or '' when it isn't installed."""
+    global _drawer_version
+    if _drawer_version is None:
+        from importlib import metadata
+        try:
+            _drawer_version = metadata.version("keymap-drawer")
+        except metadata.PackageNotFoundError:
+            _drawer_version = ""
+    return _drawer_version
+
+def script_fingerprint():
+    """Hash of the processing code and the keymap-drawer version, so upgrading either invalidates cached results."""
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+    parts = []
+    for name in ("keymap_pipeline.py", "keymap_source.py", "keymap_expr.py"):
+        with open(os.path.join(tools_dir, name), 'r') as f:
+            parts.append(f.read())
+    return hash_text(*parts, f"keymap-drawer {drawer_version()}")
+
+def drawer_config_path(output_path):
+    """Location of keymap_drawer.config.yaml, next to the output directory."""
+    return os.path.join(os.path.dirname(os.path.dirname(output_path)), "keymap_drawer.config.yaml")
+
+_keymap_drawer = None
+
+def load_keymap_drawer():
+    """Import keymap_drawer once for in-process use, or return None so callers fall back to a subprocess."""
+    global _keymap_drawer
+    if _keymap_drawer is None:
+        try:
+            from keymap_drawer.config import Config, DrawConfig
+            from keymap_drawer.draw import KeymapDrawer
+            from keymap_drawer.keymap import ComboSpec, KeymapData, LayoutKey
+            from keymap_drawer.parse import ZmkKeymapParser
+
+            class LayerKeymapDrawer(KeymapDrawer):
+                """KeymapDrawer that also links activators of layers missing from its keymap, for drawing one layer at a time."""
+
+                def __init__(self, *args, layer_names=(), **kwargs):
+                    self.extra_layer_names = set(layer_names)
+                    super().__init__(*args, **kwargs)
+
+                @property
+                def layer_names(self):
+                    return self._layer_names
+
+                @layer_names.setter
+                def layer_names(self, names):
+                    self._layer_names = set(names) | self.extra_layer_names
+
+            _keymap_drawer = {
+                'ComboSpec': ComboSpec,
+                'Config': Config,
+                'DrawConfig': DrawConfig,
+                'KeymapData': KeymapData,
+                'LayoutKey': LayoutKey,
+                'KeymapDrawer': KeymapDrawer,
+                'LayerKeymapDrawer': LayerKeymapDrawer,
+                'ZmkKeymapParser': ZmkKeymapParser,
+            }
+        except ImportError as e:
+            logger.info(f"keymap_drawer can't be imported ({e}), calling it as a subprocess instead")
+            _keymap_drawer = {}
+    return _keymap_drawer or None
+
+def drawer_parse(keymap_path):
+    """Parse a processed ZMK keymap with keymap-drawer and return the keymap document as a dict."""
+    drawer = load_keymap_drawer()
+    if drawer is None:
+        import subprocess
+        result = subprocess.run([sys.executable, "-m", "keymap_drawer", "parse", "-z", keymap_path],
+                                check=True, capture_output=True, text=True)
+        return load_yaml(result.stdout)
+
+    config = drawer['Config']()
+    with open(keymap_path, 'r') as f:
+        return drawer['ZmkKeymapParser'](config.parse_config, None).parse(f)
+
+# Behaviors whose bindings keymap-drawer's ZMK parser resolves, with the number of bindings it uses
+DRAWER_BEHAVIORS = (
+    ('zmk,behavior-hold-tap', 'hold_taps', 2),
+    ('zmk,behavior-mod-morph', 'mod_morphs', 2),
+    ('zmk,behavior-sticky-key', 'sticky_keys', 1),
+)
+
+def layer_display_name(node):
+    """Layer name as keymap-drawer derives it: its label or display-name, else the node name."""
+    for name in ('label', 'display-name'):
+        value = node.properties.get(name)
+        if isinstance(value, str):
+            return value.strip('"')
+    return node.name.removeprefix("layer_").removesuffix("_layer")
+
+def emit_keymap_document(index, layer_symbols, layout=None):
+    """Build the keymap-drawer document (layout, layers, combos) directly from the devicetree index.
+
+    Bindings are turned into legends by keymap-drawer's own ZMK parser, fed
+    with the hold-taps, mod-morphs, sticky keys and conditional layers of
+    index, so the result matches what 'keymap_drawer parse -z' would make of
+    the full config without writing and re-parsing the processed keymap.
+    layer_symbols maps layer names to numbers, see build_symbol_table().
+    Returns None when keymap_drawer can't be imported.
+    """
+    drawer = load_keymap_drawer()
+    if drawer is None:
+        return None
+
+    def resolve(binding):
+        return substitute_symbols(binding, layer_symbols)[0]
+
+    parser = drawer['ZmkKeymapParser'](drawer['Config']().parse_config, None)
+    for compatible, behaviors, count in DRAWER_BEHAVIORS:
+        for node in index.nodes(compatible):
+            bindings = [resolve(binding) for binding in node.bindings()]
+            if node.labels and len(bindings) >= count:
+                getattr(parser, behaviors)[f"&{node.labels[0]}"] = bindings[:count]
+    for parent in index.nodes('zmk,conditional-layers'):
+        for node in parent.children:
+            then_layer = index.resolve_layers(node.tokens('then-layer'))
+            if_layers = index.resolve_layers(node.tokens('if-layers'))
+            if then_layer and if_layers:
+                parser.conditional_layers[then_layer[0]] = if_layers
+
+    layer_nodes = [node for node in index.layers if node.properties.get('status') != '"reserved"']
+    parser.update_layer_names([layer_display_name(node) for node in layer_nodes])
+
+    def legend(binding, layer, positions, **kwargs):
+        try:
+            return parser._str_to_key(resolve(binding), layer, positions, **kwargs)
+        except (ValueError, IndexError) as e:
+            logger.warning(f"Could not parse binding {binding!r} ({e}), drawing it as is")
+            return drawer['LayoutKey'](tap=binding)
+
+    layers = {}
+    for layer, (name, node) in enumerate(zip(parser.layer_names, layer_nodes)):
+        layers[name] = [legend(binding, layer, [position]) for position, binding in enumerate(node.bindings())]
+
+    combos = []
+    skipped = []
+    for node in index.combos():
+        positions = index.resolve_positions(node.tokens('key-positions'))
+        bindings = node.bindings()
+        if len(positions) < 2 or not bindings:
+            skipped.append(node.name)
+            continue
+        combo = {'k': legend(bindings[0], None, positions, no_shifted=True), 'p': positions}
+        combo_layers = [layer for layer in index.resolve_layers(node.tokens('layers')) if layer < len(layer_nodes)]
+        if combo_layers:
+            combo['l'] = [parser.layer_names[layer] for layer in combo_layers]
+        # Per-combo overrides from parse_config.zmk_combos, as keymap-drawer applies them
+        overrides = drawer['ComboSpec'].normalize_fields(dict(parser.cfg.zmk_combos.get(node.name, {})))
+        combos.append(drawer['ComboSpec'](**(combo | overrides)))
+    if skipped:
+        # Without a key-labels header every combo ends up here, so report them together
+        shown = ', '.join(skipped[:5]) + (f" and {len(skipped) - 5} more" if len(skipped) > 5 else "")
+        logger.warning(f"Skipping {len(skipped)} combo(s) without a binding or resolvable key positions: {shown}")
+
+    keymap_data = drawer['KeymapData'](layers=parser.add_held_keys(layers), combos=combos, layout=None, config=None)
+    document = keymap_data.dump()
+    return ({'layout': layout} | document) if layout else document
+
+def drawer_config(drawer, yaml_data):
+    """keymap-drawer Config with the draw_config section of yaml_data applied."""
+    config = drawer['Config']()
+    if custom_config := yaml_data.get("draw_config"):
+        draw_config_cls = drawer['DrawConfig']
+        validate = getattr(draw_config_cls, "model_validate", None) or draw_config_cls.parse_obj
+        config.draw_config = validate(config.draw_config.model_dump() | custom_config)
+    return config
+
+def drawer_draw(yaml_data, yaml_path, layer_names=None):
+    """Draw the keymap described by yaml_data (already saved at yaml_path) and return the SVG text.
+
+    layer_names lists every layer of the full keymap when yaml_data holds
+    only some of them, so keys activating the others are still styled and
+    linked as layer activators. It needs keymap_drawer to be importable.
+    """
+    drawer = load_keymap_drawer()
+    if drawer is None:
+        import subprocess
+        result = subprocess.run([sys.executable, "-m", "keymap_drawer", "draw", yaml_path],
+                                check=True, capture_output=True, text=True)
+        return result.stdout
+
+    out = io.StringIO()
+    extra = {} if layer_names is None else {'layer_names': layer_names}
+    keymap_drawer = drawer['LayerKeymapDrawer' if extra else 'KeymapDrawer'](
+        config=drawer_config(drawer, yaml_data),
+        out=out,
+        layers=yaml_data["layers"],
+        layout=yaml_data.get("layout", {}),
+        combos=yaml_data.get("combos", []),
+        **extra,
+    )
+    keymap_drawer.print_board()
+    return out.getvalue()
+
+def draw_overlay(layers, svg_path, extra_style='', config_path=None):
+    """Draw annotated keys on the Sofle layout, e.g. for latency or heat overlays.
+
+    layers maps layer names to lists of keymap-drawer key dicts ('t', 'h',
+    's', 'type'), extra_style is CSS for the 'type' classes. The keymap
+    document is saved next to the SVG with a .yaml extension.
+    """
+    if config_path is None:
+        config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keymap_drawer.config.yaml")
+    yaml_data = {'layout': {'zmk_keyboard': 'sofle'}, 'layers': layers}
+    if os.path.exists(config_path):
+        yaml_data.update(load_yaml(read_file(config_path)) or {})
+    draw_config = dict(yaml_data.get('draw_config') or {})
+    draw_config['svg_extra_style'] = draw_config.get('svg_extra_style', '') + extra_style
+    yaml_data['draw_config'] = draw_config
+    yaml_data.pop('board', None)
+
+    yaml_path = os.path.splitext(svg_path)[0] + ".yaml"
+    os.makedirs(os.path.dirname(svg_path) or '.', exist_ok=True)
+    write_if_changed(yaml_path, dump_yaml(yaml_data))
+    write_if_changed(svg_path, drawer_draw(yaml_data, yaml_path))
+
+LAYERS_DIR_NAME = "layers"
+
+SVG_HEADER_PATTERN = re.compile(r'<svg width="(\d+)" height="(\d+)" viewBox="[^"]*"([^>]*)>\n')
+GLYPH_DEFS_PATTERN = re.compile(r'<defs>/\* start glyphs \*/\n(.*?)</defs>/\* end glyphs \*/\n', re.DOTALL)
+GLYPH_PATTERN = re.compile(r'<svg id="([^"]+)">\n.*?\n</svg>\n', re.DOTALL)
+STYLE_PATTERN = re.compile(r'<style>.*?</style>\n', re.DOTALL)
+LAYER_GROUP_PATTERN = re.compile(r'<g transform="translate\(([-\d.]+), [-\d.]+\)" class="layer-')
+
+def layer_file_name(layer_name):
+    """File and cache stage name of a layer, e.g. 'Mouse Fast' -> Mouse_Fast."""
+    return re.sub(r'[^A-Za-z0-9_]+', '_', layer_name).strip('_') or "layer"
+
+def layer_split_supported(yaml_data, draw_config):
+    """Layers can be stitched when they are stacked in one column with nothing drawn below them."""
+    if draw_config.n_columns != 1 or draw_config.footer_text or draw_config.separate_combo_diagrams:
+        return False
+    return not any(combo.get('draw_separate') for combo in yaml_data.get('combos', []))
+
+def layer_document(yaml_data, layer_name):
+    """Copy of the keymap document holding only layer_name and the combos drawn on it."""
+    document = {key: value for key, value in yaml_data.items() if key not in ('layers', 'combos')}
+    document['layers'] = {layer_name: yaml_data['layers'][layer_name]}
+    combos = []
+    for combo in yaml_data.get('combos', []):
+        if not combo.get('l') or layer_name in combo['l']:
+            combos.append(combo | {'l': [layer_name]} if combo.get('l') else combo)
+    if combos:
+        document['combos'] = combos
+    return document
+
+def _draw_layer(layer_name, document, yaml_path, layer_names):
+    return layer_name, drawer_draw(document, yaml_path, layer_names)
+
+def split_layer_svg(svg):
+    """Break a single-layer SVG into its size, glyph definitions, style and layer group."""
+    header = SVG_HEADER_PATTERN.match(svg)
+    style = STYLE_PATTERN.search(svg, header.end())
+    defs = GLYPH_DEFS_PATTERN.search(svg, header.end(), style.start())
+    glyphs = {m.group(1): m.group(0) for m in GLYPH_PATTERN.finditer(defs.group(1))} if defs else {}
+    body = svg[style.end():svg.rindex('</svg>')]
+    return {
+        'width': int(header.group(1)), 'height': int(header.group(2)), 'attributes': header.group(3),
+        'glyphs': glyphs, 'style': style.group(0), 'body': body,
+    }
+
+def stitch_layer_svgs(fragments, outer_pad_h):
+    """Stack single-layer SVGs into one document the way keymap-drawer lays out a single column.
+
+    Every fragment is drawn at y = 0 and is outer_pad_h taller than the
+    space its layer takes up, so each layer group is moved down by the
+    heights of the ones above it and the glyph definitions are merged.
+    """
+    parts = [split_layer_svg(svg) for svg in fragments]
+    glyphs = {}
+    body = []
+    y = 0
+    for part in parts:
+        glyphs.update(part['glyphs'])
+        body.append(LAYER_GROUP_PATTERN.sub(
+            lambda m: f'<g transform="translate({m.group(1)}, {y})" class="layer-', part['body'], count=1))
+        y += part['height'] - round(outer_pad_h)
+    width = max(part['width'] for part in parts)
+    height = y + round(outer_pad_h)
+    svg = [f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}"{parts[0]["attributes"]}>\n']
+    if glyphs:
+        svg.append("<defs>/* start glyphs */\n")
+        svg.extend(glyphs[name] for name in sorted(glyphs))
+        svg.append("</defs>/* end glyphs */\n")
+    svg.append(parts[0]['style'])
+    svg.extend(body)
+    svg.append("</svg>\n")
+    return ''.join(svg)
+
+def draw_layers_split(yaml_data, layers_dir, cache, fingerprint, jobs=None):
+    """Draw every layer as its own SVG in a process pool and stitch them into the full keymap.
+
+    Fragments are cached per layer under a key of that layer's bindings, the
+    combos drawn on it and the rest of the document, so editing one layer
+    only redraws that layer. Returns the combined SVG and the per-layer
+    SVG paths written to layers_dir, or None when the draw config lays
+    layers out in a way that can't be stitched.
+    """
+    drawer = load_keymap_drawer()
+    if drawer is None:
+        logger.info("Drawing layers separately needs keymap_drawer in-process, drawing the keymap in one piece")
+        return None
+    draw_config = drawer_config(drawer, yaml_data).draw_config
+    if not layer_split_supported(yaml_data, draw_config):
+        logger.info("Layers are drawn in columns, with a footer or with separate combo diagrams, drawing the keymap in one piece")
+        return None
+    layer_names = list(yaml_data['layers'])
+    
+    os.makedirs(layers_dir, exist_ok=True)
+    fragments = {}
+    pending = {}
+    for layer_name in layer_names:
+        document = layer_document(yaml_data, layer_name)
+        stage = f"layer_{layer_file_name(layer_name)}"
+        key = hash_text(json.dumps([document, layer_names], sort_keys=True), fingerprint)
+        fragment = cache.get(stage, key, ".svg")
+        if fragment is None:
+            yaml_path = os.path.join(layers_dir, layer_file_name(layer_name) + ".yaml")
+            write_if_changed(yaml_path, dump_yaml(document))
+            pending[layer_name] = (stage, key, document, yaml_path)
+        else:
+            fragments[layer_name] = fragment
+    
+    if pending:
+        logger.info(f"Drawing {len(pending)} of {len(layer_names)} layers, reusing the rest")
+        if len(pending) == 1 or jobs == 1:
+            drawn = [_draw_layer(name, document, yaml_path, layer_names)
+                     for name, (_, _, document, yaml_path) in pending.items()]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = [pool.submit(_draw_layer, name, document, yaml_path, layer_names)
+                           for name, (_, _, document, yaml_path) in pending.items()]
+                drawn = [future.result() for future in futures]
+        for layer_name, fragment in drawn:
+            stage, key, _, _ = pending[layer_name]
+            cache.put(stage, key, ".svg", fragment)
+            fragments[layer_name] = fragment
+    else:
+        logger.info(f"Reusing all {len(fragments)} cached layer drawings")
+    
+    layer_paths = []
+    for layer_name in layer_names:
+        path = os.path.join(layers_dir, layer_file_name(layer_name) + ".svg")
+        write_if_changed(path, fragments[layer_name])
+        layer_paths.append(path)
+    svg = stitch_layer_svgs([fragments[name] for name in layer_names], draw_config.outer_pad_h)
+    return svg, layer_paths
+
+SVG_TAG_PATTERN = re.compile(r'<(\w+)((?:\s+[\w:-]+="[^"]*")*)\s*(/?)>')
+SVG_ATTRIBUTE_PATTERN = re.compile(r'\s+([\w:-]+)="([^"]*)"')
+SVG_ID_PATTERN = re.compile(r'\sid="([^"]+)"')
+CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_SPACING_PATTERN = re.compile(r'\s*([{};,>])\s*')
+
+def unused_name(prefix, taken):
+    """First of prefix0, prefix1, ... that is not in taken, which is updated."""
+    index = 0
+    while f"{prefix}{index}" in taken:
+        index += 1
+    taken.add(f"{prefix}{index}")
+    return f"{prefix}{index}"
+
+def minify_css(css):
+    css = CSS_COMMENT_PATTERN.sub('', css)
+    css = CSS_SPACING_PATTERN.sub(r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return re.sub(r'\s+', ' ', css).replace(';}', '}').strip()
+
+def optimize_svg(svg):
+    """Shrink a keymap-drawer SVG without changing how it renders.
+
+    Inline style attributes become classes with one shared CSS rule per
+    distinct style, rects that occur more than once (key and combo boxes)
+    become <symbol>s placed with <use> at the rect's x/y, the stylesheet
+    is minified and whitespace between tags is dropped.
+    """
+    taken = set(SVG_ID_PATTERN.findall(svg)) | set(re.findall(r'\.([\w-]+)', svg[:svg.find('</style>')]))
+    style_classes = {}
+    shapes = {}
+    shape_counts = Counter()
+
+    def shape_key(attributes):
+        return tuple((name, value) for name, value in attributes if name not in ('x', 'y'))
+
+    for match in SVG_TAG_PATTERN.finditer(svg):
+        if match.group(1) == 'rect' and match.group(3):
+            shape_counts[shape_key(SVG_ATTRIBUTE_PATTERN.findall(match.group(2)))] += 1
+
+    def rewrite(match):
+        tag, attribute_text, self_closing = match.groups()
+        if 'style="' not in attribute_text and not (tag == 'rect' and self_closing):
+            return match.group(0)
+        attributes = SVG_ATTRIBUTE_PATTERN.findall(attribute_text)
+        if tag == 'rect' and self_closing and shape_counts[shape_key(attributes)] > 1:
+            key = shape_key(attributes)
+            values = dict(attributes)
+            x, y = float(values.get('x', 0)), float(values.get('y', 0))
+            if key not in shapes:
+                # The first rect of a shape sets the symbol's origin, later ones are placed relative to it
+                shapes[key] = (unused_name('k', taken), x, y)
+            name, origin_x, origin_y = shapes[key]
+            offset = ''.join(f' {axis}="{delta:g}"' for axis, delta in (('x', x - origin_x), ('y', y - origin_y)) if delta)
+            return f'<use href="#{name}"{offset}/>'
+        rewritten = {}
+        for name, value in attributes:
+            if name == 'style':
+                style = value.strip().rstrip(';')
+                if style not in style_classes:
+                    style_classes[style] = (tag, unused_name('s', taken))
+                name, value = 'class', style_classes[style][1]
+                if 'class' in rewritten:
+                    value = f"{rewritten['class']} {value}"
+            elif name == 'class' and 'class' in rewritten:
+                value = f"{value} {rewritten['class']}"
+            rewritten[name] = value
+        attribute_text = ''.join(f' {name}="{value}"' for name, value in rewritten.items())
+        return f"<{tag}{attribute_text}{self_closing}>"
+
+    style_start = svg.index('<style>') + len('<style>')
+    style_end = svg.index('</style>', style_start)
+    body = SVG_TAG_PATTERN.sub(rewrite, svg[style_end:])
+    head = svg[:style_start - len('<style>')]
+
+    # Hoisted rules go last so they win over the stylesheet the way inline styles did
+    css = [minify_css(svg[style_start:style_end])]
+    css.extend(f"{tag}.{name}{{{minify_css(style)}}}" for style, (tag, name) in style_classes.items())
+    symbols = []
+    for key, (name, x, y) in shapes.items():
+        attributes = ''.join(f' {n}="{v}"' for n, v in ((('x', f"{x:g}"), ('y', f"{y:g}")) + key))
+        symbols.append(f'<symbol id="{name}" overflow="visible"><rect{attributes}/></symbol>')
+    symbols = ''.join(symbols)
+    if symbols:
+        head += f"<defs>{symbols}</defs>"
+    optimized = f"{head}<style>{''.join(css)}{body}"
+    return re.sub(r'>\s+<', '><', optimized)
+
+def report_profile():
+    """Print the per-stage timing table when --profile is active, then start a fresh profile."""
+    if profiler.enabled and profiler.stages:
+        print("\nStage profile:")
+        print(profiler.report())
+    profiler.reset()
+
+def parse_processed_keymap(output_path, processed_keymap, base_dir, graph, key_positions, layer_definitions,
+                           cache, sources_key, fingerprint):
+    """Build the keymap document the external way: 'keymap_drawer parse -z' on the processed keymap at
+    output_path, with the layout replaced by sofle and the combos from process_combos() appended."""
+    parse_key = hash_text(processed_keymap, fingerprint)
+    parsed_json = cache.get("parsed", parse_key, ".json")
+    if parsed_json is None:
+        # Parse processed keymap into the in-memory keymap document
+        with profiler.stage("drawer parse") as stage:
+            yaml_content = drawer_parse(output_path)
+            stage['items'] = len(yaml_content.get('layers', {}))
+        cache.put("parsed", parse_key, ".json", json.dumps(yaml_content))
+    else:
+        logger.info("Reusing cached keymap-drawer parse output")
+        yaml_content = json.loads(parsed_json)
+    
+    # Extract combos from the processed keymap
+    logger.debug("No combos found in the parsed output. Extracting combos from processed keymap...")
+    combos_file = os.path.join(base_dir, "includes", "combos.dtsi")
+    cached_combos = cache.get("combos", sources_key, ".json")
+    if cached_combos is None:
+        with profiler.stage("devicetree index") as stage:
+            index = build_devicetree_index(graph, key_positions, layer_definitions) if combos_file in graph.contents else None
+            stage['items'] = len(index.by_name) if index else 0
+        with profiler.stage("combo parsing") as stage:
+            yaml_combos = process_combos(combos_file, key_positions, layer_definitions, index)
+            stage['items'] = len(yaml_combos)
+        cache.put("combos", sources_key, ".json", json.dumps(yaml_combos))
+    else:
+        yaml_combos = json.loads(cached_combos)
+        logger.info(f"Reusing {len(yaml_combos)} cached combos")
+    
+    # Update YAML layout to sofle
+    logger.debug("\nUpdating YAML layout...")
+    if yaml_content and 'layout' in yaml_content:
+        yaml_content['layout'] = {"zmk_keyboard": "sofle"}
+        logger.info("Updated YAML layout to 'sofle'")
+    
+    # Add combos to the keymap document
+    if yaml_combos:
+        logger.info(f"Processing {len(yaml_combos)} combos")
+        logger.debug(f"Sample combos: {yaml_combos[:3]}")  # Show first 3 combos for verification
+    
+        # Ensure combos section exists and preserve any existing combos
+        yaml_content = yaml_content or {}
+        yaml_content.setdefault('combos', []).extend(yaml_combos)
+        logger.debug("Combos successfully added to YAML document")
+    return yaml_content
+
+def run_pipeline(keymap_path, output_path, cache, graph=None, svg_output=None, config_file=None,
+                 split_layers=False, jobs=None, optimize=False, svgz=False, external_parse=False):
+    """Process the keymap, generate keymap.yaml and draw keymap.svg, reusing cached stages.
+
+    graph may be passed in from build_include_graph() to avoid walking the
+    include graph again, as watch mode and variant rendering do. With
+    split_layers every layer is drawn separately into <output dir>/layers/
+    using up to jobs worker processes, see draw_layers_split(). optimize
+    shrinks the SVG with optimize_svg() and svgz also writes a gzipped
+    copy next to it. The keymap document is built by emit_keymap_document()
+    unless external_parse asks for 'keymap_drawer parse -z' on the processed
+    keymap, which is also used when keymap_drawer can't be imported.
+    """
+    from subprocess import CalledProcessError
+    
+    base_dir = os.path.dirname(keymap_path)
+    project_root = os.path.dirname(os.path.dirname(keymap_path))
+    logger.debug(f"Base directory: {base_dir}")
+    logger.debug(f"Project root: {project_root}")
+    
+    # Create output directory if it doesn't exist
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    yaml_path = os.path.join(output_dir, "keymap.yaml")
+    if svg_output is None:
+        svg_output = os.path.join(project_root, "keymap.svg")
+    if config_file is None:
+        config_file = drawer_config_path(output_path)
+    config_text = ""
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            config_text = f.read()
+    
+    if graph is None:
+        graph = build_include_graph(keymap_path, cache_dir=cache.cache_dir if cache.enabled else None)
+    fingerprint = script_fingerprint()
+    # A missing key-labels header is replaced by its last compiled index, which the include graph doesn't cover
+    key_positions = graph.key_positions()
+    if not key_positions:
+        # Every combo would be dropped from the drawing, so don't overwrite a good one
+        logger.error("No key positions: the key-labels header can't be found and no compiled index is cached. "
+                     "Check out zmk-helpers next to the config or run once where it is available.")
+        return False
+    sources_key = hash_include_graph(graph, fingerprint, key_positions.source)
+    inputs_key = hash_text(sources_key, config_text)
+    render_options = [name for name, enabled in (("layers", split_layers), ("optimize", optimize), ("svgz", svgz),
+                                                  ("parse", external_parse)) if enabled]
+    if render_options:
+        inputs_key = hash_text(inputs_key, *render_options)
+    svgz_output = os.path.splitext(svg_output)[0] + ".svgz"
+    
+    if cache.outputs_unchanged(inputs_key):
+        logger.info("\nKeymap inputs unchanged since the last run, reusing existing outputs:")
+        logger.info(f"- Processed keymap: {output_path}")
+        logger.info(f"- YAML config: {yaml_path}")
+        logger.info(f"- SVG visualization: {svg_output}")
+        if svgz:
+            logger.info(f"- Compressed SVG: {svgz_output}")
+        report_profile()
+        return True
+    
+    processed_keymap = cache.get("processed", sources_key, ".keymap")
+    if processed_keymap is None:
+        processed_keymap = process_keymap(keymap_path, output_path, graph)
+        cache.put("processed", sources_key, ".keymap", processed_keymap)
+    else:
+        logger.info("Reusing cached processed keymap")
+    
+    # Write the processed keymap to the output file
+    write_if_changed(output_path, processed_keymap)
+    
+    logger.info(f"Processed keymap saved to {output_path}")
+    
+    logger.debug("\nNOTE: Combos are now processed directly within the Python script")
+    
+    # Extract layer definitions
+    layer_defs_file = os.path.join(base_dir, "includes", "layers_definitions.dtsi")
+    layer_definitions = extract_layer_definitions(layer_defs_file, graph)
+    
+    logger.debug(f"Sample key positions: {list(key_positions.items())[:5]}")
+    
+    if layer_definitions:
+        logger.debug(f"Made {len(layer_definitions)} layer name replacements")
+        logger.debug("\nLayer mapping:")
+        for layer_name, layer_value in layer_definitions.items():
+            logger.debug(f"Layer {layer_value}: {layer_name}")
+    
+    try:
+        logger.info("\nGenerating YAML configuration...")
+        yaml_content = None
+        if not external_parse:
+            cached_document = cache.get("document", sources_key, ".json")
+            if cached_document is None:
+                with profiler.stage("devicetree index") as stage:
+                    index = build_devicetree_index(graph, key_positions, layer_definitions)
+                    stage['items'] = len(index.by_name)
+                with profiler.stage("emit YAML") as stage:
+                    yaml_content = emit_keymap_document(index, build_symbol_table(graph.defines()), {"zmk_keyboard": "sofle"})
+                    stage['items'] = len(yaml_content.get('layers', {})) if yaml_content else 0
+                if yaml_content is not None:
+                    cache.put("document", sources_key, ".json", json.dumps(yaml_content))
+                    logger.info(f"Emitted {len(yaml_content['layers'])} layers and {len(yaml_content.get('combos', []))} combos")
+            else:
+                logger.info("Reusing cached keymap document")
+                yaml_content = json.loads(cached_document)
+        
+        if yaml_content is None:
+            yaml_content = parse_processed_keymap(output_path, processed_keymap, base_dir, graph, key_positions,
+                                                  layer_definitions, cache, sources_key, fingerprint)
+        
+        with profiler.stage("YAML merge") as stage:
+            if config_text:
+                logger.info("\nMerging configuration settings into keymap.yaml...")
+                config_content = load_yaml(config_text)
+            
+                if config_content and yaml_content:
+                    yaml_content.update(config_content)
+        
+            # Serialize the finished document exactly once
+            final_yaml = dump_yaml(yaml_content)
+            write_if_changed(yaml_path, final_yaml)
+            logger.info(f"YAML written to: {yaml_path}")
+            logger.debug(f"Final YAML content keys: {list(yaml_content.keys())}")
+            stage['items'] = len(final_yaml)
+        
+        # Generate SVG visualization
+        logger.info("\nGenerating SVG visualization...")
+        # The draw config is hashed on its own too, not only through the merged final_yaml
+        draw_fingerprint = hash_text(fingerprint, config_text)
+        svg_key = hash_text(final_yaml, draw_fingerprint)
+        svg_content = None
+        layer_paths = []
+        if split_layers:
+            with profiler.stage("draw layers") as stage:
+                split = draw_layers_split(yaml_content, os.path.join(output_dir, LAYERS_DIR_NAME), cache, draw_fingerprint, jobs)
+                if split is not None:
+                    svg_content, layer_paths = split
+                    stage['items'] = len(layer_paths)
+        if svg_content is None:
+            svg_content = cache.get("svg", svg_key, ".svg")
+            if svg_content is None:
+                with profiler.stage("draw") as stage:
+                    svg_content = drawer_draw(yaml_content, yaml_path)
+                    stage['items'] = len(yaml_content.get('layers', {}))
+                cache.put("svg", svg_key, ".svg", svg_content)
+            else:
+                logger.info("Reusing cached SVG visualization")
+        if optimize:
+            with profiler.stage("optimize SVG") as stage:
+                original_size = len(svg_content)
+                svg_content = optimize_svg(svg_content)
+                stage['items'] = len(svg_content)
+            logger.info(f"Optimized SVG from {original_size} to {len(svg_content)} bytes")
+        write_if_changed(svg_output, svg_content)
+        outputs = [output_path, yaml_path, svg_output] + layer_paths
+        if svgz:
+            import gzip
+            write_if_changed(svgz_output, gzip.compress(svg_content.encode('utf-8'), compresslevel=9, mtime=0))
+            outputs.append(svgz_output)
+        
+        cache.record_outputs(inputs_key, outputs)
+        
+        logger.info("\nSuccess! SVG visualization created.")
+        
+        logger.info("\nDone! Generated files:")
+        logger.info(f"- Processed keymap: {output_path}")
+        logger.info(f"- YAML config: {yaml_path}")
+        logger.info(f"- SVG visualization: {svg_output}")
+        if svgz:
+            logger.info(f"- Compressed SVG: {svgz_output}")
+        report_profile()
+        return True
+    
+    except CalledProcessError as e:
+        logger.error(f"Error calling keymap-drawer: {e}")
+    except Exception as e:
+        logger.error(f"Pipeline failed: {e}")
+    report_profile()
+    return False
+
+VARIANTS_DIR_NAME = "variants"
+
+def variant_name(flags):
+    """Directory-friendly name of a variant, e.g. has_capslock+has_mouse_keys."""
+    if not flags:
+        return "default"
+    return "+".join(
+        name.lower() if value == '' else f"{name.lower()}={value}" for name, value in flags.items())
+
+def parse_flags(text):
+    """Parse 'FLAG,NAME=VALUE' into an ordered dict of defines."""
+    flags = {}
+    for item in text.split(','):
+        item = item.strip()
+        if item:
+            name, _, value = item.partition('=')
+            flags[name.strip()] = value.strip()
+    return flags
+
+def build_variants(matrix=None, explicit=None):
+    """Expand --matrix flags into every on/off combination and add --variant entries."""
+    variants = {}
+    if matrix:
+        names = [name.strip() for name in matrix.split(',') if name.strip()]
+        for enabled in itertools.product((False, True), repeat=len(names)):
+            flags = {name: '' for name, on in zip(names, enabled) if on}
+            variants[variant_name(flags)] = flags
+    for entry in explicit or ():
+        name, separator, text = entry.partition(':')
+        flags = parse_flags(text if separator else name)
+        variants[name.strip() if separator else variant_name(flags)] = flags
+    return variants
+
+_variant_graph = None
+
+def _init_variant_worker(graph, verbosity):
+    """Process pool initializer: every worker gets the include graph once, instead of re-reading files."""
+    global _variant_graph
+    _variant_graph = graph
+    configure_logging(verbosity)
+
+def _render_variant(name, flags, output_path, svg_output, config_file, cache_dir, use_cache, pipeline_options):
+    graph = _variant_graph.variant(flags)
+    cache = StageCache(cache_dir, enabled=use_cache, manifest_name=f"manifest-{name}.json")
+    started = time.perf_counter()
+    # The variants already run in parallel, so each one draws its own layers
+    ok = run_pipeline(graph.keymap_path, output_path, cache, graph, svg_output, config_file, jobs=1, **pipeline_options)
+    return name, ok, time.perf_counter() - started
+
+def render_variants(keymap_path, output_path, variants, cache_dir, use_cache=True, jobs=None, verbosity='quiet', **pipeline_options):
+    """Render the YAML and SVG of every variant in a process pool, sharing one include graph.
+
+    Each variant writes to <output dir>/variants/<name>/ (processed keymap,
+    keymap.yaml and keymap.svg). The include graph is read and scanned once
+    here, and devicetree trees for every variant are parsed before the pool
+    starts, so workers only evaluate conditions and draw. pipeline_options
+    (split_layers, optimize, svgz, external_parse) are passed on to
+    run_pipeline(); jobs is the number of variants rendered at once.
+    """
+    graph = build_include_graph(keymap_path, cache_dir=cache_dir if use_cache else None)
+    for flags in variants.values():
+        variant = graph.variant(flags)
+        for path in variant.active_paths():
+            variant.tree(path)
+    
+    config_file = drawer_config_path(output_path)
+    variants_dir = os.path.join(os.path.dirname(output_path), VARIANTS_DIR_NAME)
+    results = {}
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_variant_worker, initargs=(graph, verbosity)) as pool:
+        futures = []
+        for name, flags in variants.items():
+            variant_dir = os.path.join(variants_dir, name)
+            futures.append(pool.submit(
+                _render_variant, name, flags,
+                os.path.join(variant_dir, os.path.basename(output_path)),
+                os.path.join(variant_dir, "keymap.svg"),
+                config_file, cache_dir, use_cache, pipeline_options))
+        for future in as_completed(futures):
+            name, ok, seconds = future.result()
+            results[name] = ok
+            status = "ok" if ok else "FAILED"
+            logger.info(f"Variant {name}: {status} in {seconds:.2f}s -> {os.path.join(variants_dir, name, 'keymap.svg')}")
+    
+    failed = [name for name, ok in results.items() if not ok]
+    if failed:
+        logger.error(f"{len(failed)} of {len(results)} variants failed: {', '.join(sorted(failed))}")
+    return not failed
+
+WATCH_DEBOUNCE_MS = 200
+WATCH_POLL_INTERVAL = 0.25
+
+class InotifyWatcher:
+    """Watch directories for written, moved-in and deleted files using Linux inotify via ctypes."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    EVENT_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directories):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = self._get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self.directories = {}
+        self.add_directories(directories)
+
+    def add_directories(self, directories):
+        for directory in directories:
+            if directory in self.directories.values():
+                continue
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.EVENT_MASK)
+            if wd < 0:
+                errno = self._get_errno()
+                logger.warning(f"Cannot watch {directory}: {os.strerror(errno)}")
+                continue
+            self.directories[wd] = directory
+
+    def wait(self, timeout):
+        """Block up to timeout seconds (forever for None) and return the set of changed paths."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, _, _, name_length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            directory = self.directories.get(wd)
+            if directory and name:
+                changed.add(os.path.join(directory, os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Portable fallback that compares file modification times in the watched directories."""
+
+    def __init__(self, directories, interval=WATCH_POLL_INTERVAL):
+        self.interval = interval
+        self.directories = set()
+        self.snapshot = {}
+        self.add_directories(directories)
+
+    def add_directories(self, directories):
+        self.directories.update(directories)
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+        return snapshot
+
+    def wait(self, timeout):
+        """Poll until something changes or timeout seconds pass (forever for None)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._take_snapshot()
+            changed = {
+                path for path in current.keys() | self.snapshot.keys()
+                if current.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = current
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            sleep_for = self.interval if deadline is None else min(self.interval, max(0, deadline - time.monotonic()))
+            time.sleep(sleep_for)
+
+    def close(self):
+        pass
+
+def create_watcher(directories):
+    """Use inotify where available and fall back to polling elsewhere (e.g. macOS)."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({e}), falling back to polling")
+    return PollingWatcher(directories)
+
+def watch_directories(graph, config_file):
+    directories = {os.path.realpath(os.path.dirname(path) or '.') for path in graph.contents}
+    directories.add(os.path.realpath(os.path.dirname(config_file) or '.'))
+    return directories
+
+def watch_keymap(keymap_path, output_path, cache, debounce_ms=WATCH_DEBOUNCE_MS, **pipeline_options):
+    """Keep the include graph in memory and re-render whenever one of its files is saved.
+
+    pipeline_options are passed on to run_pipeline().
+    """
+    config_file = drawer_config_path(output_path)
+    file_cache = {}
+    resolver = IncludeResolver(os.path.dirname(os.path.dirname(keymap_path)))
+    index_dir = cache.cache_dir if cache.enabled else None
+    graph = build_include_graph(keymap_path, file_cache, resolver, index_dir)
+    run_pipeline(keymap_path, output_path, cache, graph, **pipeline_options)
+
+    watcher = create_watcher(watch_directories(graph, config_file))
+    logger.info(f"\nWatching {len(graph.contents)} files for changes (Ctrl+C to stop)...")
+    try:
+        while True:
+            changed = watcher.wait(None)
+            # Debounce: editors often write a file several times in a burst
+            while True:
+                more = watcher.wait(debounce_ms / 1000)
+                if not more:
+                    break
+                changed |= more
+
+            graph_files = {os.path.realpath(path): path for path in graph.contents}
+            changed_real = {os.path.realpath(path) for path in changed}
+            changed_sources = [graph_files[path] for path in changed_real if path in graph_files]
+            config_changed = os.path.realpath(config_file) in changed_real
+            if not changed_sources and not config_changed:
+                continue
+
+            modified = []
+            for path in changed_sources:
+                old_content = file_cache.pop(path, (None, None))[0]
+                new_content, _ = load_source(path, file_cache)
+                if new_content != old_content:
+                    modified.append(path)
+            if not modified and not config_changed:
+                continue
+
+            for path in modified:
+                dependents = sorted(graph.dependents(path))
+                logger.info(f"\nChanged: {path}" + (f" (included by {', '.join(dependents)})" if dependents else ""))
+            if config_changed:
+                logger.info(f"\nChanged: {config_file}")
+
+            started = time.perf_counter()
+            graph = build_include_graph(keymap_path, file_cache, resolver, index_dir)
+            run_pipeline(keymap_path, output_path, cache, graph, **pipeline_options)
+            logger.info(f"Re-rendered in {(time.perf_counter() - started) * 1000:.0f} ms")
+            watcher.add_directories(watch_directories(graph, config_file))
+    except KeyboardInterrupt:
+        logger.info("\nStopped watching")
+    finally:
+        watcher.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a ZMK keymap with its includes and draw it with keymap-drawer.")
+    parser.add_argument("keymap_file", help="ZMK keymap to process, e.g. ../config/base.keymap")
+    parser.add_argument("output_file", nargs="?", help="Where to write the processed keymap (default: processed_keymap.keymap next to the input)")
+    parser.add_argument("--check", action="store_true", help="Only lint the keymap (key-position labels, layers, combos) and exit non-zero on errors, without yaml or keymap-drawer")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore and don't update the incremental stage cache")
+    parser.add_argument("--watch", action="store_true", help="Keep running and re-render whenever the keymap or one of its includes is saved")
+    parser.add_argument("--debounce-ms", type=int, default=WATCH_DEBOUNCE_MS, help=f"Quiet period after a save before re-rendering in watch mode (default: {WATCH_DEBOUNCE_MS})")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true", help="Only print warnings and errors")
+    verbosity.add_argument("-v", "--verbose", action="store_true", help="Print debug details for every include, key position and mapping")
+    parser.add_argument("--profile", action="store_true", help="Report wall time and item counts for each pipeline stage")
+    parser.add_argument("--cache-dir", help=f"Directory for the stage cache (default: {CACHE_DIR_NAME} next to the output directory)")
+    parser.add_argument("--matrix", metavar="FLAG,FLAG", help="Render every on/off combination of these #ifdef flags as separate variants")
+    parser.add_argument("--variant", action="append", metavar="[NAME:]FLAG,NAME=VALUE", help="Render a variant with these defines (repeatable)")
+    parser.add_argument("--split-layers", action="store_true", help=f"Draw every layer as its own SVG in {LAYERS_DIR_NAME}/ next to the processed keymap and stitch them together, redrawing only changed layers")
+    parser.add_argument("--optimize-svg", action="store_true", help="Shrink the SVG: shared CSS classes instead of inline styles, <symbol>/<use> for repeated key shapes, no whitespace between tags")
+    parser.add_argument("--svgz", action="store_true", help="Also write a gzip-compressed copy of the SVG with a .svgz extension")
+    parser.add_argument("--external-parse", action="store_true",
+                        help="Build keymap.yaml with 'keymap_drawer parse -z' on the processed keymap instead of emitting it directly")
+    parser.add_argument("--jobs", type=int, help="Worker processes for rendering variants or layers (default: one per CPU)")
+    args = parser.parse_args()
+    
+    if args.check:
+        from keymap_lint import check_keymap, report_problems
+        configure_logging('debug' if args.verbose else 'quiet')
+        started = time.perf_counter()
+        errors = report_problems(check_keymap(args.keymap_file))
+        logger.debug(f"Checked in {(time.perf_counter() - started) * 1000:.1f} ms")
+        sys.exit(1 if errors else 0)
+    
+    configure_logging('quiet' if args.quiet else 'debug' if args.verbose else 'normal')
+    profiler.enabled = args.profile
+    
+    keymap_path = args.keymap_file
+    if args.output_file:
+        output_path = args.output_file
+    else:
+        output_path = os.path.join(os.path.dirname(keymap_path), "processed_keymap.keymap")
+    
+    logger.debug(f"Input file: {keymap_path}")
+    logger.debug(f"Output file: {output_path}")
+    
+    cache_dir = args.cache_dir or os.path.join(os.path.dirname(os.path.dirname(output_path)), CACHE_DIR_NAME)
+    cache = StageCache(cache_dir, enabled=not args.no_cache)
+    
+    pipeline_options = {
+        'split_layers': args.split_layers,
+        'optimize': args.optimize_svg,
+        'svgz': args.svgz,
+        'external_parse': args.external_parse,
+    }
+    if args.matrix or args.variant:
+        variants = build_variants(args.matrix, args.variant)
+        logger.info(f"Rendering {len(variants)} variants: {', '.join(variants)}")
+        verbosity = 'quiet' if not args.verbose else 'debug'
+        ok = render_variants(keymap_path, output_path, variants, cache_dir, not args.no_cache, args.jobs, verbosity,
+                             **pipeline_options)
+        sys.exit(0 if ok else 1)
+    
+    pipeline_options['jobs'] = args.jobs
+    if args.watch:
+        watch_keymap(keymap_path, output_path, cache, args.debounce_ms, **pipeline_options)
+    else:
+        sys.exit(0 if run_pipeline(keymap_path, output_path, cache, **pipeline_options) else 1)
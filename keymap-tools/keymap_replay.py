@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded key event trace through a model of the keymap's combos,
+hold-taps, tap-dances and mod-morphs.
+
+The trace is a CSV of key events, one per line, in time order:
+
+    time_ms,position,action
+    0,25,press
+    48,26,press
+    95,25,release
+
+position is a key position number or a key label such as LM4, action is
+press/release (or down/up, 1/0). The file is streamed, so traces with
+millions of events don't need to fit in memory. Every timing can be
+overridden with -D and one define can be swept to compare values on the
+same trace in a single pass:
+
+    python3 keymap_replay.py ../config/base.keymap trace.csv
+    python3 keymap_replay.py ../config/base.keymap trace.csv --sweep HM_TAPPING_TERM=180,200,250
+    python3 keymap_replay.py ../config/base.keymap trace.csv -D COMBO_TERM_FAST=40
+"""
+
+import argparse
+import csv
+import re
+import sys
+import time
+from collections import Counter, deque, namedtuple
+
+import keymap_pipeline as pk
+from keymap_latency import (DEFAULT_COMBO_TIMEOUT_MS, DEFAULT_TAPPING_TERM_MS,
+                            collect_behaviors, load_keymap_index, resolve_number)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+PRESS_ACTIONS = {'press', 'down', 'p', 'd', '1', 'true'}
+RELEASE_ACTIONS = {'release', 'up', 'r', 'u', '0', 'false'}
+
+TIME_UNITS = {'ms': 1.0, 'us': 0.001, 's': 1000.0}
+
+# Keycodes that count as held modifiers for mod-morph resolution, by mod-morph MOD_ name
+MODIFIER_KEYCODES = {
+    'LSFT': {'LSHFT', 'LSHIFT', 'LEFT_SHIFT'},
+    'RSFT': {'RSHFT', 'RSHIFT', 'RIGHT_SHIFT'},
+    'LCTL': {'LCTRL', 'LCTL', 'LEFT_CONTROL'},
+    'RCTL': {'RCTRL', 'RCTL', 'RIGHT_CONTROL'},
+    'LALT': {'LALT', 'LEFT_ALT'},
+    'RALT': {'RALT', 'RIGHT_ALT'},
+    'LGUI': {'LGUI', 'LWIN', 'LCMD', 'LMETA', 'LEFT_GUI'},
+    'RGUI': {'RGUI', 'RWIN', 'RCMD', 'RMETA', 'RIGHT_GUI'},
+}
+ALL_MODIFIERS = set().union(*MODIFIER_KEYCODES.values())
+MOD_NAME_PATTERN = re.compile(r'MOD_(\w+)')
+KEYCODE_TOKEN_PATTERN = re.compile(r'\w+')
+
+Combo = namedtuple('Combo', ['name', 'positions', 'timeout', 'prior_idle', 'layers', 'binding'])
+HoldTap = namedtuple('HoldTap', ['name', 'flavor', 'tapping_term', 'quick_tap', 'prior_idle',
+                                 'trigger_positions', 'trigger_on_release', 'hold', 'tap'])
+TapDance = namedtuple('TapDance', ['name', 'tapping_term', 'bindings'])
+ModMorph = namedtuple('ModMorph', ['name', 'mods', 'bindings'])
+
+class ReplayModel:
+    """The parts of the keymap that decide when and how a key press is sent, with resolved timings."""
+
+    def __init__(self, index, macros):
+        self.index = index
+        self.layers = [layer.bindings() for layer in index.layers]
+        self.behaviors = {}
+        for name, node in collect_behaviors(index).items():
+            behavior = self._compile_behavior(name, node, macros)
+            if behavior is not None:
+                self.behaviors[name] = behavior
+
+        self.combos_by_position = {}
+        for node in index.combos():
+            positions = frozenset(index.resolve_positions(node.tokens('key-positions')))
+            bindings = node.bindings()
+            if len(positions) < 2 or not bindings:
+                continue
+            layers = frozenset(index.resolve_layers(node.tokens('layers'))) or None
+            combo = Combo(node.name, positions,
+                          resolve_number(node.properties.get('timeout-ms'), macros, DEFAULT_COMBO_TIMEOUT_MS),
+                          resolve_number(node.properties.get('require-prior-idle-ms'), macros, 0),
+                          layers, bindings[0])
+            for position in positions:
+                self.combos_by_position.setdefault(position, []).append(combo)
+
+        # Two-key combos by position, as (other position, timeout), for near-miss detection
+        self.combo_partners = {}
+        for position, combos in self.combos_by_position.items():
+            self.combo_partners[position] = [
+                (next(p for p in c.positions if p != position), c.timeout) for c in combos if len(c.positions) == 2]
+
+    def _compile_behavior(self, name, node, macros):
+        compatible = node.compatible
+        nested = node.bindings()
+        if compatible == 'zmk,behavior-hold-tap':
+            trigger_positions = node.tokens('hold-trigger-key-positions')
+            return HoldTap(
+                name,
+                (node.properties.get('flavor') or '"hold-preferred"').strip('"'),
+                resolve_number(node.properties.get('tapping-term-ms'), macros, DEFAULT_TAPPING_TERM_MS),
+                resolve_number(node.properties.get('quick-tap-ms'), macros, 0),
+                resolve_number(node.properties.get('require-prior-idle-ms'), macros, 0),
+                frozenset(self.index.resolve_positions(trigger_positions)) if trigger_positions else None,
+                'hold-trigger-on-release' in node.properties,
+                nested[0] if nested else '&none',
+                nested[1] if len(nested) > 1 else '&none')
+        if compatible == 'zmk,behavior-tap-dance':
+            return TapDance(name, resolve_number(node.properties.get('tapping-term-ms'), macros, DEFAULT_TAPPING_TERM_MS), nested)
+        if compatible == 'zmk,behavior-mod-morph':
+            mods = set()
+            for mod in MOD_NAME_PATTERN.findall(str(node.properties.get('mods', ''))):
+                mods |= MODIFIER_KEYCODES.get(mod, set())
+            return ModMorph(name, frozenset(mods), nested)
+        return None
+
+    def binding(self, active_layers, position):
+        """The binding a press of position triggers, falling through &trans to lower active layers."""
+        for layer in sorted(active_layers, reverse=True):
+            bindings = self.layers[layer] if layer < len(self.layers) else ()
+            if position < len(bindings) and bindings[position] != '&trans':
+                return bindings[position]
+        return '&none'
+
+class ReplayStats:
+    """Counters and an added-latency histogram (1 ms buckets) for one replay."""
+
+    def __init__(self):
+        self.latency = Counter()
+        self.counts = Counter()
+
+    def percentile(self, p):
+        total = sum(self.latency.values())
+        if not total:
+            return 0
+        target = total * p / 100.0
+        seen = 0
+        for value in sorted(self.latency):
+            seen += self.latency[value]
+            if seen >= target:
+                return value
+        return max(self.latency)
+
+    def mean(self):
+        total = sum(self.latency.values())
+        return sum(v * n for v, n in self.latency.items()) / total if total else 0.0
+
+class ReplayEngine:
+    """Streaming simulation of ZMK's combo, hold-tap and tap-dance resolution.
+
+    Events must be fed in time order. Key presses are queued until every
+    behavior they depend on has decided, the way ZMK captures key events
+    while a hold-tap or combo is undecided, and the time each press spends
+    in that queue is recorded as added latency.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.stats = ReplayStats()
+        self.active_layers = {0}
+        self.sticky_layer = None
+        self.held = {}
+        self.mods = {}
+        self.sticky_mods = set()
+        self.queue = deque()
+        self.last_output = 0.0
+        self.last_press = None
+        self.last_tap = {}
+        self.pending_combo = None
+        self.hold_taps = []
+        self.tap_dance = None
+        self.down = {}
+        self.idle_before = {}
+        self.fired_combos = {}
+
+    # Output queue
+
+    def _record(self, press_time):
+        record = [press_time, None, True]
+        self.queue.append(record)
+        return record
+
+    def _decide(self, record, at, counted=True):
+        record[1] = at
+        record[2] = counted
+        self._flush()
+
+    def _flush(self):
+        queue = self.queue
+        while queue and queue[0][1] is not None:
+            press_time, decided, counted = queue.popleft()
+            output = max(decided, self.last_output)
+            self.last_output = output
+            if counted:
+                self.stats.latency[int(round(output - press_time))] += 1
+
+    # Timers
+
+    def _next_deadline(self):
+        deadline = None
+        if self.pending_combo is not None:
+            deadline = self.pending_combo['deadline']
+        for hold_tap in self.hold_taps:
+            if hold_tap['decision'] is None and (deadline is None or hold_tap['deadline'] < deadline):
+                deadline = hold_tap['deadline']
+        if self.tap_dance is not None and (deadline is None or self.tap_dance['deadline'] < deadline):
+            deadline = self.tap_dance['deadline']
+        return deadline
+
+    def advance(self, now):
+        """Fire every timer that expires before now."""
+        while True:
+            deadline = self._next_deadline()
+            if deadline is None or deadline > now:
+                return
+            if self.pending_combo is not None and self.pending_combo['deadline'] == deadline:
+                self._resolve_combo(deadline)
+                continue
+            if self.tap_dance is not None and self.tap_dance['deadline'] == deadline:
+                self._resolve_tap_dance(deadline)
+                continue
+            for hold_tap in self.hold_taps:
+                if hold_tap['decision'] is None and hold_tap['deadline'] == deadline:
+                    self._decide_hold_tap(hold_tap, 'tap' if hold_tap['spec'].flavor == 'tap-unless-interrupted' else 'hold', deadline)
+                    break
+
+    # Events
+
+    def feed(self, now, position, pressed):
+        self.advance(now)
+        self.stats.counts['events'] += 1
+        if pressed:
+            self.stats.counts['presses'] += 1
+            self._on_press(position, now)
+            self.down[position] = now
+        else:
+            self.down.pop(position, None)
+            self._on_release(position, now)
+
+    def finish(self):
+        """Resolve everything still pending at the end of the trace."""
+        self.advance(float('inf'))
+        self._flush()
+
+    def _on_press(self, position, now):
+        self.idle_before[position] = now - self.last_press if self.last_press is not None else float('inf')
+        self._check_near_miss(position, now)
+        pending = self.pending_combo
+        if pending is not None:
+            if position not in pending['positions']:
+                candidates = [c for c in pending['candidates']
+                              if position in c.positions and now - pending['start'] <= c.timeout]
+                if candidates:
+                    pending['positions'][position] = self._record(now)
+                    pending['candidates'] = candidates
+                    pressed = set(pending['positions'])
+                    complete = [c for c in candidates if c.positions <= pressed]
+                    if complete and not any(c.positions > pressed for c in candidates):
+                        self._fire_combo(max(complete, key=lambda c: len(c.positions)), now)
+                    return
+            self._resolve_combo(now)
+
+        self._interrupt(position, now)
+        combos = self._active_combos(position, now)
+        if combos:
+            self.pending_combo = {
+                'start': now,
+                'positions': {position: self._record(now)},
+                'candidates': combos,
+                'deadline': now + max(c.timeout for c in combos),
+            }
+        else:
+            self._press(position, self.model.binding(self.active_layers, position), now, now, self._record(now))
+        self.last_press = now
+
+    def _on_release(self, position, now):
+        pending = self.pending_combo
+        if pending is not None and position in pending['positions']:
+            self._resolve_combo(now)
+        for hold_tap in list(self.hold_taps):
+            if hold_tap['position'] != position and hold_tap['decision'] is None:
+                self._interrupt_release(hold_tap, position, now)
+        fired = self.fired_combos.pop(position, None)
+        if fired is not None:
+            self._release_combo_key(fired, position, now)
+        action = self.held.pop(position, None)
+        if action is None:
+            return
+        kind, value = action
+        if kind == 'hold-tap':
+            self._release_hold_tap(value, now)
+        else:
+            self._release_action(kind, value, position)
+
+    # Combos
+
+    def _active_layer(self):
+        return max(self.active_layers)
+
+    def _active_combos(self, position, now):
+        combos = self.model.combos_by_position.get(position)
+        if not combos:
+            return None
+        layer = self._active_layer()
+        idle = self.idle_before[position]
+        return [c for c in combos if (c.layers is None or layer in c.layers) and idle >= c.prior_idle] or None
+
+    def _resolve_combo(self, now):
+        """Fire the best complete combo of the pending keys, or replay them as ordinary presses."""
+        pending = self.pending_combo
+        pressed = set(pending['positions'])
+        complete = [c for c in pending['candidates'] if c.positions <= pressed]
+        if complete:
+            self._fire_combo(max(complete, key=lambda c: len(c.positions)), now)
+            return
+        self.pending_combo = None
+        for position, record in pending['positions'].items():
+            self._interrupt(position, now)
+            self._press(position, self.model.binding(self.active_layers, position), record[0], now, record)
+
+    def _fire_combo(self, combo, now):
+        pending = self.pending_combo
+        self.pending_combo = None
+        self.stats.counts['combos fired'] += 1
+        records = list(pending['positions'].values())
+        for record in records[1:]:
+            self._decide(record, now, counted=False)
+        first = next(iter(pending['positions']))
+        self._press(first, combo.binding, records[0][0], now, records[0])
+        fired = {'combo': combo, 'order': list(pending['positions']), 'released': []}
+        for position in pending['positions']:
+            self.fired_combos[position] = fired
+
+    def _release_combo_key(self, fired, position, now):
+        """Count combos that fired on keys typed as a roll rather than chorded.
+
+        A roll releases the keys in the order they were pressed and lets go
+        of the first key well before the last, a chord releases them together.
+        """
+        fired['released'].append((position, now))
+        if len(fired['released']) < len(fired['order']):
+            return
+        release_order = [p for p, _ in fired['released']]
+        spread = fired['released'][-1][1] - fired['released'][0][1]
+        if release_order == fired['order'] and spread > fired['combo'].timeout:
+            self.stats.counts['combo misfires'] += 1
+
+    def _check_near_miss(self, position, now):
+        """Count two-key combos whose keys were held together but pressed too far apart to fire."""
+        for other, timeout in self.model.combo_partners.get(position, ()):
+            pressed_at = self.down.get(other)
+            if pressed_at is not None and other not in self.fired_combos and timeout < now - pressed_at <= 2 * timeout:
+                self.stats.counts['combo near misses'] += 1
+
+    # Bindings
+
+    def _press(self, position, binding, press_time, now, record):
+        """Start the behavior of binding for a press of position at press_time, decided no earlier than now."""
+        parts = binding.split()
+        name = parts[0].lstrip('&')
+        params = parts[1:]
+        behavior = self.model.behaviors.get(name)
+
+        if isinstance(behavior, ModMorph):
+            held_mods = set(self.mods.values()) | self.sticky_mods
+            morphed = behavior.bindings[1] if behavior.mods & held_mods and len(behavior.bindings) > 1 else behavior.bindings[0]
+            self._press(position, morphed, press_time, now, record)
+            return
+
+        if isinstance(behavior, HoldTap):
+            self._press_hold_tap(position, behavior, params, press_time, now, record)
+            return
+
+        if isinstance(behavior, TapDance):
+            dance = self.tap_dance
+            if dance is not None and dance['position'] == position:
+                dance['count'] += 1
+                dance['deadline'] = now + behavior.tapping_term
+                self._decide(record, now, counted=False)
+                if dance['count'] >= len(behavior.bindings):
+                    self._resolve_tap_dance(now)
+                return
+            if dance is not None:
+                self._resolve_tap_dance(now)
+            self.tap_dance = {'position': position, 'spec': behavior, 'count': 1,
+                              'deadline': now + behavior.tapping_term, 'record': record}
+            return
+
+        self._apply(position, name, params)
+        self._decide(record, now)
+        self._consume_sticky(name)
+
+    def _apply(self, position, name, params):
+        """Apply the state change of a simple behavior (layers and modifiers) and remember how to undo it."""
+        layer = self._layer_param(params)
+        if name == 'mo' and layer is not None:
+            self.active_layers.add(layer)
+            self.held[position] = ('layer', layer)
+        elif name == 'to' and layer is not None:
+            self.active_layers = {0, layer}
+        elif name == 'tog' and layer is not None:
+            self.active_layers ^= {layer} if layer else set()
+        elif name == 'sl' and layer is not None:
+            self.active_layers.add(layer)
+            self.sticky_layer = layer
+            return
+        elif name == 'sk' and params:
+            self.sticky_mods |= self._modifiers(params[0])
+            return
+        elif name == 'kp' and params and self._modifiers(params[0]):
+            self.mods[position] = next(iter(self._modifiers(params[0])))
+            self.held[position] = ('mod', position)
+        else:
+            self.held.setdefault(position, ('key', None))
+
+    def _consume_sticky(self, name):
+        if name in ('sl', 'sk'):
+            return
+        if self.sticky_layer is not None:
+            self.active_layers.discard(self.sticky_layer)
+            self.sticky_layer = None
+        self.sticky_mods.clear()
+
+    def _layer_param(self, params):
+        if not params:
+            return None
+        value = params[0]
+        if value in self.model.index.layer_ids:
+            return int(self.model.index.layer_ids[value])
+        return int(value) if value.isdigit() else None
+
+    def _modifiers(self, keycode):
+        return {token for token in KEYCODE_TOKEN_PATTERN.findall(keycode) if token in ALL_MODIFIERS}
+
+    def _release_action(self, kind, value, position):
+        if kind == 'layer':
+            if not any(a == ('layer', value) for a in self.held.values()):
+                self.active_layers.discard(value)
+        elif kind == 'mod':
+            self.mods.pop(value, None)
+
+    # Hold-taps
+
+    def _press_hold_tap(self, position, spec, params, press_time, now, record):
+        hold = f"{spec.hold} {params[0]}" if params else spec.hold
+        tap = f"{spec.tap} {params[1]}" if len(params) > 1 else spec.tap
+        state = {'position': position, 'spec': spec, 'hold': hold, 'tap': tap, 'press_time': press_time,
+                 'deadline': press_time + spec.tapping_term, 'record': record, 'decision': None,
+                 'interrupts': {}, 'nested_taps': 0}
+        self.held[position] = ('hold-tap', state)
+        self.stats.counts['hold-taps'] += 1
+
+        last_tap = self.last_tap.get(position)
+        if spec.quick_tap and last_tap is not None and press_time - last_tap < spec.quick_tap:
+            self._decide_hold_tap(state, 'tap', now)
+            return
+        if spec.prior_idle and self.idle_before.get(position, float('inf')) < spec.prior_idle:
+            self._decide_hold_tap(state, 'tap', now)
+            return
+        if now >= state['deadline']:
+            self._decide_hold_tap(state, 'tap' if spec.flavor == 'tap-unless-interrupted' else 'hold', now)
+            return
+        self.hold_taps.append(state)
+
+    def _interrupt(self, position, now):
+        """Let undecided hold-taps and tap-dances react to another key being pressed."""
+        if self.tap_dance is not None and self.tap_dance['position'] != position:
+            self._resolve_tap_dance(now)
+        for state in list(self.hold_taps):
+            if state['decision'] is not None or state['position'] == position:
+                continue
+            state['interrupts'][position] = now
+            spec = state['spec']
+            if spec.trigger_positions is not None and not spec.trigger_on_release:
+                if position not in spec.trigger_positions:
+                    self._decide_hold_tap(state, 'tap', now)
+                    continue
+            if spec.flavor in ('hold-preferred', 'tap-unless-interrupted'):
+                self._decide_hold_tap(state, 'hold', now)
+
+    def _interrupt_release(self, state, position, now):
+        if position not in state['interrupts']:
+            return
+        spec = state['spec']
+        if spec.trigger_positions is not None and spec.trigger_on_release and position not in spec.trigger_positions:
+            self._decide_hold_tap(state, 'tap', now)
+            return
+        state['nested_taps'] += 1
+        if spec.flavor == 'balanced':
+            self._decide_hold_tap(state, 'hold', now)
+
+    def _decide_hold_tap(self, state, decision, now):
+        state['decision'] = decision
+        state['decided_at'] = now
+        if state in self.hold_taps:
+            self.hold_taps.remove(state)
+        self.stats.counts[f"hold-tap {decision}s"] += 1
+        binding = state['hold'] if decision == 'hold' else state['tap']
+        position = state['position']
+        was_held = self.held.pop(position, None)
+        self._press(position, binding, state['press_time'], now, state['record'])
+        action = self.held.pop(position, None)
+        if was_held is not None:
+            # The hold-tap stays in charge of the position, its action is undone on release
+            self.held[position] = was_held
+            state['action'] = action
+        elif action is not None:
+            self._release_action(action[0], action[1], position)
+
+    def _release_hold_tap(self, state, now):
+        if state['decision'] is None:
+            self._decide_hold_tap(state, 'tap', now)
+        if state['decision'] == 'tap':
+            self.last_tap[state['position']] = now
+            # A key pressed and released entirely inside this hold suggests the hold was meant
+            if state['nested_taps']:
+                self.stats.counts['missed holds'] += 1
+        elif not state['interrupts']:
+            # Held past the tapping term without using the hold: the tap was lost
+            self.stats.counts['accidental holds'] += 1
+        action = state.get('action')
+        if action is not None:
+            self._release_action(action[0], action[1], state['position'])
+
+    # Tap-dances
+
+    def _resolve_tap_dance(self, now):
+        dance = self.tap_dance
+        self.tap_dance = None
+        bindings = dance['spec'].bindings
+        binding = bindings[min(dance['count'], len(bindings)) - 1] if bindings else '&none'
+        self.stats.counts['tap-dances'] += 1
+        position = dance['position']
+        self._press(position, binding, dance['record'][0], now, dance['record'])
+        if position not in self.down:
+            # Resolved after the key went up, so release the chosen binding right away
+            action = self.held.pop(position, None)
+            if action is not None:
+                self._release_action(action[0], action[1], position)
+
+def read_trace(lines, key_positions, time_scale=1.0):
+    """Yield (time_ms, position, pressed) from CSV lines, skipping a header and blank lines."""
+    positions = {}
+    actions = dict.fromkeys(PRESS_ACTIONS, True)
+    actions.update(dict.fromkeys(RELEASE_ACTIONS, False))
+    for row in csv.reader(lines):
+        if len(row) < 3:
+            continue
+        try:
+            timestamp = float(row[0]) * time_scale
+        except ValueError:
+            continue
+        position = positions.get(row[1])
+        if position is None:
+            label = row[1].strip()
+            if label in key_positions:
+                position = int(key_positions[label])
+            elif label.isdigit():
+                position = int(label)
+            else:
+                pk.logger.warning(f"Unknown key position {label!r} in trace")
+                continue
+            positions[row[1]] = position
+        pressed = actions.get(row[2])
+        if pressed is None:
+            pressed = actions.get(row[2].strip().lower())
+            if pressed is None:
+                pk.logger.warning(f"Unknown key action {row[2]!r} in trace")
+                continue
+        yield timestamp, position, pressed
+
+def replay(lines, key_positions, engines, time_scale=1.0):
+    """Feed one pass over the trace to every engine and return the number of events."""
+    last_time = None
+    events = 0
+    for timestamp, position, pressed in read_trace(lines, key_positions, time_scale):
+        if last_time is not None and timestamp < last_time:
+            pk.logger.warning(f"Trace goes back in time at {timestamp}ms, clamping to {last_time}ms")
+            timestamp = last_time
+        last_time = timestamp
+        for engine in engines:
+            engine.feed(timestamp, position, pressed)
+        events += 1
+    for engine in engines:
+        engine.finish()
+    return events
+
+def parse_overrides(values):
+    overrides = {}
+    for value in values or ():
+        name, separator, number = value.partition('=')
+        if not separator:
+            raise ValueError(f"Expected NAME=VALUE, got {value!r}")
+        overrides[name.strip()] = number.strip()
+    return overrides
+
+def format_report(variants):
+    """Format one column per variant: latency percentiles and resolution counters."""
+    names = [name for name, _ in variants]
+    rows = [('keypresses', lambda s: s.counts['presses'])]
+    rows += [(f"p{p:g} latency ms", lambda s, p=p: s.percentile(p)) for p in PERCENTILES]
+    rows += [
+        ('max latency ms', lambda s: max(s.latency, default=0)),
+        ('mean latency ms', lambda s: f"{s.mean():.1f}"),
+        ('combos fired', lambda s: s.counts['combos fired']),
+        ('combo misfires', lambda s: s.counts['combo misfires']),
+        ('combo near misses', lambda s: s.counts['combo near misses']),
+        ('hold-taps', lambda s: s.counts['hold-taps']),
+        ('hold-tap taps', lambda s: s.counts['hold-tap taps']),
+        ('hold-tap holds', lambda s: s.counts['hold-tap holds']),
+        ('accidental holds', lambda s: s.counts['accidental holds']),
+        ('missed holds', lambda s: s.counts['missed holds']),
+        ('tap-dances', lambda s: s.counts['tap-dances']),
+    ]
+    width = max(12, *(len(name) for name in names))
+    lines = [f"{'':<20}" + ''.join(f"{name:>{width + 2}}" for name in names)]
+    for label, value in rows:
+        lines.append(f"{label:<20}" + ''.join(f"{str(value(stats)):>{width + 2}}" for _, stats in variants))
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a key event trace through the keymap's combos and hold-taps.")
+    parser.add_argument('keymap_file', help="path to the keymap, e.g. ../config/base.keymap")
+    parser.add_argument('trace', help="CSV trace of time,position,action events ('-' for stdin)")
+    parser.add_argument('-D', dest='defines', action='append', metavar='NAME=VALUE',
+                        help="override a define such as HM_TAPPING_TERM (repeatable)")
+    parser.add_argument('--sweep', metavar='NAME=V1,V2,...', help="replay once per value of one define")
+    parser.add_argument('--time-unit', choices=sorted(TIME_UNITS), default='ms', help="unit of the trace timestamps")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show include and parsing details")
+    args = parser.parse_args()
+
+    pk.configure_logging('debug' if args.verbose else 'quiet')
+    try:
+        overrides = parse_overrides(args.defines)
+        sweep_name, sweep_values = None, [None]
+        if args.sweep:
+            sweep_name, _, values = args.sweep.partition('=')
+            sweep_values = [v.strip() for v in values.split(',') if v.strip()]
+            if not sweep_values:
+                raise ValueError(f"No values given for --sweep {sweep_name}")
+    except ValueError as e:
+        pk.logger.error(str(e))
+        sys.exit(2)
+
+    graph, index = load_keymap_index(args.keymap_file)
+    variants = []
+    macros = graph.macros().with_defines(overrides)
+    for value in sweep_values:
+        label = 'replay'
+        variant_macros = macros
+        if sweep_name:
+            variant_macros = macros.with_defines({sweep_name: value})
+            label = f"{sweep_name}={value}"
+        variants.append((label, ReplayEngine(ReplayModel(index, variant_macros))))
+
+    start = time.perf_counter()
+    if args.trace == '-':
+        events = replay(sys.stdin, graph.key_positions(), [engine for _, engine in variants], TIME_UNITS[args.time_unit])
+    else:
+        with open(args.trace, newline='') as f:
+            events = replay(f, graph.key_positions(), [engine for _, engine in variants], TIME_UNITS[args.time_unit])
+    elapsed = time.perf_counter() - start
+
+    print(format_report([(label, engine.stats) for label, engine in variants]))
+    print(f"\nReplayed {events} events x {len(variants)} variant(s) in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1389 @@
+#!/usr/bin/env python3
+"""
+Read a ZMK keymap the way the C preprocessor and devicetree compiler see it.
+
+This is the part of the process_keymap.py pipeline that doesn't draw
+anything: the preprocessor scan, include resolution, macro expansion, key
+position labels and the devicetree index. keymap_lint.py runs on it alone,
+so it imports nothing beyond os, re, sys and time up front; logging,
+hashlib, json, copy, the thread pool and the #if evaluator in
+keymap_expr.py are imported where they are used, and regular expressions
+are compiled the first time they match.
+"""
+
+import os
+import re
+import sys
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+LOGGER_NAME = "process_keymap"
+
+def _discard(*args, **kwargs):
+    pass
+
+class QuietLogger:
+    """The "process_keymap" logger, without importing logging until something else has.
+
+    Until logging is imported (keymap_pipeline.py and the other tools import
+    it and configure the logger), messages are handled the way
+    configure_logging('quiet') would: warnings and errors are printed with
+    their level and everything else is dropped.
+    """
+
+    def __getattr__(self, name):
+        if 'logging' in sys.modules:
+            import logging
+            return getattr(logging.getLogger(LOGGER_NAME), name)
+        if name in ('warning', 'error', 'critical'):
+            return lambda message, *args, **kwargs: print(f"{name.upper()}: {message % args if args else message}")
+        return _discard
+
+logger = QuietLogger()
+
+class LazyPattern:
+    """A regular expression that is compiled the first time it's used."""
+
+    def __init__(self, pattern, flags=0):
+        self._source = (pattern, flags)
+
+    def __getattr__(self, name):
+        compiled = re.compile(*self._source)
+        for method in ('match', 'fullmatch', 'search', 'finditer', 'findall', 'sub', 'subn', 'split'):
+            setattr(self, method, getattr(compiled, method))
+        return getattr(compiled, name)
+
+
+class StageProfiler:
+    """Collects wall time and item counts per pipeline stage for --profile."""
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+
+    def reset(self):
+        self.stages = {}
+
+    def record(self, name, seconds, items=0):
+        if not self.enabled:
+            return
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'items': 0, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['items'] += items
+        entry['calls'] += 1
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block; the block may set counter['items'] to report how much it processed."""
+        counter = {'items': 0}
+        started = time.perf_counter()
+        try:
+            yield counter
+        finally:
+            self.record(name, time.perf_counter() - started, counter['items'])
+
+    def report(self):
+        lines = [f"{'Stage':<24} {'Time (ms)':>10} {'Items':>8} {'Calls':>6}"]
+        total = 0.0
+        for name, entry in self.stages.items():
+            total += entry['seconds']
+            lines.append(f"{name:<24} {entry['seconds'] * 1000:>10.1f} {entry['items']:>8} {entry['calls']:>6}")
+        lines.append(f"{'total':<24} {total * 1000:>10.1f}")
+        return '\n'.join(lines)
+
+profiler = StageProfiler()
+
+def read_file(path):
+    """Read the content of a file."""
+    try:
+        with open(path, 'r') as f:
+            content = f.read()
+            logger.debug(f"Read file {path}: {len(content)} bytes")
+            return content
+    except Exception as e:
+        logger.error(f"Could not read file {path}: {e}")
+        return ""
+
+# A preprocessor directive found by scan_preprocessor(), with its provenance
+Directive = namedtuple('Directive', ['kind', 'name', 'value', 'path', 'line', 'conditions'])
+
+# An #ifdef/#ifndef/#if ... #elif ... #else ... #endif region. branches holds the
+# (directive, symbol, line) of the opening directive and of every #elif and #else,
+# else_line is the line of the first #elif or #else
+ConditionalRegion = namedtuple('ConditionalRegion', ['directive', 'symbol', 'path', 'start_line', 'else_line', 'end_line',
+                                                     'branches'])
+
+DIRECTIVE_PATTERN = LazyPattern(r'#\s*(\w+)\s*(.*)$')
+INCLUDE_PATTERN = LazyPattern(r'[<"]([^>"]+)[>"]')
+DEFINE_PATTERN = LazyPattern(r'(\w+)(\([^)]*\))?\s*(.*)$')
+# Key-labels headers name keys by side, row and column: LN5, RT0, LH2, LT10
+# on wider boards, LEC/REC for encoders, and the like
+KEY_LABEL_PATTERN = LazyPattern(r'^[LR](?:[A-Z]{1,2}\d{1,2}|EC\d?)$')
+KEY_POSITION_VALUE_PATTERN = LazyPattern(r'^(\d+)\b')
+
+def strip_comments(line, in_block_comment):
+    """Remove // and /* ... */ comments from a line, tracking open block comments across lines.
+
+    Comment markers inside "..." strings, like a URL in a display-name, are kept.
+    """
+    if not in_block_comment and '/' not in line:
+        return line, False
+
+    code = []
+    pos = 0
+    length = len(line)
+    while pos < length:
+        if in_block_comment:
+            end = line.find('*/', pos)
+            if end < 0:
+                return ''.join(code), True
+            pos = end + 2
+            in_block_comment = False
+            continue
+
+        slash = line.find('/', pos)
+        if slash < 0 or slash + 1 >= length:
+            code.append(line[pos:])
+            break
+        quote = line.find('"', pos, slash)
+        if quote >= 0:
+            end = quote + 1
+            while end < length and line[end] != '"':
+                end += 2 if line[end] == '\\' else 1
+            code.append(line[pos:end + 1])
+            pos = end + 1
+            continue
+        nxt = line[slash + 1]
+        if nxt == '/':
+            code.append(line[pos:slash])
+            break
+        if nxt == '*':
+            code.append(line[pos:slash])
+            code.append(' ')
+            pos = slash + 2
+            in_block_comment = True
+            continue
+        code.append(line[pos:slash + 1])
+        pos = slash + 1
+
+    return ''.join(code), in_block_comment
+
+def scan_preprocessor(content, path=None):
+    """Scan a file once and collect its includes, defines, key positions and conditional regions.
+
+    Every directive keeps the file and line it came from, and the
+    #ifdef/#ifndef/#if/#elif conditions that select its branch as
+    (directive, symbol, expected) tuples: inside an #elif or #else the
+    conditions of the earlier branches of its chain are expected false.
+    """
+    scan = {
+        'path': path,
+        'includes': [],
+        'defines': [],
+        'macros': [],
+        'flags': [],
+        'undefs': [],
+        'key_positions': [],
+        'conditionals': [],
+    }
+    open_regions = []
+    in_block_comment = False
+    pending = None
+    pending_line = 0
+
+    for line_number, line in enumerate(content.split('\n'), 1):
+        if not in_block_comment and '#' not in line and pending is None:
+            # Fast path: nothing on this line can start a directive or a comment we care about
+            if '/*' not in line:
+                continue
+
+        code, in_block_comment = strip_comments(line, in_block_comment)
+
+        if pending is not None:
+            code = pending + code
+            directive_line = pending_line
+            pending = None
+        else:
+            directive_line = line_number
+
+        stripped = code.strip()
+        if not stripped.startswith('#'):
+            continue
+        if stripped.endswith('\\'):
+            # Line continuation, keep collecting the directive
+            pending = stripped[:-1] + ' '
+            pending_line = directive_line
+            continue
+
+        match = DIRECTIVE_PATTERN.match(stripped)
+        if not match:
+            continue
+        kind, rest = match.group(1), match.group(2).strip()
+        conditions = tuple(condition for region in open_regions for condition in region[5])
+
+        if kind == 'include':
+            include_match = INCLUDE_PATTERN.search(rest)
+            if include_match:
+                scan['includes'].append(Directive('include', include_match.group(1), None, path, directive_line, conditions))
+        elif kind == 'define':
+            define_match = DEFINE_PATTERN.match(rest)
+            if not define_match:
+                continue
+            name, params, value = define_match.group(1), define_match.group(2), define_match.group(3).strip()
+            if params is not None:
+                scan['macros'].append(Directive('macro', name, (params[1:-1], value), path, directive_line, conditions))
+            elif value:
+                scan['defines'].append(Directive('define', name, value, path, directive_line, conditions))
+                if KEY_LABEL_PATTERN.match(name):
+                    position_match = KEY_POSITION_VALUE_PATTERN.match(value)
+                    if position_match:
+                        scan['key_positions'].append(
+                            Directive('key_position', name, position_match.group(1), path, directive_line, conditions))
+            else:
+                scan['flags'].append(Directive('flag', name, None, path, directive_line, conditions))
+        elif kind == 'undef':
+            if rest:
+                scan['undefs'].append(Directive('undef', rest.split()[0], None, path, directive_line, conditions))
+        elif kind in ('ifdef', 'ifndef', 'if'):
+            # [directive, symbol, start line, else line, branches, conditions of the current branch]
+            open_regions.append([kind, rest, directive_line, None, [(kind, rest, directive_line)], ((kind, rest, True),)])
+        elif kind in ('else', 'elif'):
+            if not open_regions or open_regions[-1][4][-1][0] == 'else':
+                logger.warning(f"Unmatched #{kind} in {path}:{directive_line}")
+                continue
+            region = open_regions[-1]
+            if region[3] is None:
+                region[3] = directive_line
+            region[4].append((kind, rest if kind == 'elif' else None, directive_line))
+            skipped = tuple((directive, symbol, False) for directive, symbol, _ in region[4][:-1])
+            region[5] = skipped + (((kind, rest, True),) if kind == 'elif' else ())
+        elif kind == 'endif':
+            if open_regions:
+                directive, symbol, start_line, else_line, branches, _ = open_regions.pop()
+                scan['conditionals'].append(
+                    ConditionalRegion(directive, symbol, path, start_line, else_line, directive_line, tuple(branches)))
+            else:
+                logger.warning(f"Unmatched #endif in {path}:{directive_line}")
+
+    for directive, symbol, start_line, *_ in open_regions:
+        logger.warning(f"Unterminated #{directive} {symbol} in {path}:{start_line}")
+
+    return scan
+
+_reported_conditions = set()
+
+def evaluate_condition(directive, expression, symbols):
+    """Evaluate an #ifdef/#ifndef/#if condition against a table of defined symbols.
+
+    #if is evaluated like the C preprocessor does: integer arithmetic,
+    defined, and identifiers replaced by their values, which may be
+    expressions themselves. Undefined identifiers count as 0 and symbols
+    defined without a value (like -D flags) as 1. A condition that can't be
+    evaluated is reported once and treated as false.
+    """
+    if directive in ('ifdef', 'ifndef'):
+        name = expression.split()[0] if expression else ''
+        return (name in symbols) == (directive == 'ifdef')
+    from keymap_expr import evaluate_integer
+
+    def value(name, expanding=frozenset()):
+        # Function-like macros aren't expanded without arguments and a symbol
+        # defined in terms of itself isn't expanded again, both count as 0
+        if symbols.get(name) is None or name in expanding:
+            return 0
+        text = (symbols[name] or '').strip()
+        if not text:
+            return 1
+        return evaluate_integer(text, lambda inner: value(inner, expanding | {name}), symbols.__contains__)
+
+    try:
+        return bool(evaluate_integer(expression, value, symbols.__contains__))
+    except (ValueError, RecursionError) as e:
+        if expression not in _reported_conditions:
+            _reported_conditions.add(expression)
+            logger.warning(f"Can't evaluate #if {expression} ({e}), treating it as false")
+        return False
+
+def conditions_hold(conditions, symbols):
+    """Check the (directive, symbol, expected) conditions recorded for a directive."""
+    return all(evaluate_condition(directive, symbol, symbols) == expected
+               for directive, symbol, expected in conditions)
+
+def inactive_lines(scan, symbols):
+    """Line numbers of a scanned file that lie in #if/#elif/#else branches not taken."""
+    lines = set()
+    for region in scan['conditionals']:
+        taken = None
+        for index, (directive, symbol, _) in enumerate(region.branches):
+            if directive == 'else' or evaluate_condition(directive, symbol, symbols):
+                taken = index
+                break
+        ends = [line for _, _, line in region.branches[1:]] + [region.end_line]
+        for index, ((_, _, start), end) in enumerate(zip(region.branches, ends)):
+            if index != taken:
+                lines.update(range(start, end + 1))
+    return lines
+
+def resolve_include(include_path, base_dir, project_root):
+    """Resolve a single include name to a file path, or None when it should be skipped or can't be found."""
+    # Skip system includes and ZMK core includes
+    if include_path.startswith('<') or include_path.startswith('dt-bindings/') or include_path.startswith('behaviors') or include_path.startswith('input/'):
+        logger.debug(f"Skipping system/ZMK include: {include_path}")
+        return None
+
+    # Special handling for zmk-helpers files
+    if include_path.startswith("zmk-helpers/"):
+        candidates = [
+            os.path.join(project_root, include_path),
+            os.path.join(project_root, "..", include_path),
+            os.path.join(project_root, "..", "..", include_path)
+        ]
+    else:
+        # Local include paths
+        candidates = [
+            os.path.join(base_dir, include_path),
+            os.path.join(base_dir, "includes", include_path),
+            os.path.join(project_root, include_path),
+            os.path.join(project_root, "includes", include_path)
+        ]
+
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            logger.debug(f"Found include file: {candidate}")
+            return candidate
+
+    logger.warning(f"Could not find include file: {include_path}")
+    # For key-labels headers (sofle.h, 42.h, ...), look in the zmk-helpers folder
+    if "key-labels" in include_path:
+        header_name = os.path.basename(include_path)
+        helpers_dirs = [
+            os.path.join(project_root, "zmk-helpers"),
+            os.path.join(project_root, "..", "zmk-helpers"),
+            os.path.join(project_root, "..", "..", "zmk-helpers")
+        ]
+
+        for helpers_dir in helpers_dirs:
+            header_path = os.path.join(helpers_dir, "include", "zmk-helpers", "key-labels", header_name)
+            if os.path.exists(header_path):
+                logger.info(f"Found {header_name} at: {header_path}")
+                return header_path
+
+        logger.info(f"Could not find key-labels/{header_name} in zmk-helpers")
+
+    return None
+
+class IncludeResolver:
+    """Memoizes resolve_include() per (include name, search root) for one project root."""
+
+    def __init__(self, project_root):
+        self.project_root = project_root
+        self._resolved = {}
+
+    def resolve(self, include_path, base_dir):
+        key = (include_path, os.path.normpath(base_dir))
+        if key not in self._resolved:
+            self._resolved[key] = resolve_include(include_path, base_dir, self.project_root)
+        return self._resolved[key]
+
+def find_includes(content, base_dir, project_root, scan=None, resolver=None):
+    """Find all #include statements and return a list of file paths."""
+    if scan is None:
+        scan = scan_preprocessor(content)
+    if resolver is None:
+        resolver = IncludeResolver(project_root)
+
+    includes = []
+    for directive in scan['includes']:
+        logger.debug(f"Found include: {directive.name}")
+        resolved = resolver.resolve(directive.name, base_dir)
+        if resolved:
+            includes.append(resolved)
+
+    return includes
+
+def extract_defines(content, scans=None):
+    """Extract #define statements and return a dictionary of replacements."""
+    if scans is None:
+        scans = [scan_preprocessor(content)]
+
+    defines = {}
+    for scan in scans:
+        for directive in sorted(scan['defines'] + scan['undefs'], key=lambda d: d.line):
+            if directive.kind == 'undef':
+                defines.pop(directive.name, None)
+            else:
+                defines[directive.name] = directive.value
+
+    logger.info(f"Extracted {len(defines)} define statements")
+    return defines
+
+MACRO_TOKEN_PATTERN = LazyPattern(r'"(?:\\.|[^"\\])*"|[A-Za-z_]\w*')
+MACRO_BODY_TOKEN_PATTERN = LazyPattern(r'##|#|"(?:\\.|[^"\\])*"|[A-Za-z_]\w*|\s+|.')
+MACRO_PASTE_PATTERN = LazyPattern(r'\s*##\s*')
+MACRO_TRAILING_NAME_PATTERN = LazyPattern(r'(?<!\w)([A-Za-z_]\w*)\s*$')
+# Deeper expansions are left as is, well within Python's recursion limit
+MACRO_EXPANSION_DEPTH = 200
+
+def split_macro_call(text, start):
+    """Split the argument list of a macro call whose '(' is the next non-blank character at start.
+
+    Returns (arguments, end of the call) or None if text has no complete
+    argument list there. Commas inside nested parentheses or strings don't
+    split arguments.
+    """
+    position = start
+    while position < len(text) and text[position].isspace():
+        position += 1
+    if position >= len(text) or text[position] != '(':
+        return None
+    depth = 0
+    args = []
+    arg_start = position + 1
+    in_string = False
+    for index in range(position, len(text)):
+        char = text[index]
+        if in_string:
+            if char == '\\':
+                in_string = 'escape'
+            elif in_string == 'escape':
+                in_string = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                args.append(text[arg_start:index].strip())
+                return ([] if args == [''] else args), index + 1
+        elif char == ',' and depth == 1:
+            args.append(text[arg_start:index].strip())
+            arg_start = index + 1
+    return None
+
+class MacroTable:
+    """Object-like and function-like #defines of an include graph, expanded on demand.
+
+    Nothing is expanded up front: expand() only looks at the identifiers of
+    the text it is given, such as one property value or binding. The result
+    of every define and every macro call is memoized, so each is expanded
+    once however often it is referred to. As with the C preprocessor, a
+    name met again while it is being expanded, directly or through other
+    macros, stays as it is; each such recursion is reported once. macros maps names to
+    (parameters, body), see scan_preprocessor().
+    """
+
+    def __init__(self, defines=None, macros=None):
+        self.defines = defines or {}
+        self.macros = macros or {}
+        self._expanded = {}
+        self._calls = {}
+        self._active = []
+        self._cycles = 0
+        self._reported = set()
+
+    def with_defines(self, overrides):
+        """A table with some defines replaced, e.g. -D overrides, sharing the function-like macros."""
+        return MacroTable(dict(self.defines, **overrides), self.macros)
+
+    def expand(self, text):
+        """Expand every define and macro call in text."""
+        if not isinstance(text, str):
+            return text
+        parts = []
+        position = 0
+        match = MACRO_TOKEN_PATTERN.search(text)
+        while match:
+            name = match.group(0)
+            end = match.end()
+            replacement = None
+            if name in self.macros:
+                call = split_macro_call(text, end)
+                if call is not None:
+                    args, end = call
+                    replacement = self._call(name, args, text[match.start():end])
+            elif name in self.defines:
+                replacement = self._expand_define(name)
+            if replacement is not None:
+                replacement, end = self._call_trailing(replacement, text, end)
+                parts.append(text[position:match.start()])
+                parts.append(replacement)
+                position = end
+            match = MACRO_TOKEN_PATTERN.search(text, end)
+        if not parts:
+            return text
+        parts.append(text[position:])
+        return ''.join(parts)
+
+    def _call_trailing(self, replacement, text, end):
+        """Call a function-like macro that replacement ends with on the arguments after end in text.
+
+        C rescans a replacement together with the rest of the input, so with
+        '#define F G' and a function-like G, 'F(2)' calls G. Returns the new
+        replacement and the end of the text it covers.
+        """
+        match = MACRO_TRAILING_NAME_PATTERN.search(replacement)
+        while match and match.group(1) in self.macros:
+            call = split_macro_call(text, end)
+            if call is None:
+                break
+            name = match.group(1)
+            args, call_end = call
+            replacement = replacement[:match.start()] + self._call(name, args, name + text[end:call_end])
+            end = call_end
+            match = MACRO_TRAILING_NAME_PATTERN.search(replacement)
+        return replacement, end
+
+    def _enter(self, name):
+        """Push name on the expansion stack, or return False if that would recurse."""
+        if len(self._active) >= MACRO_EXPANSION_DEPTH:
+            self._cycles += 1
+            if name not in self._reported:
+                self._reported.add(name)
+                logger.warning(f"Macro {name} is nested more than {MACRO_EXPANSION_DEPTH} levels deep, leaving it unexpanded")
+            return False
+        if name not in self._active:
+            self._active.append(name)
+            return True
+        cycle = self._active[self._active.index(name):]
+        self._cycles += 1
+        if name not in self._reported:
+            self._reported.add(name)
+            logger.warning(f"Recursive macro {' -> '.join(cycle + [name])}, leaving {name} unexpanded")
+        return False
+
+    def _expand_define(self, name):
+        if name in self._expanded:
+            return self._expanded[name]
+        if not self._enter(name):
+            return name
+        cycles = self._cycles
+        try:
+            value = self.expand(self.defines[name].strip())
+        finally:
+            self._active.pop()
+        # Results that ran into a recursion depend on the stack they were expanded from
+        if self._cycles == cycles:
+            self._expanded[name] = value
+        return value
+
+    def _call(self, name, args, original):
+        key = (name, tuple(args))
+        if key in self._calls:
+            return self._calls[key]
+        params, body = self.macros[name]
+        variadic = bool(params) and params[-1] == '...'
+        named = params[:-1] if variadic else params
+        if len(args) < len(named) or (len(args) > len(named) and not variadic):
+            logger.warning(f"Macro {name} takes {len(named)} argument(s), got {len(args)}: {original}")
+            return original
+        if not self._enter(name):
+            return original
+        cycles = self._cycles
+        try:
+            raw = dict(zip(named, args))
+            if variadic:
+                raw['__VA_ARGS__'] = ', '.join(args[len(named):])
+            value = self.expand(self._substitute(body, raw))
+        finally:
+            self._active.pop()
+        if self._cycles == cycles:
+            self._calls[key] = value
+        return value
+
+    def _substitute(self, body, raw):
+        """Put the arguments into body: '#param' stringified, '##' operands as written, others expanded."""
+        tokens = MACRO_BODY_TOKEN_PATTERN.findall(body)
+        significant = [i for i, token in enumerate(tokens) if not token.isspace()]
+        neighbours = {i: (tokens[significant[n - 1]] if n else None,
+                          tokens[significant[n + 1]] if n + 1 < len(significant) else None)
+                      for n, i in enumerate(significant)}
+        out = []
+        for i, token in enumerate(tokens):
+            if token not in raw:
+                out.append(token)
+                continue
+            before, after = neighbours[i]
+            if before == '#':
+                while out and (out[-1].isspace() or out[-1] == '#'):
+                    if out.pop() == '#':
+                        break
+                out.append('"' + raw[token].replace('\\', '\\\\').replace('"', '\\"') + '"')
+            elif before == '##' or after == '##':
+                out.append(raw[token])
+            else:
+                out.append(self.expand(raw[token]))
+        return MACRO_PASTE_PATTERN.sub('', ''.join(out))
+
+def extract_key_positions(content, scans=None):
+    """Extract key position definitions from a file."""
+    if scans is None:
+        scans = [scan_preprocessor(content)]
+
+    key_positions = {}
+    for scan in scans:
+        for directive in scan['key_positions']:
+            key_positions[directive.name] = directive.value
+            logger.debug(f"Found key position: {directive.name} -> {directive.value}")
+
+    if key_positions:
+        logger.info(f"Extracted {len(key_positions)} key positions")
+        logger.debug(f"Sample key positions: {list(key_positions.items())[:5]}")
+
+    return key_positions
+
+KEY_LABELS_DIR_NAME = "key-labels"
+KEY_INDEX_PREFIX = "keypos"
+
+class KeyPositionIndex(dict):
+    """Key label to position table, e.g. compiled from a zmk-helpers key-labels header.
+
+    Maps labels like LT4 to positions as strings, the form they take in the
+    keymap, and labels maps positions back to the first label defining them.
+    source tells which headers the positions came from and whether the last
+    compiled index stood in for a missing one, see resolve_key_positions().
+    """
+
+    def __init__(self, positions=(), board=None, source_hash=None, source=''):
+        super().__init__(positions)
+        self.board = board
+        self.source_hash = source_hash
+        self.source = source
+        self.labels = {}
+        for label, position in self.items():
+            self.labels.setdefault(int(position), label)
+
+    def position(self, label):
+        """Numeric position of label, or None."""
+        position = self.get(label)
+        return None if position is None else int(position)
+
+    def label(self, position):
+        """First label defined for position, or None."""
+        return self.labels.get(int(position))
+
+    def to_json(self):
+        positions = {label: int(position) for label, position in self.items()}
+        import json
+        return json.dumps({'board': self.board, 'hash': self.source_hash, 'positions': positions}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        import json
+        data = json.loads(text)
+        positions = {label: str(position) for label, position in data['positions'].items()}
+        return cls(positions, data.get('board'), data.get('hash'))
+
+def is_key_labels_header(include_name):
+    return f"{KEY_LABELS_DIR_NAME}/" in include_name.replace(os.sep, '/')
+
+def header_board(include_name):
+    """Board a key-labels header is for, e.g. key-labels/sofle.h -> sofle."""
+    return os.path.splitext(os.path.basename(include_name))[0]
+
+def compile_key_labels(scan, board=None, source_hash=None):
+    """Compile every '#define LABEL <position>' of a key-labels header, whatever the label names.
+
+    Labels defined as another label (aliases) get that label's position.
+    """
+    positions = {}
+    for directive in scan['defines']:
+        position_match = KEY_POSITION_VALUE_PATTERN.match(directive.value)
+        if position_match:
+            positions[directive.name] = position_match.group(1)
+        elif directive.value in positions:
+            positions[directive.name] = positions[directive.value]
+    return KeyPositionIndex(positions, board, source_hash)
+
+_key_position_indexes = {}
+
+def load_key_position_index(path, content, scan, cache_dir=None):
+    """Return the compiled index of a key-labels header, from memory, cache_dir or by compiling it.
+
+    Index files are named keypos-<board>-<header hash>.json, so an edited
+    header is compiled again and the index of an unchanged one loads in
+    well under a millisecond. Without cache_dir nothing is hashed (the lint
+    doesn't need the hash and skips importing hashlib) and the index has no
+    source_hash.
+    """
+    source_hash = hash_text(content) if cache_dir else None
+    memo_key = source_hash or content
+    if memo_key in _key_position_indexes:
+        return _key_position_indexes[memo_key]
+    board = header_board(path)
+    index_path = os.path.join(cache_dir, f"{KEY_INDEX_PREFIX}-{board}-{source_hash[:16]}.json") if cache_dir else None
+    index = None
+    if index_path:
+        try:
+            with open(index_path, 'r') as f:
+                index = KeyPositionIndex.from_json(f.read())
+            logger.debug(f"Loaded key position index {index_path}")
+        except (OSError, ValueError, KeyError):
+            index = None
+    if index is None:
+        index = compile_key_labels(scan, board, source_hash)
+        logger.info(f"Compiled {len(index)} key positions for {board} from {path}")
+        if index_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(index.to_json())
+            os.replace(tmp_path, index_path)
+    _key_position_indexes[memo_key] = index
+    return index
+
+def clear_memos():
+    """Forget the parsed #if expressions and key position indexes kept for the life of the process."""
+    from keymap_expr import _parsed_expressions
+    _parsed_expressions.clear()
+    _key_position_indexes.clear()
+
+def latest_key_position_index(cache_dir, board):
+    """The most recently compiled index for board in cache_dir, for when its header isn't checked out."""
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return None
+    prefix = f"{KEY_INDEX_PREFIX}-{board}-"
+    candidates = [entry for entry in os.scandir(cache_dir) if entry.name.startswith(prefix) and entry.name.endswith(".json")]
+    for entry in sorted(candidates, key=lambda entry: entry.stat().st_mtime, reverse=True):
+        try:
+            with open(entry.path, 'r') as f:
+                return KeyPositionIndex.from_json(f.read())
+        except (OSError, ValueError, KeyError):
+            continue
+    return None
+
+def resolve_key_positions(scans, headers=(), contents=None, cache_dir=None):
+    """Build the key position index of a keymap.
+
+    headers lists the (include name, resolved path or None) of its
+    key-labels includes. Each found header is compiled (or loaded from
+    cache_dir), a header that isn't checked out falls back to the last
+    index compiled for its board. Labels defined in the other scanned files
+    override the header's.
+    """
+    scan_by_path = {scan['path']: scan for scan in scans}
+    positions = {}
+    boards = []
+    source_hashes = []
+    sources = []
+    header_paths = set()
+    for include_name, path in headers:
+        board = header_board(include_name)
+        if path in scan_by_path and contents and path in contents:
+            header_paths.add(path)
+            index = load_key_position_index(path, contents[path], scan_by_path[path], cache_dir)
+            sources.append(f"{board} header {index.source_hash}")
+        else:
+            index = latest_key_position_index(cache_dir, board)
+            if index is None:
+                logger.warning(f"Key labels header {include_name} not found and never compiled, key labels stay unresolved")
+                sources.append(f"{board} missing")
+                continue
+            logger.warning(f"Key labels header {include_name} not found, using the last compiled index for {board}")
+            sources.append(f"{board} fallback {index.source_hash}")
+        positions.update(index)
+        boards.append(board)
+        source_hashes.append(index.source_hash or '')
+
+    overrides = extract_key_positions(None, [scan for scan in scans if scan['path'] not in header_paths])
+    positions.update(overrides)
+    if not positions:
+        logger.warning("No key positions found, key labels in combos stay unresolved")
+    return KeyPositionIndex(positions, '+'.join(boards) or None, hash_text(*source_hashes) if any(source_hashes) else None,
+                            ', '.join(sources))
+
+INCLUDE_READ_WORKERS = 8
+
+def read_and_scan(path):
+    """Read a file and run the preprocessor scan on it."""
+    content = read_file(path)
+    return content, (scan_preprocessor(content, path) if content else None)
+
+def load_source(path, file_cache=None):
+    """Read and scan a file, reusing the (content, scan) pair from file_cache when present."""
+    if file_cache is not None and path in file_cache:
+        return file_cache[path]
+    loaded = read_and_scan(path)
+    if file_cache is not None:
+        file_cache[path] = loaded
+    return loaded
+
+class IncludeGraph:
+    """The keymap, sofle.keymap and every resolved include, with their scans and include edges.
+
+    contents and scans keep the breadth-first discovery order, which later
+    defines rely on to override earlier ones. edges maps each file to the
+    resolved paths it includes.
+    """
+
+    def __init__(self, keymap_path, base_dir, project_root, resolver=None, cache_dir=None):
+        self.keymap_path = keymap_path
+        self.base_dir = base_dir
+        self.project_root = project_root
+        self.resolver = resolver or IncludeResolver(project_root)
+        self.cache_dir = cache_dir
+        self.keymap_content = ""
+        self.roots = []
+        self.contents = {}
+        self.scans = []
+        self.scan_by_path = {}
+        self.edges = {}
+        self.flags = {}
+        self._trees = {}
+        self._symbols = None
+        self._active_paths = None
+        self._defines = None
+        self._function_macros = None
+        self._macros = None
+        self._key_positions = None
+
+    def add(self, path, content, scan, includes):
+        self.contents[path] = content
+        self.scans.append(scan)
+        self.scan_by_path[path] = scan
+        self.edges[path] = includes
+
+    def variant(self, flags):
+        """A view of the graph with extra defines (like -D), for rendering feature-flag variants.
+
+        File contents, scans and already parsed trees are shared with this
+        graph, only the derived define tables are recomputed.
+        """
+        import copy
+        graph = copy.copy(self)
+        graph.flags = dict(flags)
+        graph._symbols = graph._active_paths = graph._defines = graph._key_positions = None
+        graph._function_macros = graph._macros = None
+        return graph
+
+    def _evaluate(self):
+        """Walk the files in preprocessor order, collecting the defines and includes whose conditions hold."""
+        symbols = dict(self.flags)
+        function_macros = {}
+        active = []
+        visited = set()
+
+        def visit(path):
+            visited.add(path)
+            active.append(path)
+            scan = self.scan_by_path[path]
+            base_dir = os.path.dirname(path)
+            directives = sorted(scan['includes'] + scan['defines'] + scan['flags'] + scan['macros'] + scan['undefs'],
+                                key=lambda d: d.line)
+            for directive in directives:
+                if directive.conditions and not conditions_hold(directive.conditions, symbols):
+                    continue
+                if directive.kind == 'include':
+                    resolved = self.resolver.resolve(directive.name, base_dir)
+                    if resolved in self.scan_by_path and resolved not in visited:
+                        visit(resolved)
+                elif directive.kind == 'macro':
+                    symbols[directive.name] = None
+                    function_macros[directive.name] = directive.value
+                elif directive.kind == 'undef':
+                    symbols.pop(directive.name, None)
+                    function_macros.pop(directive.name, None)
+                else:
+                    symbols[directive.name] = directive.value or ''
+
+        for root in self.roots:
+            if root in self.scan_by_path and root not in visited:
+                visit(root)
+        # Variant flags win over definitions in the files
+        symbols.update(self.flags)
+        self._symbols = symbols
+        self._function_macros = {name: macro for name, macro in function_macros.items() if symbols.get(name, '') is None}
+        self._active_paths = active
+
+    def symbols(self):
+        """Every symbol defined for this variant (defines, flags and macros) as the preprocessor sees it."""
+        if self._symbols is None:
+            self._evaluate()
+        return self._symbols
+
+    def active_paths(self):
+        """Files reached through includes whose #ifdef conditions hold, in preprocessor order."""
+        if self._active_paths is None:
+            self._evaluate()
+        return self._active_paths
+
+    def defines(self):
+        """All object-like defines of the graph, later definitions overriding earlier ones."""
+        if self._defines is None:
+            if self.flags or any(scan['conditionals'] or scan['undefs'] for scan in self.scans):
+                self._defines = {name: value for name, value in self.symbols().items() if value}
+                logger.info(f"Extracted {len(self._defines)} define statements")
+            else:
+                self._defines = extract_defines(None, self.scans)
+        return self._defines
+
+    def macros(self):
+        """MacroTable of the object-like defines and function-like macros, expanded on demand and memoized."""
+        if self._macros is None:
+            if self._function_macros is None:
+                self._evaluate()
+            macros = {name: (tuple(p.strip() for p in params.split(',') if p.strip()), body)
+                      for name, (params, body) in self._function_macros.items()}
+            self._macros = MacroTable(self.defines(), macros)
+        return self._macros
+
+    def key_label_headers(self):
+        """(include name, resolved path or None) of every active key-labels include."""
+        headers = []
+        for path in self.active_paths():
+            for directive in self.scan_by_path[path]['includes']:
+                if is_key_labels_header(directive.name):
+                    headers.append((directive.name, self.resolver.resolve(directive.name, os.path.dirname(path))))
+        return headers
+
+    def key_positions(self):
+        """KeyPositionIndex compiled from the key-labels header of the include graph."""
+        if self._key_positions is None:
+            self._key_positions = resolve_key_positions(
+                self.scans, self.key_label_headers(), self.contents, self.cache_dir)
+        return self._key_positions
+
+    def tree(self, path):
+        """The parsed devicetree of one file, parsed at most once per set of inactive #ifdef branches."""
+        skip_lines = frozenset(inactive_lines(self.scan_by_path[path], self.symbols()))
+        key = (path, skip_lines)
+        if key not in self._trees:
+            self._trees[key] = parse_devicetree(self.contents[path], path, skip_lines)
+        return self._trees[key]
+
+    def dependents(self, path):
+        """Return the files that include path, directly or through other includes."""
+        included_by = {}
+        for parent, children in self.edges.items():
+            for child in children:
+                included_by.setdefault(child, set()).add(parent)
+
+        dependents = set()
+        pending = [path]
+        while pending:
+            for parent in included_by.get(pending.pop(), ()):
+                if parent not in dependents:
+                    dependents.add(parent)
+                    pending.append(parent)
+        return dependents
+
+    def unresolved_includes(self):
+        """Sorted names of the includes that didn't resolve to a file, like those of modules that aren't checked out."""
+        names = set()
+        for scan in self.scans:
+            base_dir = os.path.dirname(scan['path'])
+            for directive in scan['includes']:
+                if self.resolver.resolve(directive.name, base_dir) is None:
+                    names.add(directive.name)
+        return sorted(names)
+
+def build_include_graph(keymap_path, file_cache=None, resolver=None, cache_dir=None, workers=INCLUDE_READ_WORKERS):
+    """Read the keymap, sofle.keymap and every resolved include, scanning each file once.
+
+    Includes are walked breadth-first with a deque. As soon as a file is
+    discovered its read is submitted to a thread pool, so independent
+    includes load concurrently while the walk keeps its deterministic order.
+    With workers=1 the files are read during the walk instead, which saves
+    starting the pool when there are only a few of them.
+    Files already present in file_cache are not read again, which lets watch
+    mode refresh only the files that changed. cache_dir is where compiled
+    key position indexes are kept.
+    """
+    base_dir = os.path.dirname(keymap_path)
+    project_root = os.path.dirname(base_dir)
+
+    logger.debug(f"Base directory: {base_dir}")
+    logger.debug(f"Project root: {project_root}")
+
+    started = time.perf_counter()
+    if file_cache is None:
+        file_cache = {}
+    if resolver is None:
+        resolver = IncludeResolver(project_root)
+    graph = IncludeGraph(keymap_path, base_dir, project_root, resolver, cache_dir)
+
+    # Find sofle.keymap for key position info
+    roots = [keymap_path]
+    sofle_keymap_path = os.path.join(base_dir, "sofle.keymap")
+    if os.path.exists(sofle_keymap_path):
+        roots.append(sofle_keymap_path)
+    graph.roots = roots
+
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=workers)
+    pending_reads = {}
+
+    def prefetch(path):
+        if executor is not None and path not in file_cache and path not in pending_reads:
+            pending_reads[path] = executor.submit(read_and_scan, path)
+
+    def load(path):
+        if path not in file_cache:
+            pending = pending_reads.pop(path, None)
+            file_cache[path] = pending.result() if pending is not None else read_and_scan(path)
+        return file_cache[path]
+
+    try:
+        for path in roots:
+            prefetch(path)
+
+        keymap_content, _ = load(keymap_path)
+        if not keymap_content:
+            logger.error(f"Empty keymap content from {keymap_path}")
+            profiler.record("include resolution", time.perf_counter() - started)
+            return graph
+        graph.keymap_content = keymap_content
+
+        # Roots are processed first, then their includes breadth-first
+        queue = deque()
+        for path in roots:
+            content, scan = load(path)
+            if not content:
+                continue
+            includes = find_includes(content, base_dir, project_root, scan, resolver)
+            graph.add(path, content, scan, includes)
+            for include_path in includes:
+                prefetch(include_path)
+            queue.extend(includes)
+
+        processed_includes = set()
+
+        while queue:
+            include_path = queue.popleft()
+            if include_path in processed_includes:
+                continue
+
+            processed_includes.add(include_path)
+            include_content, include_scan = load(include_path)
+
+            if include_content:
+                # Find nested includes
+                new_includes = find_includes(include_content, os.path.dirname(include_path), project_root, include_scan, resolver)
+                graph.add(include_path, include_content, include_scan, new_includes)
+                for nested in new_includes:
+                    if nested not in processed_includes:
+                        prefetch(nested)
+                        queue.append(nested)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logger.info(f"Processed {len(processed_includes)} includes")
+    profiler.record("include resolution", time.perf_counter() - started, len(graph.contents))
+    return graph
+
+PREPROCESSOR_DIRECTIVES = {'include', 'define', 'undef', 'ifdef', 'ifndef', 'if', 'elif', 'else', 'endif', 'pragma', 'error', 'warning'}
+DEVICETREE_TOKEN_PATTERN = LazyPattern(r'"(?:\\.|[^"\\])*"|<[^>]*>|\[[^\]]*\]|[{};]|[^"<\[{};]+')
+NODE_HEADER_PATTERN = LazyPattern(r'^((?:[\w-]+\s*:\s*)*)(.+)$')
+CELL_PATTERN = LazyPattern(r'<([^>]*)>')
+BINDING_PATTERN = LazyPattern(r'&[^&]+')
+LAYER_BEHAVIORS = {'&mo', '&lt', '&to', '&tog', '&sl'}
+LAYER_PROPERTIES = ('layers', 'if-layers', 'then-layer')
+KEY_POSITION_PROPERTIES = ('key-positions', 'hold-trigger-key-positions')
+
+class DTNode:
+    """A devicetree node with its labels, raw property values, children and source location."""
+
+    def __init__(self, name, labels=(), parent=None, source=None, line=0):
+        self.name = name
+        self.labels = list(labels)
+        self.parent = parent
+        self.source = source
+        self.line = line
+        self.properties = {}
+        self.children = []
+
+    def __repr__(self):
+        return f"DTNode({self.path!r}, {self.source}:{self.line})"
+
+    @property
+    def path(self):
+        if self.parent is None or self.parent.parent is None:
+            return self.name
+        parent_path = self.parent.path
+        return f"{parent_path.rstrip('/')}/{self.name}"
+
+    @property
+    def compatible(self):
+        value = self.properties.get('compatible')
+        return value.strip('"') if value else None
+
+    def child(self, name):
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def cells(self, name):
+        """Return the contents of each <...> group of a property, e.g. ['&kp LG(Z)']."""
+        value = self.properties.get(name)
+        if not value or value is True:
+            return []
+        return [cell.strip() for cell in CELL_PATTERN.findall(value)]
+
+    def tokens(self, name):
+        """Return the whitespace separated tokens of all <...> groups of a property."""
+        return ' '.join(self.cells(name)).split()
+
+    def bindings(self, name='bindings'):
+        """Split a bindings property into individual behavior invocations, e.g. ['&kp A', '&lt NAV TAB']."""
+        return split_bindings(' '.join(self.cells(name)))
+
+def split_bindings(text):
+    """Split a run of bindings into individual behavior invocations."""
+    return [binding.strip() for binding in BINDING_PATTERN.findall(text)]
+
+def devicetree_code(content, skip_lines=None):
+    """Return content with comments, preprocessor directives and skip_lines blanked out, keeping line numbers."""
+    lines = []
+    in_block_comment = False
+    continuation = False
+    for line_number, line in enumerate(content.split('\n'), 1):
+        code, in_block_comment = strip_comments(line, in_block_comment)
+        if skip_lines and line_number in skip_lines:
+            lines.append('')
+            continue
+        stripped = code.strip()
+        if continuation:
+            continuation = stripped.endswith('\\')
+            lines.append('')
+            continue
+        if stripped.startswith('#'):
+            match = DIRECTIVE_PATTERN.match(stripped)
+            # '#binding-cells' is a property, '#define' and friends are not
+            if match and match.group(1) in PREPROCESSOR_DIRECTIVES:
+                continuation = stripped.endswith('\\')
+                lines.append('')
+                continue
+        lines.append(code)
+    return '\n'.join(lines)
+
+def parse_devicetree(content, path=None, skip_lines=None):
+    """Parse devicetree source into a tree of DTNode, handling nested braces.
+
+    The returned root is a synthetic node whose children are the top-level
+    '/ { ... }' and '&label { ... }' blocks of the file. skip_lines holds
+    line numbers of #ifdef branches that aren't taken.
+    """
+    code = devicetree_code(content, skip_lines)
+    root = DTNode('', source=path)
+    stack = [root]
+    statement = []
+    statement_start = 0
+    line = 1
+    scanned_to = 0
+
+    for match in DEVICETREE_TOKEN_PATTERN.finditer(code):
+        token = match.group(0)
+        if token == '{':
+            header = ''.join(statement).strip()
+            line += code.count('\n', scanned_to, statement_start)
+            scanned_to = statement_start
+            header_match = NODE_HEADER_PATTERN.match(header)
+            if header_match:
+                labels = [label.strip() for label in header_match.group(1).split(':') if label.strip()]
+                name = header_match.group(2).strip()
+            else:
+                labels, name = [], header
+            node = DTNode(name, labels, stack[-1], path, line)
+            stack[-1].children.append(node)
+            stack.append(node)
+            statement = []
+        elif token == '}':
+            if len(stack) > 1:
+                stack.pop()
+            else:
+                logger.warning(f"Unbalanced '}}' in {path}")
+            statement = []
+        elif token == ';':
+            text = ''.join(statement).strip()
+            if text and len(stack) > 1:
+                name, separator, value = text.partition('=')
+                name = name.strip()
+                if separator:
+                    stack[-1].properties[name] = value.strip()
+                elif not name.startswith('/'):
+                    stack[-1].properties[name] = True
+            statement = []
+        else:
+            if not statement:
+                if token.isspace():
+                    continue
+                # The token may start with the newline ending the previous statement
+                statement_start = match.start() + len(token) - len(token.lstrip())
+            statement.append(token)
+
+    if len(stack) > 1:
+        logger.warning(f"Unterminated node {stack[-1].path} in {path}")
+    return root
+
+class DeviceTreeIndex:
+    """Index of parsed devicetree nodes by compatible, name, label, key position and layer.
+
+    key_positions maps labels like LT4 to positions, layer_ids maps layer
+    names to numbers and defines (a dict or a MacroTable) is used to expand
+    list macros such as KEYS_L in hold-trigger-key-positions and defines
+    used as layers.
+    """
+
+    def __init__(self, key_positions=None, layer_ids=None, defines=None):
+        self.key_positions = key_positions or {}
+        self.layer_ids = layer_ids or {}
+        self.macros = defines if isinstance(defines, MacroTable) else MacroTable(defines)
+        self.defines = self.macros.defines
+        self.roots = []
+        self.by_compatible = {}
+        self.by_name = {}
+        self.by_label = {}
+        self.layers = []
+        self._by_key_position = None
+        self._by_layer = None
+
+    def add_tree(self, root):
+        self.roots.append(root)
+        for node in root.walk():
+            if node is root:
+                continue
+            self.by_name.setdefault(node.name, []).append(node)
+            for label in node.labels:
+                self.by_label[label] = node
+            if node.compatible:
+                self.by_compatible.setdefault(node.compatible, []).append(node)
+            if node.compatible == 'zmk,keymap':
+                self.layers.extend(node.children)
+        self._by_key_position = self._by_layer = None
+
+    @property
+    def by_key_position(self):
+        """Nodes by the key positions they refer to, built on first use since the lint doesn't need it."""
+        if self._by_key_position is None:
+            self._index_references()
+        return self._by_key_position
+
+    @property
+    def by_layer(self):
+        """Nodes by the layers they refer to, built on first use like by_key_position."""
+        if self._by_layer is None:
+            self._index_references()
+        return self._by_layer
+
+    def _index_references(self):
+        self._by_key_position = {}
+        self._by_layer = {}
+        for root in self.roots:
+            for node in root.walk():
+                if node is root:
+                    continue
+                for name in KEY_POSITION_PROPERTIES:
+                    for position in self.resolve_positions(node.tokens(name)):
+                        self._by_key_position.setdefault(position, []).append(node)
+                referenced_layers = set()
+                for name in LAYER_PROPERTIES:
+                    referenced_layers.update(self.resolve_layers(node.tokens(name)))
+                for binding in node.bindings():
+                    parts = binding.split()
+                    if parts[0] in LAYER_BEHAVIORS and len(parts) > 1:
+                        referenced_layers.update(self.resolve_layers(parts[1:2]))
+                for layer in referenced_layers:
+                    self._by_layer.setdefault(layer, []).append(node)
+
+    def expand(self, tokens, seen=None):
+        """Expand tokens that name list macros (e.g. KEYS_L) into their labels."""
+        expanded = []
+        for token in tokens:
+            value = self.defines.get(token)
+            if value is not None and token not in self.key_positions and token not in (seen or ()):
+                expanded.extend(self.expand(value.split(), (seen or set()) | {token}))
+            else:
+                expanded.append(token)
+        return expanded
+
+    def resolve_positions(self, tokens):
+        positions = []
+        for token in self.expand(tokens):
+            if token in self.key_positions:
+                positions.append(int(self.key_positions[token]))
+            elif token.isdigit():
+                positions.append(int(token))
+        return positions
+
+    def resolve_layers(self, tokens):
+        layers = []
+        for token in tokens:
+            value = self.layer_ids.get(token) or self.macros.expand(token).strip()
+            if str(value).isdigit():
+                layers.append(int(value))
+        return layers
+
+    def nodes(self, compatible):
+        return self.by_compatible.get(compatible, [])
+
+    def combos(self):
+        """All combo nodes, i.e. the children of every zmk,combos node, in source order."""
+        return [combo for combos in self.nodes('zmk,combos') for combo in combos.children]
+
+def build_devicetree_index(graph, key_positions, layer_ids):
+    """Parse every file of the include graph once and index the resulting nodes."""
+    index = DeviceTreeIndex(key_positions, layer_ids, graph.macros())
+    for path in graph.active_paths():
+        index.add_tree(graph.tree(path))
+    logger.info(f"Indexed {sum(len(nodes) for nodes in index.by_name.values())} devicetree nodes")
+    return index
+
+
+def extract_layer_definitions(layers_file_path, graph=None):
+    """Extract layer definitions from the layers_definitions.dtsi file.
+
+    When the file is part of graph its existing scan is used instead of reading it again.
+    """
+    scan = graph.scan_by_path.get(layers_file_path) if graph is not None else None
+    if scan is not None:
+        layer_definitions = {
+            directive.name: directive.value for directive in scan['defines']
+            if directive.value.isdigit()
+        }
+        logger.info(f"Extracted {len(layer_definitions)} layer definitions")
+        return layer_definitions
+
+    if not os.path.exists(layers_file_path):
+        logger.warning(f"Layers definitions file not found: {layers_file_path}")
+        return {}
+
+    # Read the layers file
+    layers_content = read_file(layers_file_path)
+    if not layers_content:
+        return {}
+
+    # Extract layer definitions using regex
+    layer_pattern = r'#define\s+(\w+)\s+(\d+)'
+    layer_definitions = {}
+
+    for match in re.finditer(layer_pattern, layers_content):
+        layer_name = match.group(1)
+        layer_value = match.group(2)
+        layer_definitions[layer_name] = layer_value
+
+    logger.info(f"Extracted {len(layer_definitions)} layer definitions")
+    logger.debug(f"Sample layer definitions: {list(layer_definitions.items())[:5]}")
+
+    return layer_definitions
+
+
+def hash_text(*parts):
+    """Return a sha256 hex digest over the given strings."""
+    import hashlib
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from build_firmware import Target, module_state, target_inputs_key
+
+needs_git = pytest.mark.skipif(shutil.which("git") is None, reason="git isn't installed")
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def git(directory, *args):
+    subprocess.run(["git", "-C", directory, "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                   check=True, capture_output=True)
+
+
+@needs_git
+def test_module_state_follows_commits_edits_and_untracked_files(tmp_path):
+    module = str(tmp_path / "zmk-helpers")
+    header = write(os.path.join(module, "include", "zmk-helpers", "helper.h"), "#define ZMK_HELPER 1\n")
+    git(module, "init", "-q")
+    git(module, "add", "-A")
+    git(module, "commit", "-q", "-m", "initial")
+    states = [module_state(module)]
+
+    write(header, "#define ZMK_HELPER 2\n")
+    states.append(module_state(module))
+    write(os.path.join(module, "include", "zmk-helpers", "new.h"), "#pragma once\n")
+    states.append(module_state(module))
+    git(module, "add", "-A")
+    git(module, "commit", "-q", "-m", "bump")
+    states.append(module_state(module))
+
+    assert len(set(states)) == len(states)
+    assert module_state(module) == states[-1]
+
+
+def test_module_without_git_is_hashed_file_by_file(tmp_path):
+    module = str(tmp_path / "zmk-userspace")
+    behaviors = write(os.path.join(module, "dts", "behaviors.dtsi"), "/ { };\n")
+    before = module_state(module)
+    assert module_state(module) == before
+    write(behaviors, "/ { behaviors { }; };\n")
+    assert module_state(module) != before
+
+
+def test_inputs_key_covers_module_versions_and_unresolved_includes(tmp_path):
+    config = str(tmp_path / "config")
+    write(os.path.join(config, "sofle.keymap"), '#include <behaviors.dtsi>\n#include "elpekenin/behaviors.dtsi"\n/ { };\n')
+    target = Target('nice_nano', 'sofle_left')
+    graphs = {}
+
+    def inputs_key(versions):
+        return target_inputs_key(target, config, graphs, ["west", "build"], versions)
+
+    key = inputs_key(["zmk", "module-a"])
+    assert inputs_key(["zmk", "module-a"]) == key
+    assert inputs_key(["zmk", "module-b"]) != key
+    (graph,) = graphs.values()
+    assert graph.unresolved_includes() == ['behaviors.dtsi', 'elpekenin/behaviors.dtsi']
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from keymap_source import build_include_graph, evaluate_condition, inactive_lines, scan_preprocessor
+
+CHAIN = """\
+#if defined(A)
+#define X 1
+#elif B
+#define X 2
+#else
+#define X 3
+#endif
+"""
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+@pytest.mark.parametrize('directive, expression, symbols, expected', [
+    ('ifdef', 'HAS_MOUSE_KEYS', {'HAS_MOUSE_KEYS': ''}, True),
+    ('ifndef', 'HAS_MOUSE_KEYS', {'HAS_MOUSE_KEYS': ''}, False),
+    ('if', 'defined(A) && !defined B', {'A': ''}, True),
+    ('if', 'TERM / 2 == 100', {'TERM': '200 + 1'}, True),
+    ('if', '1 / 2', {}, False),
+    ('if', '-7 % 2 == -1', {}, True),
+    ('if', 'UNDEFINED || 0x10 >> 4', {}, True),
+    ('if', 'SELF', {'SELF': 'SELF + 1'}, True),
+    ('elif', 'B', {'B': '0'}, False),
+    ('if', '1 +', {}, False),
+])
+def test_conditions_evaluate_like_the_c_preprocessor(directive, expression, symbols, expected):
+    assert evaluate_condition(directive, expression, symbols) is expected
+
+
+def test_elif_and_else_branches_record_the_earlier_conditions():
+    scan = scan_preprocessor(CHAIN)
+    assert [(define.value, define.conditions) for define in scan['defines']] == [
+        ('1', (('if', 'defined(A)', True),)),
+        ('2', (('if', 'defined(A)', False), ('elif', 'B', True))),
+        ('3', (('if', 'defined(A)', False), ('elif', 'B', False))),
+    ]
+    (region,) = scan['conditionals']
+    assert [line for _, _, line in region.branches] == [1, 3, 5]
+    assert inactive_lines(scan, {'B': '1'}) == {1, 2, 3, 5, 6, 7}
+
+
+@pytest.mark.parametrize('flags, expected', [
+    ({}, '3'),
+    ({'A': ''}, '1'),
+    ({'B': '1'}, '2'),
+    ({'A': '', 'B': '1'}, '1'),
+    ({'B': '0'}, '3'),
+])
+def test_variants_take_exactly_one_branch_of_a_chain(tmp_path, flags, expected):
+    keymap = write(os.path.join(str(tmp_path), "config", "base.keymap"), CHAIN)
+    assert build_include_graph(keymap).variant(flags).defines()['X'] == expected
+
+
+def test_undef_removes_a_define_for_the_directives_after_it(tmp_path):
+    config = os.path.join(str(tmp_path), "config")
+    write(os.path.join(config, "flags.h"), "#define HAS_MOUSE_KEYS\n#define TERM 200\n#undef HAS_MOUSE_KEYS\n")
+    keymap = write(os.path.join(config, "base.keymap"),
+                   '#include "flags.h"\n'
+                   '#ifdef HAS_MOUSE_KEYS\n'
+                   '#define MOUSE 1\n'
+                   '#endif\n'
+                   '#undef TERM\n'
+                   '#define TERM 150\n')
+    graph = build_include_graph(keymap)
+    assert 'HAS_MOUSE_KEYS' not in graph.symbols()
+    assert graph.defines() == {'TERM': '150'}
+    assert 'MOUSE' not in graph.variant({'TERM': '100'}).defines()
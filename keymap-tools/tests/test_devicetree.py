@@ -0,0 +1,110 @@
+from keymap_source import DeviceTreeIndex, parse_devicetree
+
+KEYMAP = """\
+#include <behaviors.dtsi>
+#define KEYS_L LT0 LT1
+
+/ {
+    behaviors {
+        hm: homerow_mods {
+            compatible = "zmk,behavior-hold-tap";
+            #binding-cells = <2>;
+            tapping-term-ms = <280>;
+            hold-trigger-key-positions = <KEYS_L>;
+            bindings = <&kp>, <&kp>;
+        };
+    };
+
+    combos {
+        compatible = "zmk,combos";
+        combo_esc {
+            key-positions = <LT0 LT1>;
+            bindings = <&kp ESC>;
+            layers = <BASE NAV>;
+        };
+        combo_url {
+            display-name = "https://zmk.dev/{docs}";
+            key-positions = <2 3>;
+            bindings = <&kp TAB>;
+        };
+    };
+
+    keymap {
+        compatible = "zmk,keymap";
+        base_layer {
+            bindings = <&kp A &hm LSHFT B &mo NAV>;
+        };
+        nav_layer {
+            bindings = <&trans &trans &tog BASE>;
+        };
+    };
+};
+
+&hm {
+    tapping-term-ms = <200>;
+};
+"""
+
+
+def index_keymap():
+    index = DeviceTreeIndex({'LT0': '0', 'LT1': '1'}, {'BASE': '0', 'NAV': '1'}, {'KEYS_L': 'LT0 LT1'})
+    root = parse_devicetree(KEYMAP, "base.keymap")
+    index.add_tree(root)
+    return root, index
+
+
+def test_nested_nodes_keep_their_path_labels_and_line():
+    root, _ = index_keymap()
+    hold_tap = root.children[0].child('behaviors').child('homerow_mods')
+    assert hold_tap.path == '/behaviors/homerow_mods'
+    assert hold_tap.labels == ['hm']
+    assert (hold_tap.source, hold_tap.line) == ("base.keymap", 6)
+    assert hold_tap.compatible == 'zmk,behavior-hold-tap'
+    assert hold_tap.properties['#binding-cells'] == '<2>'
+    assert hold_tap.bindings() == ['&kp', '&kp']
+    combos = root.children[0].child('combos')
+    assert [combo.name for combo in combos.children] == ['combo_esc', 'combo_url']
+    assert combos.child('combo_esc').line == 17
+
+
+def test_braces_and_slashes_inside_strings_dont_open_nodes():
+    root, _ = index_keymap()
+    combo = root.children[0].child('combos').child('combo_url')
+    assert combo.children == []
+    assert combo.properties['display-name'] == '"https://zmk.dev/{docs}"'
+    assert combo.tokens('key-positions') == ['2', '3']
+
+
+def test_label_override_is_a_top_level_node():
+    root, index = index_keymap()
+    override = root.children[1]
+    assert override.name == '&hm'
+    assert override.properties == {'tapping-term-ms': '<200>'}
+    assert index.by_label['hm'].properties['tapping-term-ms'] == '<280>'
+    assert index.by_name['&hm'] == [override]
+
+
+def test_index_by_compatible_key_position_and_layer():
+    _, index = index_keymap()
+    assert [combo.name for combo in index.combos()] == ['combo_esc', 'combo_url']
+    assert [layer.name for layer in index.layers] == ['base_layer', 'nav_layer']
+    # hold-trigger-key-positions goes through the KEYS_L list macro
+    assert [node.name for node in index.by_key_position[0]] == ['homerow_mods', 'combo_esc']
+    assert [node.name for node in index.by_key_position[3]] == ['combo_url']
+    assert [node.name for node in index.by_layer[1]] == ['combo_esc', 'base_layer']
+    assert [node.name for node in index.by_layer[0]] == ['combo_esc', 'nav_layer']
+
+
+def test_bindings_are_split_per_behavior():
+    _, index = index_keymap()
+    base, nav = index.layers
+    assert base.bindings() == ['&kp A', '&hm LSHFT B', '&mo NAV']
+    assert nav.bindings() == ['&trans', '&trans', '&tog BASE']
+
+
+def test_skipped_lines_drop_inactive_nodes():
+    content = "/ {\n#ifdef HAS_MOUSE\n    mouse { x = <1>; };\n#endif\n    other { };\n};\n"
+    root = parse_devicetree(content, skip_lines={2, 3, 4})
+    assert [child.name for child in root.children[0].children] == ['other']
+    root = parse_devicetree(content)
+    assert [child.name for child in root.children[0].children] == ['mouse', 'other']
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import keymap_pipeline as pk
+
+pytest.importorskip("keymap_drawer")
+
+COMBOS = """\
+/ {
+    combos {
+        compatible = "zmk,combos";
+        combo_esc {
+            key-positions = <LT0 LT1>;
+            bindings = <&kp ESC>;
+        };
+        combo_tab {
+            key-positions = <2 3>;
+            bindings = <&kp TAB>;
+        };
+    };
+};
+"""
+
+KEYMAP = """\
+#include "zmk-helpers/key-labels/sofle.h"
+#include "includes/layers_definitions.dtsi"
+#include <behaviors.dtsi>
+#include <dt-bindings/zmk/keys.h>
+#include "includes/combos.dtsi"
+
+/ {
+    keymap {
+        compatible = "zmk,keymap";
+        base_layer {
+            display-name = "Base";
+            bindings = <&kp A &lt NAV B &mt LSHFT C &kp N1>;
+        };
+        nav_layer {
+            display-name = "Nav";
+            bindings = <&trans &trans &kp LEFT &to BASE>;
+        };
+    };
+};
+"""
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_emitted_yaml_matches_the_external_parse(tmp_path):
+    root = str(tmp_path)
+    config = os.path.join(root, "config")
+    write(os.path.join(root, "zmk-helpers", "include", "zmk-helpers", "key-labels", "sofle.h"),
+          "#define LT0 0\n#define LT1 1\n#define LT2 2\n#define LT3 3\n")
+    layer_defs_file = write(os.path.join(config, "includes", "layers_definitions.dtsi"), "#define BASE 0\n#define NAV 1\n")
+    write(os.path.join(config, "includes", "combos.dtsi"), COMBOS)
+    keymap = write(os.path.join(config, "base.keymap"), KEYMAP)
+
+    graph = pk.build_include_graph(keymap)
+    key_positions = graph.key_positions()
+    layer_definitions = pk.extract_layer_definitions(layer_defs_file, graph)
+
+    # The --external-parse path: write the processed keymap and run keymap-drawer's parser on it
+    output_path = os.path.join(root, "out", "processed_keymap.keymap")
+    processed_keymap = pk.process_keymap(keymap, output_path, graph)
+    write(output_path, processed_keymap)
+    cache = pk.StageCache(os.path.join(root, "cache"), enabled=False)
+    parsed = pk.parse_processed_keymap(output_path, processed_keymap, config, graph, key_positions,
+                                       layer_definitions, cache, "sources", "fingerprint")
+
+    index = pk.build_devicetree_index(graph, key_positions, layer_definitions)
+    emitted = pk.emit_keymap_document(index, pk.build_symbol_table(graph.defines()), {"zmk_keyboard": "sofle"})
+
+    assert list(emitted) == ['layout', 'layers', 'combos']
+    assert pk.dump_yaml(emitted) == pk.dump_yaml(parsed)
@@ -0,0 +1,47 @@
+from keymap_heatmap import CHUNK_CHARS, HeatmapCounter, KeymapRoutes
+from keymap_source import DeviceTreeIndex, KeyPositionIndex, MacroTable, parse_devicetree
+
+KEYMAP = """\
+/ {
+    keymap {
+        compatible = "zmk,keymap";
+        base_layer {
+            bindings = <&kp A &kp B &mo NUM &kp SPACE>;
+        };
+        num_layer {
+            bindings = <&kp N1 &kp N2 &trans &trans>;
+        };
+    };
+};
+"""
+
+
+def counter():
+    index = DeviceTreeIndex(layer_ids={'BASE': '0', 'NUM': '1'})
+    index.add_tree(parse_devicetree(KEYMAP, "base.keymap"))
+    return HeatmapCounter(KeymapRoutes(index, MacroTable(), KeyPositionIndex()))
+
+
+def test_layer_hold_across_a_chunk_boundary_counts_once(tmp_path):
+    # "12" straddles the end of the first chunk, " 21 1" adds two more holds of NUM
+    text = 'a' * (CHUNK_CHARS - 1) + '12' + ' 21 1' + 'b'
+    corpus = tmp_path / "corpus.txt"
+    corpus.write_text(text)
+
+    streamed = counter()
+    assert streamed.feed_file(str(corpus)) == len(text)
+    presses, layer_activations, combos, unmapped = streamed.results()
+    assert presses == {
+        (0, 0): CHUNK_CHARS - 1,
+        (0, 1): 1,
+        (0, 2): 3,
+        (0, 3): 2,
+        (1, 0): 3,
+        (1, 1): 2,
+    }
+    assert layer_activations == {1: 3}
+    assert not combos and not unmapped
+
+    whole = counter()
+    whole.feed(text)
+    assert whole.results() == streamed.results()
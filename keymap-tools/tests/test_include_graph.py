@@ -0,0 +1,102 @@
+import os
+
+import keymap_source
+import keymap_pipeline as pk
+from keymap_source import IncludeResolver, build_include_graph, load_source
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+    return str(path)
+
+
+def make_project(root):
+    """base.keymap includes layers and combos, which both include shared.dtsi."""
+    config = os.path.join(root, "config")
+    keymap = write(os.path.join(config, "base.keymap"),
+                   '#include <behaviors.dtsi>\n'
+                   '#include <dt-bindings/zmk/keys.h>\n'
+                   '#include "includes/layers.dtsi"\n'
+                   '#include "combos.dtsi"\n'
+                   '/ { keymap { compatible = "zmk,keymap"; }; };\n')
+    write(os.path.join(config, "includes", "layers.dtsi"), '#include "shared.dtsi"\n#define BASE 0\n')
+    write(os.path.join(config, "includes", "combos.dtsi"), '#include "shared.dtsi"\n#define COMBO_TERM 40\n')
+    write(os.path.join(config, "includes", "shared.dtsi"), '#define SHARED 1\n')
+    return keymap
+
+
+def relative(graph, paths):
+    return [os.path.relpath(path, graph.project_root) for path in paths]
+
+
+def test_includes_are_walked_breadth_first_and_read_once(tmp_path):
+    graph = build_include_graph(make_project(str(tmp_path)))
+    assert relative(graph, graph.contents) == [
+        os.path.join("config", "base.keymap"),
+        os.path.join("config", "includes", "layers.dtsi"),
+        os.path.join("config", "includes", "combos.dtsi"),
+        os.path.join("config", "includes", "shared.dtsi"),
+    ]
+    assert graph.defines()['COMBO_TERM'] == '40'
+
+
+def test_inline_reads_match_the_thread_pool(tmp_path):
+    keymap = make_project(str(tmp_path))
+    pooled = build_include_graph(keymap)
+    inline = build_include_graph(keymap, workers=1)
+    assert inline.contents == pooled.contents
+    assert inline.edges == pooled.edges
+
+
+def test_dependents_follow_include_edges(tmp_path):
+    graph = build_include_graph(make_project(str(tmp_path)))
+    shared = next(path for path in graph.contents if path.endswith("shared.dtsi"))
+    assert sorted(relative(graph, graph.dependents(shared))) == [
+        os.path.join("config", "base.keymap"),
+        os.path.join("config", "includes", "combos.dtsi"),
+        os.path.join("config", "includes", "layers.dtsi"),
+    ]
+
+
+def test_resolver_resolves_each_include_once_per_directory(tmp_path, monkeypatch):
+    calls = []
+    resolve_include = keymap_source.resolve_include
+
+    def counting(include_path, base_dir, project_root):
+        calls.append((include_path, os.path.normpath(base_dir)))
+        return resolve_include(include_path, base_dir, project_root)
+
+    monkeypatch.setattr(keymap_source, 'resolve_include', counting)
+    resolver = IncludeResolver(str(tmp_path))
+    build_include_graph(make_project(str(tmp_path)), resolver=resolver)
+    build_include_graph(make_project(str(tmp_path)), resolver=resolver)
+    assert len(calls) == len(set(calls))
+    assert ('shared.dtsi', os.path.join(str(tmp_path), "config", "includes")) in calls
+
+
+def test_changed_include_is_reread_and_invalidates_the_cache(tmp_path, monkeypatch):
+    keymap = make_project(str(tmp_path))
+    file_cache = {}
+    graph = build_include_graph(keymap, file_cache)
+    cache = pk.StageCache(os.path.join(str(tmp_path), ".cache"))
+    output = write(os.path.join(str(tmp_path), "out", "keymap.svg"), "<svg/>")
+    inputs_key = pk.hash_include_graph(graph)
+    cache.record_outputs(inputs_key, [output])
+    assert cache.outputs_unchanged(pk.hash_include_graph(build_include_graph(keymap)))
+
+    shared = next(path for path in graph.contents if path.endswith("shared.dtsi"))
+    write(shared, '#define SHARED 2\n')
+    # Like watch mode: forget the saved file, every other file comes from file_cache
+    reads = []
+    read_and_scan = keymap_source.read_and_scan
+    monkeypatch.setattr(keymap_source, 'read_and_scan', lambda path: reads.append(path) or read_and_scan(path))
+    file_cache.pop(shared)
+    load_source(shared, file_cache)
+    refreshed = build_include_graph(keymap, file_cache)
+
+    assert reads == [shared]
+    assert refreshed.defines()['SHARED'] == '2'
+    assert pk.hash_include_graph(refreshed) != inputs_key
+    assert not cache.outputs_unchanged(pk.hash_include_graph(refreshed))
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+import keymap_source
+from keymap_source import KeyPositionIndex, build_include_graph, clear_memos, compile_key_labels, scan_preprocessor
+
+HEADER = """\
+#pragma once
+#define LT0 0
+#define LT1 1
+#define RT0 2  /* right half */
+#define THUMB_L LT1
+"""
+
+
+@pytest.fixture(autouse=True)
+def fresh_memos():
+    clear_memos()
+    yield
+    clear_memos()
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def make_project(root, header=HEADER, board="corne"):
+    keymap = os.path.join(root, "config", "base.keymap")
+    write(keymap, f'#include "zmk-helpers/key-labels/{board}.h"\n#define LT0 5\n')
+    write(os.path.join(root, "zmk-helpers", "include", "zmk-helpers", "key-labels", f"{board}.h"), header)
+    return keymap
+
+
+def test_any_header_compiles_with_aliases():
+    index = compile_key_labels(scan_preprocessor(HEADER), "corne")
+    assert dict(index) == {'LT0': '0', 'LT1': '1', 'RT0': '2', 'THUMB_L': '1'}
+    assert index.position('THUMB_L') == 1
+    assert index.label(1) == 'LT1'
+    assert index.position('LX9') is None
+
+
+def test_index_round_trips_through_json():
+    index = KeyPositionIndex({'LT0': '0', 'RT0': '2'}, "corne", "abc")
+    loaded = KeyPositionIndex.from_json(index.to_json())
+    assert dict(loaded) == dict(index)
+    assert (loaded.board, loaded.source_hash, loaded.labels) == ("corne", "abc", {0: 'LT0', 2: 'RT0'})
+
+
+def test_labels_in_the_config_override_the_header(tmp_path):
+    graph = build_include_graph(make_project(str(tmp_path)))
+    key_positions = graph.key_positions()
+    assert key_positions['LT0'] == '5'
+    assert key_positions['RT0'] == '2'
+    assert key_positions.board == "corne"
+
+
+def test_compiled_index_is_cached_and_recompiled_when_the_header_changes(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    keymap = make_project(str(tmp_path))
+    build_include_graph(keymap, cache_dir=cache_dir).key_positions()
+    (first,) = os.listdir(cache_dir)
+    assert first.startswith("keypos-corne-")
+
+    compiled = []
+    compile_labels = keymap_source.compile_key_labels
+    monkeypatch.setattr(keymap_source, 'compile_key_labels',
+                        lambda *args: compiled.append(args) or compile_labels(*args))
+    clear_memos()
+    build_include_graph(keymap, cache_dir=cache_dir).key_positions()
+    assert compiled == []
+
+    make_project(str(tmp_path), HEADER + "#define RT1 3\n")
+    clear_memos()
+    key_positions = build_include_graph(keymap, cache_dir=cache_dir).key_positions()
+    assert len(compiled) == 1
+    assert key_positions['RT1'] == '3'
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_missing_header_falls_back_to_the_last_compiled_index(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    keymap = make_project(str(tmp_path))
+    header = build_include_graph(keymap, cache_dir=cache_dir).key_positions()
+    os.remove(os.path.join(str(tmp_path), "zmk-helpers", "include", "zmk-helpers", "key-labels", "corne.h"))
+
+    clear_memos()
+    key_positions = build_include_graph(keymap, cache_dir=cache_dir).key_positions()
+    assert key_positions['RT0'] == '2'
+    assert key_positions.source != header.source
+    clear_memos()
+    missing = build_include_graph(keymap).key_positions()
+    assert 'RT0' not in missing
+    assert missing.source == "corne missing"
+
+
+def test_config_labels_follow_the_key_labels_naming():
+    scan = scan_preprocessor("#define LT10 40\n#define REC 57\n#define RH2 54\n#define RGB 1\n#define BASE 0\n")
+    assert [(define.name, define.value) for define in scan['key_positions']] == [
+        ('LT10', '40'), ('REC', '57'), ('RH2', '54')]
+
+
+def test_pipeline_fails_without_any_key_positions(tmp_path):
+    import keymap_pipeline as pk
+
+    keymap = make_project(str(tmp_path))
+    os.remove(os.path.join(str(tmp_path), "zmk-helpers", "include", "zmk-helpers", "key-labels", "corne.h"))
+    with open(keymap, 'w') as f:
+        f.write('#include "zmk-helpers/key-labels/corne.h"\n/ { keymap { compatible = "zmk,keymap"; }; };\n')
+    svg = str(tmp_path / "keymap.svg")
+    cache = pk.StageCache(str(tmp_path / "cache"))
+    assert not pk.run_pipeline(keymap, str(tmp_path / "out" / "processed.keymap"), cache, svg_output=svg)
+    assert not os.path.exists(svg)
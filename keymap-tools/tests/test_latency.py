@@ -0,0 +1,40 @@
+from keymap_latency import collect_behaviors, resolve_number
+from keymap_source import DeviceTreeIndex, MacroTable, parse_devicetree
+
+KEYMAP = """\
+/ {
+    behaviors {
+        hm: homerow_mods {
+            compatible = "zmk,behavior-hold-tap";
+            tapping-term-ms = <280>;
+            bindings = <&kp>, <&kp>;
+        };
+    };
+};
+
+&hm {
+    tapping-term-ms = <200>;
+};
+
+&lt {
+    tapping-term-ms = <150>;
+};
+"""
+
+
+def test_overrides_leave_the_indexed_nodes_untouched():
+    index = DeviceTreeIndex()
+    index.add_tree(parse_devicetree(KEYMAP, "base.keymap"))
+    behaviors = collect_behaviors(index)
+    assert behaviors['hm'].properties['tapping-term-ms'] == '<200>'
+    assert behaviors['lt'].properties['tapping-term-ms'] == '<150>'
+    assert index.by_label['hm'].properties['tapping-term-ms'] == '<280>'
+    assert collect_behaviors(index)['hm'].properties['tapping-term-ms'] == '<200>'
+
+
+def test_timings_resolve_with_c_integer_semantics():
+    macros = MacroTable({'TERM': '(280 + 15) / 2', 'IDLE': '-7 / 2'})
+    assert resolve_number('<TERM>', macros) == 147
+    assert resolve_number('<IDLE>', macros) == -3
+    assert resolve_number('<__import__("os")>', macros, 200) == 200
+    assert resolve_number('<1 / 0>', macros, 200) == 200
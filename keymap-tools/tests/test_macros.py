@@ -0,0 +1,89 @@
+import logging
+
+from keymap_source import MACRO_EXPANSION_DEPTH, MacroTable, scan_preprocessor
+
+
+def table(source):
+    scan = scan_preprocessor(source, "test.dtsi")
+    defines = {directive.name: directive.value for directive in scan['defines']}
+    macros = {}
+    for directive in scan['macros']:
+        params, body = directive.value
+        macros[directive.name] = (tuple(param.strip() for param in params.split(',') if param.strip()), body)
+    return MacroTable(defines, macros)
+
+
+def test_chained_defines_expand_inside_cells():
+    macros = table("#define COMBO_TERM_FAST FAST\n#define FAST 18\n")
+    assert macros.expand("<COMBO_TERM_FAST>") == "<18>"
+
+
+def test_self_referential_define_stays_unexpanded(caplog):
+    macros = table("#define A A\n#define B A + 1\n")
+    with caplog.at_level(logging.WARNING, logger="process_keymap"):
+        assert macros.expand("A") == "A"
+        assert macros.expand("B") == "A + 1"
+        assert macros.expand("A A") == "A A"
+    assert [record.getMessage() for record in caplog.records] == ["Recursive macro A -> A, leaving A unexpanded"]
+
+
+def test_mutually_recursive_defines_stop_where_c_does(caplog):
+    macros = table("#define B C + 1\n#define C B * 2\n")
+    with caplog.at_level(logging.WARNING, logger="process_keymap"):
+        assert macros.expand("B") == "B * 2 + 1"
+        assert macros.expand("C") == "C + 1 * 2"
+        # A repeated expansion gives the same result and isn't reported again
+        assert macros.expand("B") == "B * 2 + 1"
+    assert len(caplog.records) == 2
+
+
+def test_recursive_function_like_macros():
+    macros = table("#define F(x) F(x) + 1\n#define G(x) H(x)\n#define H(x) G(x)\n")
+    assert macros.expand("F(2)") == "F(2) + 1"
+    assert macros.expand("G(1)") == "G(1)"
+
+
+def test_function_like_macros_with_stringify_paste_and_varargs():
+    macros = table(
+        "#define TERM 30\n"
+        "#define NAME(x) #x\n"
+        "#define CAT(a, b) a ## b\n"
+        "#define HOLD(name, ...) name: name { bindings = <__VA_ARGS__>; }\n")
+    assert macros.expand("NAME(TERM)") == '"TERM"'
+    assert macros.expand("CAT(TE, RM)") == "30"
+    assert macros.expand("HOLD(hm, &kp, TERM)") == "hm: hm { bindings = <&kp, 30>; }"
+    # Too few arguments leaves the call as written
+    assert macros.expand("CAT(a)") == "CAT(a)"
+
+
+def test_expansions_are_memoized():
+    macros = table("#define A B\n#define B 7\n#define ADD(x) x + B\n")
+    assert macros.expand("A ADD(1)") == "7 1 + 7"
+    assert macros._expanded == {'A': '7', 'B': '7'}
+    assert macros._calls == {('ADD', ('1',)): '1 + 7'}
+    macros.defines['B'] = '8'
+    assert macros.expand("A") == "7"
+
+
+def test_expansion_depth_is_bounded(caplog):
+    depth = MACRO_EXPANSION_DEPTH + 10
+    source = ''.join(f"#define D{i} D{i + 1}\n" for i in range(depth)) + f"#define D{depth} done\n"
+    with caplog.at_level(logging.WARNING, logger="process_keymap"):
+        result = table(source).expand("D0")
+    assert result.startswith("D")
+    assert any("levels deep" in record.getMessage() for record in caplog.records)
+
+
+def test_overrides_share_the_function_like_macros():
+    macros = table("#define TERM 200\n#define DOUBLE(x) (x * 2)\n")
+    fast = macros.with_defines({'TERM': '150'})
+    assert fast.expand("DOUBLE(TERM)") == "(150 * 2)"
+    assert macros.expand("DOUBLE(TERM)") == "(200 * 2)"
+
+
+def test_replacements_are_rescanned_with_the_text_after_them():
+    macros = table("#define F G\n#define G(x) x+1\n#define H(x) G\n#define K(x) K\n")
+    assert macros.expand("F(2)") == "2+1"
+    assert macros.expand("<F (2) F>") == "<2+1 G>"
+    assert macros.expand("H(1)(2)") == "2+1"
+    assert macros.expand("K(1)(2)(3)") == "K"
@@ -0,0 +1,116 @@
+import pytest
+
+from keymap_replay import ReplayEngine, ReplayModel, replay
+from keymap_source import DeviceTreeIndex, MacroTable, parse_devicetree
+
+KEYMAP = """\
+/ {
+    behaviors {
+        hm: homerow_mods {
+            compatible = "zmk,behavior-hold-tap";
+            #binding-cells = <2>;
+            flavor = "hold-preferred";
+            tapping-term-ms = <200>;
+            bindings = <&kp>, <&kp>;
+        };
+        tp: tap_preferred {
+            compatible = "zmk,behavior-hold-tap";
+            #binding-cells = <2>;
+            flavor = "tap-preferred";
+            tapping-term-ms = <200>;
+            bindings = <&kp>, <&kp>;
+        };
+    };
+
+    combos {
+        compatible = "zmk,combos";
+        combo_esc {
+            timeout-ms = <50>;
+            key-positions = <2 3>;
+            bindings = <&kp ESC>;
+        };
+    };
+
+    keymap {
+        compatible = "zmk,keymap";
+        base_layer {
+            bindings = <&kp A &hm LSHFT B &kp C &kp D &tp LCTRL E>;
+        };
+    };
+};
+"""
+
+
+class RecordingEngine(ReplayEngine):
+    """A ReplayEngine that remembers the simple bindings it sends, in the order they're decided."""
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.sent = []
+
+    def _apply(self, position, name, params):
+        self.sent.append(' '.join([f"&{name}"] + params))
+        super()._apply(position, name, params)
+
+
+def run(trace):
+    index = DeviceTreeIndex()
+    index.add_tree(parse_devicetree(KEYMAP, "base.keymap"))
+    engine = RecordingEngine(ReplayModel(index, MacroTable()))
+    replay(trace.splitlines(), {}, [engine])
+    return engine
+
+
+@pytest.mark.parametrize('trace, sent, decision, latency', [
+    # Released inside the tapping term
+    ("0,1,press\n120,1,release\n", ['&kp B'], 'taps', {120: 1}),
+    # Hold-preferred: another key pressed while undecided makes it a hold
+    ("0,1,press\n40,0,press\n60,0,release\n90,1,release\n", ['&kp LSHFT', '&kp A'], 'holds', {40: 1, 0: 1}),
+    # Held past the tapping term
+    ("0,1,press\n300,1,release\n", ['&kp LSHFT'], 'holds', {200: 1}),
+])
+def test_hold_tap_resolution(trace, sent, decision, latency):
+    engine = run(trace)
+    assert engine.sent == sent
+    assert engine.stats.counts['hold-taps'] == 1
+    assert engine.stats.counts[f"hold-tap {decision}"] == 1
+    assert engine.stats.latency == latency
+
+
+def test_hold_released_without_using_it_is_an_accidental_hold():
+    assert run("0,1,press\n300,1,release\n").stats.counts['accidental holds'] == 1
+    assert run("0,1,press\n40,0,press\n60,0,release\n90,1,release\n").stats.counts['accidental holds'] == 0
+
+
+def test_key_tapped_inside_a_tap_preferred_hold_tap_is_a_missed_hold():
+    engine = run("0,4,press\n30,0,press\n60,0,release\n100,4,release\n")
+    # A is decided first but queued behind the hold-tap, so both go out at 100ms
+    assert engine.sent == ['&kp A', '&kp E']
+    assert engine.stats.counts['hold-tap taps'] == 1
+    assert engine.stats.counts['missed holds'] == 1
+    assert engine.stats.latency == {100: 1, 70: 1}
+
+
+def test_combo_fires_when_its_keys_are_chorded():
+    engine = run("0,2,press\n20,3,press\n80,2,release\n85,3,release\n")
+    assert engine.sent == ['&kp ESC']
+    assert engine.stats.counts['combos fired'] == 1
+    assert engine.stats.counts['combo misfires'] == 0
+    # The second key of the combo isn't a keypress of its own
+    assert engine.stats.latency == {20: 1}
+
+
+def test_combo_timeout_sends_the_keys_and_counts_a_near_miss():
+    engine = run("0,2,press\n70,3,press\n90,2,release\n100,3,release\n")
+    assert engine.sent == ['&kp C', '&kp D']
+    assert engine.stats.counts['combos fired'] == 0
+    assert engine.stats.counts['combo near misses'] == 1
+    # C waits out the 50ms combo timeout, D is released before its own
+    assert engine.stats.latency == {50: 1, 30: 1}
+
+
+def test_combo_typed_as_a_roll_is_a_misfire():
+    engine = run("0,2,press\n20,3,press\n40,2,release\n130,3,release\n")
+    assert engine.sent == ['&kp ESC']
+    assert engine.stats.counts['combo misfires'] == 1
+    assert engine.stats.counts['combo near misses'] == 0
@@ -0,0 +1,96 @@
+from keymap_source import devicetree_code, scan_preprocessor, strip_comments
+
+
+def names(directives):
+    return [directive.name for directive in directives]
+
+
+def test_line_comment():
+    assert strip_comments("a = <1>; // note", False) == ("a = <1>; ", False)
+
+
+def test_block_comment_within_a_line():
+    assert strip_comments("a /* x */ b", False) == ("a   b", False)
+
+
+def test_block_comment_across_lines():
+    code, in_block = strip_comments("a /* start", False)
+    assert (code, in_block) == ("a  ", True)
+    code, in_block = strip_comments("still inside // and #define X", True)
+    assert (code, in_block) == ("", True)
+    assert strip_comments("end */ b", True) == (" b", False)
+
+
+def test_comment_markers_inside_strings_are_kept():
+    assert strip_comments('label = "http://example.com"; // c', False) == ('label = "http://example.com"; ', False)
+    assert strip_comments('s = "/* not a comment */";', False) == ('s = "/* not a comment */";', False)
+    assert strip_comments('s = "a\\"//"; // c', False) == ('s = "a\\"//"; ', False)
+
+
+def test_directives_in_block_comments_are_skipped():
+    scan = scan_preprocessor(
+        "/*\n"
+        "#define HIDDEN 1\n"
+        "#include \"hidden.h\"\n"
+        "*/\n"
+        "#define SHOWN 2 /* trailing */\n"
+        "/* inline */ #include \"shown.h\"\n",
+        "test.dtsi")
+    assert names(scan['defines']) == ['SHOWN']
+    assert scan['defines'][0].value == '2'
+    assert names(scan['includes']) == ['shown.h']
+
+
+def test_include_with_slashes_in_its_name():
+    scan = scan_preprocessor('#include "zmk-helpers//helper.h" // comment\n', "test.dtsi")
+    assert names(scan['includes']) == ['zmk-helpers//helper.h']
+
+
+def test_line_continuation_joins_a_define():
+    scan = scan_preprocessor(
+        "#define KEYS_L \\\n"
+        "    LT0 LT1 \\\n"
+        "    LT2\n"
+        "#define AFTER 3\n",
+        "test.dtsi")
+    keys, after = scan['defines']
+    assert keys.name == 'KEYS_L'
+    assert keys.value.split() == ['LT0', 'LT1', 'LT2']
+    assert keys.line == 1
+    assert (after.name, after.line) == ('AFTER', 4)
+
+
+def test_line_continuation_of_a_function_like_macro():
+    scan = scan_preprocessor(
+        "#define HOLD(name, key) \\\n"
+        "    name: name { bindings = <key>; }\n",
+        "test.dtsi")
+    (macro,) = scan['macros']
+    params, body = macro.value
+    assert macro.name == 'HOLD'
+    assert params == 'name, key'
+    assert body.split() == ['name:', 'name', '{', 'bindings', '=', '<key>;', '}']
+
+
+def test_continued_directive_is_blanked_in_devicetree_code():
+    content = "#define A \\\n  1\n/ { x = <A>; };\n"
+    assert devicetree_code(content).split('\n') == ['', '', '/ { x = <A>; };', '']
+
+
+def test_directives_keep_file_line_and_conditions():
+    scan = scan_preprocessor(
+        "#define LT0 12\n"
+        "#ifdef HAS_MOUSE_KEYS\n"
+        "#include \"mouse.dtsi\"\n"
+        "#else\n"
+        "#define NO_MOUSE\n"
+        "#endif\n",
+        "keys.dtsi")
+    (position,) = scan['key_positions']
+    assert (position.name, position.value, position.path, position.line) == ('LT0', '12', 'keys.dtsi', 1)
+    (include,) = scan['includes']
+    assert include.conditions == (('ifdef', 'HAS_MOUSE_KEYS', True),)
+    (flag,) = scan['flags']
+    assert flag.conditions == (('ifdef', 'HAS_MOUSE_KEYS', False),)
+    (region,) = scan['conditionals']
+    assert (region.start_line, region.else_line, region.end_line) == (2, 4, 6)
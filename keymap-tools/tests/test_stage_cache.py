@@ -0,0 +1,17 @@
+import keymap_pipeline as pk
+
+
+def test_fingerprint_changes_with_the_keymap_drawer_version(monkeypatch):
+    monkeypatch.setattr(pk, '_drawer_version', "0.21.0")
+    installed = pk.script_fingerprint()
+    monkeypatch.setattr(pk, '_drawer_version', "0.22.0")
+    assert pk.script_fingerprint() != installed
+
+
+def test_disabled_cache_never_reuses_outputs(tmp_path):
+    output = tmp_path / "keymap.svg"
+    output.write_text("<svg/>")
+    cache = pk.StageCache(str(tmp_path / "cache"), enabled=False)
+    cache.put("svg", "key", ".svg", "<svg/>")
+    assert cache.get("svg", "key", ".svg") is None
+    assert not cache.outputs_unchanged("inputs")
@@ -0,0 +1,109 @@
+import gzip
+import os
+import re
+from xml.etree import ElementTree
+
+import pytest
+
+import keymap_pipeline as pk
+
+pytest.importorskip("keymap_drawer")
+
+SVG_NAMESPACE = "{http://www.w3.org/2000/svg}"
+GLYPH = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" id="{}"><path d="M12 2 15 9 22 9 16 14 18 21 12 17 6 21 8 14 2 9 9 9z"/></svg>'
+
+KEYMAP_DOCUMENT = {
+    'layout': {'ortho_layout': {'split': False, 'rows': 2, 'columns': 3}},
+    'draw_config': {'glyphs': {'star': GLYPH.format('star'), 'moon': GLYPH.format('moon')}, 'shrink_wide_legends': 5},
+    'layers': {
+        'Base': ['A', 'B', {'t': 'NAV', 'type': 'held'}, 'D', '$$star$$', 'F'],
+        'Nav': ['1', '2', '3', '$$moon$$', '$$star$$', '6'],
+        'Sym': ['!', '@', '#', 'CAPSWORD', '%', 'BOOTLOADER'],
+    },
+    'combos': [{'p': [0, 1], 'k': 'ESC', 'l': ['Nav']}],
+}
+
+
+def test_split_layers_stitch_into_the_whole_keymap_drawing(tmp_path):
+    layers_dir = str(tmp_path / "layers")
+    cache = pk.StageCache(str(tmp_path / "cache"))
+    svg, layer_paths = pk.draw_layers_split(KEYMAP_DOCUMENT, layers_dir, cache, "test", jobs=1)
+
+    assert [os.path.basename(path) for path in layer_paths] == ["Base.svg", "Nav.svg", "Sym.svg"]
+    assert svg == pk.drawer_draw(KEYMAP_DOCUMENT, str(tmp_path / "keymap.yaml"))
+
+    # One stylesheet and one set of glyph definitions holding the glyphs of every layer
+    assert svg.count("<style>") == 1
+    assert svg.count("<defs>") == 1
+    assert re.findall(r'<svg id="([^"]+)">', svg) == ["moon", "star"]
+
+    # Each layer group is moved down by the heights of the layers above it
+    drawer = pk.load_keymap_drawer()
+    outer_pad_h = round(pk.drawer_config(drawer, KEYMAP_DOCUMENT).draw_config.outer_pad_h)
+    offsets = [0]
+    for path in layer_paths[:-1]:
+        with open(path) as f:
+            offsets.append(offsets[-1] + pk.split_layer_svg(f.read())['height'] - outer_pad_h)
+    groups = re.findall(r'<g transform="translate\([-\d.]+, ([-\d.]+)\)" class="layer-(\w+)">', svg)
+    assert groups == [(str(y), name) for y, name in zip(offsets, ["Base", "Nav", "Sym"])]
+    assert offsets[-1] > 0
+
+
+def drawn_elements(svg):
+    """(tag, attributes, text) of every drawn element in document order.
+
+    <use>s of the rect symbols optimize_svg() adds are replaced by the rect
+    they place, and styles hoisted into classes are put back inline.
+    """
+    root = ElementTree.fromstring(svg)
+    symbols = {symbol.get('id'): symbol[0] for symbol in root.iter(SVG_NAMESPACE + 'symbol')}
+    hoisted = dict(re.findall(r'\w+\.(s\d+)\{([^}]*)\}', ''.join(root.find(SVG_NAMESPACE + 'style').itertext())))
+    elements = []
+
+    def walk(parent):
+        for element in parent:
+            tag = element.tag.replace(SVG_NAMESPACE, '')
+            if tag in ('defs', 'style'):
+                continue
+            attributes = dict(element.attrib)
+            if tag == 'use' and attributes.get('href', '')[1:] in symbols:
+                rect = symbols[attributes['href'][1:]]
+                tag, attributes = 'rect', dict(rect.attrib)
+                for axis in ('x', 'y'):
+                    attributes[axis] = float(rect.get(axis, 0)) + float(element.get(axis, 0))
+            for axis in ('x', 'y'):
+                if tag == 'rect' and axis in attributes:
+                    attributes[axis] = f"{float(attributes[axis]):g}"
+            classes = attributes.pop('class', '').split()
+            styles = [hoisted[name] for name in classes if name in hoisted]
+            if 'style' in attributes:
+                styles.append(pk.minify_css(attributes.pop('style').strip().rstrip(';')))
+            if styles:
+                attributes['style'] = ';'.join(styles)
+            classes = [name for name in classes if name not in hoisted]
+            if classes:
+                attributes['class'] = ' '.join(classes)
+            elements.append((tag, attributes, (element.text or '').strip()))
+            walk(element)
+
+    walk(root)
+    return root.attrib, elements
+
+
+def test_optimized_svg_keeps_every_element_and_text(tmp_path):
+    svg = pk.drawer_draw(KEYMAP_DOCUMENT, str(tmp_path / "keymap.yaml"))
+    optimized = pk.optimize_svg(svg)
+    assert len(optimized) < len(svg)
+    assert '<use href="#k0"' in optimized
+    assert 'style="' in svg and 'style="' not in optimized
+
+    original_root, original_elements = drawn_elements(svg)
+    optimized_root, optimized_elements = drawn_elements(optimized)
+    assert optimized_root == original_root
+    assert optimized_elements == original_elements
+    assert [text for _, _, text in optimized_elements if text][:2] == ["Base:", "A"]
+
+    # The glyph definitions survive, and the .svgz copy is the same document
+    assert re.findall(r'<svg id="([^"]+)">', optimized) == ["moon", "star"]
+    svgz = gzip.compress(optimized.encode('utf-8'), compresslevel=9, mtime=0)
+    assert gzip.decompress(svgz).decode('utf-8') == optimized